@@ -0,0 +1,348 @@
+import gzip
+import json
+import re
+from datetime import date
+from functools import wraps
+from flask import Blueprint, request, session, make_response
+
+from db import get_db
+from pagination import trip_page, InvalidCursor, TRIP_SORTS, DEFAULT_TRIP_SORT
+from starter import visible_trips_clause
+from sync import changes_since, parse_token, InvalidToken
+from geo import markers, InvalidBox
+from intervals import month_calendar, trips_during, on_this_day, parse_month, InvalidDate
+
+# ============================================================================
+# JSON API (v1)
+# ============================================================================
+#
+# The mobile client used to scrape the HTML pages, one request per trip. The
+# API serves the same Trips / Journal / Album rows as JSON:
+#
+#   GET /api/v1/trips?sort=date_desc&after=<cursor>&limit=50&include=journal,photos
+#   GET /api/v1/trips/batch?ids=4,8,15,16&include=journal,photos
+#   GET /api/v1/trips/<trip_id>?include=journal
+#   GET /api/v1/sync?since=<token>          (changes since the last sync, see sync.py)
+#   GET /api/v1/map?bbox=<w>,<s>,<e>,<n>&zoom=<z>   (clustered trip markers, see geo.py)
+#   GET /api/v1/calendar?month=2024-06       (a month of trips / journal entries, see intervals.py)
+#   GET /api/v1/trips/during?start=2024-06-01&end=2024-06-09   (end optional: where was I on X)
+#   GET /api/v1/on-this-day?date=2025-06-01
+#
+# Trips come in keyset pages (same cursors as the home page). Whatever the
+# number of trips, a response costs one query per table: the trip ids are
+# passed as a single JSON array and joined with json_each(), so there are no
+# per-trip queries and no IN (?, ?, ...) lists to build.
+#
+# fields[trips]=trip_location,rating (or just fields=), fields[journal]= and
+# fields[photos]= pick the columns sent back - and only those are selected,
+# plus the id (trip_id / journal_id / photo_id), which always comes back.
+# Responses are compact JSON, gzipped whenever the client accepts it.
+#
+# Signed in with the normal session cookie (POST /login); 401 otherwise.
+
+API_PREFIX = '/api/v1'
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_IDS = 200
+GZIP_MIN_BYTES = 512  # smaller bodies aren't worth the CPU (or grow)
+GZIP_LEVEL = 6
+
+# resource -> fields that can be requested (all of them by default)
+FIELDS = {
+    'trips': ('trip_id', 'trip_location', 'trip_start', 'trip_end', 'trip_image', 'trip_description', 'rating'),
+    'journal': ('journal_id', 'entry_date', 'journal_entry'),
+    'photos': ('photo_id', 'photo_path', 'photo_alt', 'date_added'),
+}
+INCLUDES = ('journal', 'photos')
+
+# Child rows: table, id column, order within a trip (the same as the pages)
+CHILDREN = {
+    'journal': ('Journal', 'journal_id', 'entry_date DESC, journal_id DESC'),
+    'photos': ('Album', 'photo_id', 'date_added DESC, photo_id DESC'),
+}
+
+api = Blueprint('api', __name__, url_prefix=API_PREFIX)
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# Compact JSON response (no spaces, whatever the app's debug setting)
+def json_response(payload, status=200):
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+    response = make_response(body, status)
+    response.content_type = 'application/json'
+    return response
+
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return json_response({'error': 'Not signed in'}, 401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@api.errorhandler(ApiError)
+def api_error(e):
+    return json_response({'error': e.message}, e.status)
+
+
+# Gzip every API response the client can take gzipped
+@api.after_request
+def compress(response):
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or not request.accept_encodings['gzip']):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# ============================================================================
+# QUERY PARAMETERS
+# ============================================================================
+
+# Requested fields of a resource (fields[trips]= or fields= for trips), id first
+def _fields(resource):
+    raw = request.args.get(f'fields[{resource}]')
+    if raw is None and resource == 'trips':
+        raw = request.args.get('fields')
+    if raw is None:
+        return FIELDS[resource]
+    fields = tuple(dict.fromkeys(field.strip() for field in raw.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in FIELDS[resource]]
+    if unknown:
+        raise ApiError(f'Unknown {resource} field(s): {", ".join(unknown)}')
+    return tuple(dict.fromkeys((FIELDS[resource][0], *fields)))
+
+
+def _includes():
+    includes = tuple(name.strip() for name in request.args.get('include', '').split(',') if name.strip())
+    unknown = [name for name in includes if name not in INCLUDES]
+    if unknown:
+        raise ApiError(f'Unknown include(s): {", ".join(unknown)}')
+    return includes
+
+
+def _int_arg(name, default, maximum):
+    value = request.args.get(name, str(default))
+    if not value.isdigit() or not 1 <= int(value) <= maximum:
+        raise ApiError(f'{name} must be a number from 1 to {maximum}')
+    return int(value)
+
+
+def _ids():
+    raw = request.args.get('ids', '')
+    if not re.fullmatch(r'\d+(,\d+)*', raw):
+        raise ApiError('ids must be a comma-separated list of trip ids')
+    ids = list(dict.fromkeys(int(trip_id) for trip_id in raw.split(',')))
+    if len(ids) > MAX_BATCH_IDS:
+        raise ApiError(f'At most {MAX_BATCH_IDS} ids per batch')
+    return ids
+
+
+# ============================================================================
+# BATCHED READS
+# ============================================================================
+
+def _trip_json(row, fields):
+    return {field: row[field] for field in fields}
+
+
+# The visible trips among `ids`, in the order asked for (one query)
+def _trips_by_id(conn, user_id, ids, fields):
+    visible, params = visible_trips_clause(conn, user_id)
+    rows = conn.execute(f'''
+        SELECT {', '.join(dict.fromkeys(('trip_id', *fields)))}
+        FROM Trips
+        WHERE trip_id IN (SELECT value FROM json_each(?)) AND {visible}
+    ''', (json.dumps(ids), *params)).fetchall()
+    by_id = {row['trip_id']: row for row in rows}
+    return [by_id[trip_id] for trip_id in ids if trip_id in by_id]
+
+
+# Children of many trips at once: {trip_id: [row, ...]} (one query per table)
+def _children(conn, name, trip_ids, fields):
+    table, id_column, order = CHILDREN[name]
+    columns = ', '.join(f'{table}.{column}' for column in dict.fromkeys((id_column, *fields)))
+    rows = conn.execute(f'''
+        SELECT {table}.trip_id AS parent_trip_id, {columns}
+        FROM json_each(?) AS ids
+        JOIN {table} ON {table}.trip_id = ids.value
+        ORDER BY {table}.trip_id, {order}
+    ''', (json.dumps(trip_ids),)).fetchall()
+    grouped = {trip_id: [] for trip_id in trip_ids}
+    for row in rows:
+        grouped[row['parent_trip_id']].append({field: row[field] for field in fields})
+    return grouped
+
+
+# Trip rows -> JSON, with the included children attached
+def _with_children(conn, trips, fields, includes):
+    trip_ids = [trip['trip_id'] for trip in trips]
+    children = {name: _children(conn, name, trip_ids, _fields(name)) for name in includes} if trip_ids else {}
+    data = []
+    for trip in trips:
+        item = _trip_json(trip, fields)
+        for name in includes:
+            item[name] = children[name][trip['trip_id']]
+        data.append(item)
+    return data
+
+
+# ============================================================================
+# ROUTES
+# ============================================================================
+
+# READ: ONE PAGE OF THE USER'S TRIPS
+@api.route('/trips')
+@api_login_required
+def list_trips():
+    sort_by = request.args.get('sort', DEFAULT_TRIP_SORT)
+    if sort_by not in TRIP_SORTS:
+        raise ApiError(f'sort must be one of: {", ".join(TRIP_SORTS)}')
+    fields, includes = _fields('trips'), _includes()
+    limit = _int_arg('limit', DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+    conn = get_db()
+    user_id = session['user_id']
+    try:
+        trips, next_cursor = trip_page(conn, user_id, sort_by, request.args.get('after'), limit,
+                                       visible=visible_trips_clause(conn, user_id), columns=fields)
+    except InvalidCursor:
+        raise ApiError('Invalid page cursor')
+    return json_response({'data': _with_children(conn, trips, fields, includes), 'next': next_cursor})
+
+
+# READ: MANY TRIPS (WITH THEIR JOURNAL ENTRIES AND PHOTOS) IN ONE REQUEST
+@api.route('/trips/batch')
+@api_login_required
+def batch_trips():
+    ids = _ids()
+    fields, includes = _fields('trips'), _includes()
+
+    conn = get_db()
+    trips = _trips_by_id(conn, session['user_id'], ids, fields)
+    found = {trip['trip_id'] for trip in trips}
+    return json_response({'data': _with_children(conn, trips, fields, includes),
+                          'missing': [trip_id for trip_id in ids if trip_id not in found]})
+
+
+# READ: ONE TRIP
+@api.route('/trips/<int:trip_id>')
+@api_login_required
+def get_trip(trip_id):
+    fields, includes = _fields('trips'), _includes()
+
+    conn = get_db()
+    trips = _trips_by_id(conn, session['user_id'], [trip_id], fields)
+    if not trips:
+        raise ApiError('Trip not found', 404)
+    return json_response({'data': _with_children(conn, trips, fields, includes)[0]})
+
+
+# READ: WHAT CHANGED SINCE THE LAST SYNC (UPSERTED ROWS + TOMBSTONES)
+@api.route('/sync')
+@api_login_required
+def sync():
+    try:
+        since = parse_token(request.args.get('since'))
+    except InvalidToken:
+        raise ApiError('Invalid sync token')
+    # Journal entries and photos say which trip they belong to
+    fields = {'trips': _fields('trips'),
+              'journal': ('trip_id', *_fields('journal')),
+              'photos': ('trip_id', *_fields('photos'))}
+    return json_response(changes_since(get_db(), session['user_id'], since, fields))
+
+
+# READ: CLUSTERED TRIP MARKERS INSIDE THE MAP'S BOUNDING BOX
+@api.route('/map')
+@api_login_required
+def trip_map():
+    try:
+        west, south, east, north = (float(value) for value in request.args.get('bbox', '').split(','))
+    except ValueError:
+        raise ApiError('bbox must be west,south,east,north')
+    zoom = request.args.get('zoom', '')
+    if not zoom.isdigit():
+        raise ApiError('zoom must be a whole number')
+    try:
+        data = markers(get_db(), session['user_id'], west, south, east, north, int(zoom))
+    except InvalidBox as e:
+        raise ApiError(str(e))
+    return json_response({'data': data})
+
+
+# ============================================================================
+# CALENDAR (SEE intervals.py)
+# ============================================================================
+
+def _calendar_trip(row):
+    return {'trip_id': row['trip_id'], 'trip_location': row['trip_location'],
+            'trip_start': row['trip_start'], 'trip_end': row['trip_end']}
+
+
+def _calendar_entry(row):
+    return {'journal_id': row['journal_id'], 'trip_id': row['trip_id'], 'entry_date': row['entry_date']}
+
+
+# READ: ONE MONTH - ITS TRIPS, JOURNAL ENTRIES AND WHAT'S ON EACH DAY
+@api.route('/calendar')
+@api_login_required
+def calendar_month():
+    try:
+        year, month = parse_month(request.args.get('month', ''))
+    except InvalidDate:
+        raise ApiError('month must be YYYY-MM')
+    cal = month_calendar(get_db(), session['user_id'], year, month)
+    days = {}
+    for week in cal['weeks']:
+        for cell in week:
+            if cell['in_month'] and (cell['trips'] or cell['entries']):
+                days[cell['date'].isoformat()] = {'trips': [trip['trip_id'] for trip in cell['trips']],
+                                                  'journal': [entry['journal_id'] for entry in cell['entries']]}
+    return json_response({'data': {'trips': [_calendar_trip(row) for row in cal['trips']],
+                                   'journal': [_calendar_entry(row) for row in cal['entries']],
+                                   'days': days}})
+
+
+# READ: TRIPS BETWEEN TWO DATES (OVERLAP CHECK), OR ON ONE DATE
+@api.route('/trips/during')
+@api_login_required
+def trips_between():
+    try:
+        trips = trips_during(get_db(), session['user_id'], request.args.get('start', ''), request.args.get('end'))
+    except InvalidDate:
+        raise ApiError('start and end must be dates (YYYY-MM-DD)')
+    return json_response({'data': [_calendar_trip(row) for row in trips]})
+
+
+# READ: TRIPS AND JOURNAL ENTRIES FROM THIS DATE IN EARLIER YEARS
+@api.route('/on-this-day')
+@api_login_required
+def memories():
+    try:
+        today = date.fromisoformat(request.args['date']) if 'date' in request.args else None
+    except ValueError:
+        raise ApiError('date must be YYYY-MM-DD')
+    data = []
+    for row in on_this_day(get_db(), session['user_id'], today):
+        item = _calendar_entry(row) if row['journal_id'] else _calendar_trip(row)
+        item['years_ago'] = row['years_ago']
+        data.append(item)
+    return json_response({'data': data})
+
+
+def init_app(app):
+    app.register_blueprint(api)
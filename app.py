@@ -1,9 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, get_template_attribute, make_response
 import sqlite3
-from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+from db import get_db, init_app as init_db
+from migrations import init_app as init_migrations
+from pagination import trip_page, InvalidCursor, DEFAULT_TRIP_SORT, TRIPS_PER_PAGE
+from images import image_sources
+from blobs import collect_garbage
+from jobs import init_app as init_jobs, queue_upload, queue_files, job_status, placeholder_job_id, QueueFull
+from starter import visible_trips_clause, get_visible_trip, is_visible, own_trip, hide
+from cache import init_app as init_cache, get_cache, page_key, invalidate_trips
+from versions import home_version, trip_version, build_time, stamp
+from search import search, RESULTS_PER_PAGE
+from stats import dashboard
+from intervals import month_calendar, on_this_day, parse_month, InvalidDate, EXCERPT_CHARS
+from profiling import init_app as init_profiling, render_metrics
+from assets import init_app as init_assets
+from idempotency import idempotent
+from api import init_app as init_api
+from archive import plan_export, export_response, import_archive, InvalidArchive
+from media import init_app as init_media
+from geo import locate_trip
+from duplicates import trip_duplicates, MAX_DISTANCE
+from passwords import init_app as init_passwords, hash_password, verify_password, PoolBusy, RETRY_AFTER
 import os
-import time
+import json
+import mimetypes
+import zipfile
+import calendar
+from datetime import date
 from functools import wraps
 
 # ============================================================================
@@ -20,8 +43,68 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Database (one pooled connection per request, see db.py)
+app.config['DATABASE'] = os.environ.get('TRIPTROVE_DATABASE', 'part_a.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('TRIPTROVE_DB_POOL_SIZE', 8))
+init_db(app)
+init_migrations(app)  # bring the schema up to date (PRAGMA user_version)
+
+# Opt-in request profiling: SQL / template / upload timings in a Server-Timing
+# header and on /metrics, slow queries logged with their plan (see profiling.py)
+app.config['PROFILING'] = os.environ.get('TRIPTROVE_PROFILING') == '1'
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('TRIPTROVE_SLOW_QUERY_MS', 100))
+init_profiling(app)
+
+# Password hashing runs on a small process pool, never the request thread;
+# logins past PASSWORD_QUEUE_SIZE get a 429 (see passwords.py)
+app.config['PASSWORD_METHOD'] = os.environ.get('TRIPTROVE_PASSWORD_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('TRIPTROVE_PASSWORD_WORKERS', 2))
+app.config['PASSWORD_QUEUE_SIZE'] = int(os.environ.get('TRIPTROVE_PASSWORD_QUEUE_SIZE', 16))
+init_passwords(app)
+
+# Home page trips per page (keyset pagination, see pagination.py)
+app.config['TRIPS_PER_PAGE'] = TRIPS_PER_PAGE
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Background upload processing (see jobs.py)
+app.config['UPLOAD_QUEUE_FOLDER'] = 'upload_queue'
+app.config['UPLOAD_WORKERS'] = int(os.environ.get('TRIPTROVE_UPLOAD_WORKERS', 2))
+app.config['UPLOAD_QUEUE_SIZE'] = int(os.environ.get('TRIPTROVE_UPLOAD_QUEUE_SIZE', 500))
+
+# Album bulk uploads (several photos, or a zip of photos, in one POST)
+app.config['BULK_UPLOAD_MAX_FILES'] = 200
+app.config['BULK_UPLOAD_MAX_LENGTH'] = 512 * 1024 * 1024  # 512MB per bulk upload
+app.config['IMPORT_MAX_LENGTH'] = 4 * 1024 * 1024 * 1024  # 4GB per account import (see archive.py)
+init_jobs(app)
+
+# Rendered trip / journal / album pages, kept until the trip changes (see cache.py)
+app.config['RENDER_CACHE_MAX_BYTES'] = int(os.environ.get('TRIPTROVE_RENDER_CACHE_BYTES', 32 * 1024 * 1024))
+init_cache(app)
+
+# Conditional GET: pages carry an ETag / Last-Modified from the database's
+# modification counters (see versions.py) plus the build they were rendered by
+app.config['BUILD_TIME'] = build_time(__file__, app.template_folder,
+                                     os.path.join(app.static_folder, 'css'), os.path.join(app.static_folder, 'js'))
+
+# One minified, fingerprinted CSS bundle, served as immutable (see assets.py)
+init_assets(app)
+
+# Web app manifest (the PWA install metadata in static/)
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+
+# JSON API for the mobile client: /api/v1/... (see api.py)
+init_api(app)
+
+# Templates pick thumbnails with image_sources() (see images.py / macros.html)
+app.jinja_env.globals['image_sources'] = image_sources
+
+# Uploaded photos only go to users who can see them: /media/... (see media.py).
+# Behind nginx, set TRIPTROVE_MEDIA_OFFLOAD=x-accel-redirect (or x-sendfile
+# for Apache / lighttpd) so the web server sends the file.
+app.config['MEDIA_OFFLOAD'] = os.environ.get('TRIPTROVE_MEDIA_OFFLOAD') or None
+init_media(app)
+
 
 # ============================================================================
 # HELPER FUNCTIONS
@@ -31,6 +114,46 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+# Hand an uploaded image to the background workers (see jobs.py). Returns the
+# placeholder path to store in the database; the worker swaps in the real one.
+def save_upload(file, previous_path=None):
+    return queue_upload(get_db(), file, session['user_id'], previous_path)
+
+
+# Upload queue is full: ask the browser to try again shortly
+@app.errorhandler(QueueFull)
+def upload_queue_full(e):
+    return "Too many uploads are being processed right now. Please try again in a moment.", 503, {'Retry-After': '5'}
+
+
+# Password pool full: too many sign-ins at once
+@app.errorhandler(PoolBusy)
+def password_pool_busy(e):
+    return "Too many people are signing in right now. Please try again in a moment.", 429, {'Retry-After': str(RETRY_AFTER)}
+
+
+# Open an uploaded zip of photos (None if it isn't a zip)
+def open_photo_zip(file):
+    try:
+        return zipfile.ZipFile(file.stream)
+    except zipfile.BadZipFile:
+        return None
+
+
+# (member, reason it was skipped or None) for each file inside a zip
+def photos_in_zip(archive):
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+            continue
+        if not allowed_file(name):
+            yield info, 'Invalid file type'
+        elif info.file_size > app.config['MAX_CONTENT_LENGTH']:
+            yield info, 'File is larger than 16MB'
+        else:
+            yield info, None
+
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -41,6 +164,68 @@ def login_required(f):
     return decorated_function
 
 
+# Answer 304 Not Modified if the browser's copy is still current, before the
+# route queries or renders anything. `version` is one of versions.py's functions.
+def conditional(version):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(**kwargs):
+            if request.method != 'GET':
+                return f(**kwargs)
+            
+            token = version(get_db(), session['user_id'], **kwargs)
+            if token is None:
+                return f(**kwargs)  # let the route answer (e.g. 404)
+            etag, last_modified = stamp(token, app.config['BUILD_TIME'])
+            
+            # If-None-Match wins when both are sent (RFC 9110)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(f(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'  # always revalidate
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
+
+
+# Serve a trip page from the render cache (see cache.py). Only successful GETs
+# are stored; X-Cache says whether the database was skipped.
+def cached_page(f):
+    @wraps(f)
+    def decorated_function(trip_id):
+        if request.method != 'GET':
+            return f(trip_id)
+        
+        cache = get_cache()
+        key = page_key(session['user_id'], f.__name__, trip_id, request.args.get('sort'))
+        html = cache.get(key)
+        if html is not None:
+            response = make_response(html)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        
+        generation = cache.generation(trip_id)
+        result = f(trip_id)
+        if not isinstance(result, str):
+            return result  # error or redirect
+        cache.put(key, result, generation)
+        response = make_response(result)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return decorated_function
+
+
 # ============================================================================
 # AUTHENTICATION ROUTES
 # ============================================================================
@@ -52,15 +237,19 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        conn = sqlite3.connect('part_a.db')
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('SELECT * FROM Users WHERE username = ?', (username,))
         user = cursor.fetchone()
-        conn.close()
         
-        if user and check_password_hash(user['password'], password):
+        # Checked on the password pool; a hash made with old parameters comes back upgraded
+        matches, rehashed = verify_password(user['password'] if user else None, password or '')
+        if matches:
+            if rehashed:
+                cursor.execute('UPDATE Users SET password = ? WHERE user_id = ? AND password = ?',
+                               (rehashed, user['user_id'], user['password']))
+                conn.commit()
             session['user_id'] = user['user_id']
             session['username'] = user['username']
             return redirect(url_for('index'))
@@ -81,63 +270,27 @@ def register():
         if password != confirm_password:
             return render_template('login.html', error='Passwords do not match', show_register=True)
         
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password or '')
         
-        conn = sqlite3.connect('part_a.db')
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('INSERT INTO Users (username, password) VALUES (?, ?)',
+            # Starter trips are shared, not copied: the user gets their own
+            # copy of one only when they first change it (see starter.py)
+            cursor.execute('INSERT INTO Users (username, password, starter_content) VALUES (?, ?, 1)',
                          (username, hashed_password))
             conn.commit()
             
             # Get the new user's ID
             user_id = cursor.lastrowid
             
-            # COPY STARTER TRIPS FROM USER_ID 1 TO NEW USER
-            cursor.execute('''
-                INSERT INTO Trips (trip_location, trip_start, trip_end, trip_image, trip_description, rating, user_id)
-                SELECT trip_location, trip_start, trip_end, trip_image, trip_description, rating, ?
-                FROM Trips
-                WHERE user_id = 1
-            ''', (user_id,))
-            
-            # Copy journal entries for the new trips
-            cursor.execute('SELECT trip_id FROM Trips WHERE user_id = ? ORDER BY trip_id', (user_id,))
-            new_trip_ids = [row[0] for row in cursor.fetchall()]
-            
-            cursor.execute('SELECT trip_id FROM Trips WHERE user_id = 1 ORDER BY trip_id')
-            old_trip_ids = [row[0] for row in cursor.fetchall()]
-            
-            # Copy journal entries
-            for old_id, new_id in zip(old_trip_ids, new_trip_ids):
-                cursor.execute('''
-                    INSERT INTO Journal (entry_date, journal_entry, trip_id)
-                    SELECT entry_date, journal_entry, ?
-                    FROM Journal
-                    WHERE trip_id = ?
-                ''', (new_id, old_id))
-            
-            # Copy album photos
-            for old_id, new_id in zip(old_trip_ids, new_trip_ids):
-                cursor.execute('''
-                    INSERT INTO Album (photo_path, photo_alt, trip_id, date_added)
-                    SELECT photo_path, photo_alt, ?, date_added
-                    FROM Album
-                    WHERE trip_id = ?
-                ''', (new_id, old_id))
-            
-            conn.commit()
-            conn.close()
-            
             # Log them in automatically
             session['user_id'] = user_id
             session['username'] = username
             
             return redirect(url_for('index'))
         except sqlite3.IntegrityError:
-            conn.close()
             return render_template('login.html', error='Username already exists', show_register=True)
     
     return render_template('login.html', show_register=True)
@@ -154,56 +307,59 @@ def logout():
 # TRIPS
 # ============================================================================
 
-# READ: HOME PAGE (DISPLAY ALL TRIPS)
+# READ: HOME PAGE (FIRST PAGE OF TRIPS, MORE ARE LOADED WHILE SCROLLING)
 @app.route('/')
 @login_required
+@conditional(home_version)
 def index():
-    # Get sort parameter
-    sort_by = request.args.get('sort', 'id_desc')
+    # Get sort parameter (and the page cursor if JS is off and "Load more" was clicked)
+    sort_by = request.args.get('sort', DEFAULT_TRIP_SORT)
+    after = request.args.get('after')
     
-    # Connect to database
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    # Fetch one page of trips for logged-in user only (see pagination.py for sort orders)
+    conn = get_db()
+    try:
+        trips, next_cursor = trip_page(conn, session['user_id'], sort_by, after,
+                                       app.config['TRIPS_PER_PAGE'],
+                                       visible=visible_trips_clause(conn, session['user_id']))
+    except InvalidCursor:
+        return "Invalid page cursor", 400
     
-    # Determine sort order (based on option selected by user)
-    if sort_by == 'date_asc':
-        order_clause = 'ORDER BY trip_start ASC'
-    elif sort_by == 'date_desc':
-        order_clause = 'ORDER BY trip_start DESC'
-    elif sort_by == 'id_asc':
-        order_clause = 'ORDER BY trip_id ASC'
-    elif sort_by == 'id_desc':
-        order_clause = 'ORDER BY trip_id DESC'
-    elif sort_by == 'location_asc':
-        order_clause = 'ORDER BY trip_location COLLATE NOCASE ASC'
-    elif sort_by == 'rating_asc':
-        order_clause = 'ORDER BY rating ASC, trip_id DESC'
-    elif sort_by == 'rating_desc':
-        order_clause = 'ORDER BY rating DESC, trip_id DESC'
-    else:
-        order_clause = 'ORDER BY trip_id DESC'
+    # Dashboard header: precomputed totals, not aggregated per request (see stats.py)
+    stats = dashboard(conn, session['user_id'])
+    
+    return render_template('index.html', trips=trips, sort_by=sort_by, next_cursor=next_cursor, stats=stats)
+
+
+# READ: NEXT PAGE OF TRIPS (JSON, USED BY INFINITE SCROLL ON HOME PAGE)
+@app.route('/trips/page')
+@login_required
+@conditional(home_version)
+def trips_page():
+    sort_by = request.args.get('sort', DEFAULT_TRIP_SORT)
+    after = request.args.get('after')
     
-    # Fetch trips for logged-in user only
-    query = f'SELECT * FROM Trips WHERE user_id = ? {order_clause}'
-    cursor.execute(query, (session['user_id'],))
-    all_trips = cursor.fetchall()
-    conn.close()
+    conn = get_db()
+    try:
+        trips, next_cursor = trip_page(conn, session['user_id'], sort_by, after,
+                                       app.config['TRIPS_PER_PAGE'],
+                                       visible=visible_trips_clause(conn, session['user_id']))
+    except InvalidCursor:
+        return jsonify(error='Invalid page cursor'), 400
     
-    return render_template('index.html', trips=all_trips)
+    # Cards are rendered with the same partial as the home page
+    html = ''.join(render_template('trip_card.html', trip=trip) for trip in trips)
+    return jsonify(html=html, count=len(trips), next=next_cursor)
 
 
 # READ: VIEW INDIVIDUAL TRIP DETAILS
 @app.route('/trip/<int:trip_id>')
 @login_required
+@conditional(trip_version)
+@cached_page
 def trip(trip_id):
-    # Get trip details
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
-    trip = cursor.fetchone()
-    conn.close()
+    # Get trip details (the user's own, or a shared starter trip)
+    trip = get_visible_trip(get_db(), trip_id, session['user_id'])
     
     if trip is None:
         return "Trip not found", 404
@@ -222,6 +378,14 @@ def create():
         trip_end = request.form.get('trip_end')
         trip_description = request.form.get('trip_description')
         rating = request.form.get('rating')
+
+        # Validate rating
+        try:
+            rating_int = int(rating)
+            if rating_int < 1 or rating_int > 5:
+                return "Rating must be between 1 and 5.", 400
+        except (ValueError, TypeError):
+            return "Invalid rating. Please select a rating.", 400
         
         # Handle image upload
         if 'trip_image' not in request.files:
@@ -233,23 +397,21 @@ def create():
             return "No file selected", 400
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filename = f"{int(time.time())}_{filename}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            trip_image = f"uploads/{filename}"
+            trip_image = save_upload(file)
         else:
             return "Invalid file type. Please upload PNG, JPG, JPEG, GIF, or WEBP", 400
 
         # Insert into database with user_id
-        conn = sqlite3.connect('part_a.db')
+        conn = get_db()
         cursor = conn.cursor()
 
         cursor.execute('''
         INSERT INTO Trips (trip_location, trip_start, trip_end, trip_image, trip_description, rating, user_id)
         VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (trip_location, trip_start, trip_end, trip_image, trip_description, rating, session['user_id']))
+        # Map point from the bundled gazetteer (see geo.py)
+        locate_trip(conn, cursor.lastrowid, session['user_id'], trip_location)
         conn.commit()
-        conn.close()
         
         return redirect(url_for('index'))
     
@@ -260,8 +422,7 @@ def create():
 @app.route('/update/<int:trip_id>', methods=['POST','GET'])
 @login_required
 def update(trip_id):
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
 
     if request.method == 'POST':
@@ -277,7 +438,6 @@ def update(trip_id):
         
         # Validate location
         if not re.match(r'^[a-zA-Z\s,.-]+$', trip_location):
-            conn.close()
             return "Invalid location format. Only letters, spaces, commas, periods, and hyphens allowed.", 400
         
         # Validate dates
@@ -285,43 +445,40 @@ def update(trip_id):
             start = datetime.strptime(trip_start, '%Y-%m-%d')
             end = datetime.strptime(trip_end, '%Y-%m-%d')
             if end < start:
-                conn.close()
                 return "End date must be after start date.", 400
         except ValueError:
-            conn.close()
             return "Invalid date format.", 400
         
         # Validate description length
         if trip_description and len(trip_description) > 250:
-            conn.close()
             return "Description must be 250 characters or less.", 400
         
         # Validate rating
         try:
             rating_int = int(rating)
             if rating_int < 1 or rating_int > 5:
-                conn.close()
                 return "Rating must be between 1 and 5.", 400
         except (ValueError, TypeError):
-            conn.close()
             return "Invalid rating. Please select a rating.", 400
 
+        # Editing a shared starter trip gives the user their own copy first
+        owned = own_trip(conn, trip_id, session['user_id'])
+        if owned is None:
+            return "Trip not found", 404
+        owned_from, trip_id = trip_id, owned[0]
+
+        # Existing image (kept unless a new one was uploaded)
+        cursor.execute('SELECT trip_image FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
+        result = cursor.fetchone()
+        trip_image = result['trip_image'] if result else None
+
         # Handle image upload
         if 'trip_image' in request.files and request.files['trip_image'].filename != '':
             file = request.files['trip_image']
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filename = f"{int(time.time())}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                trip_image = f"uploads/{filename}"
+                trip_image = save_upload(file, previous_path=trip_image)
             else:
-                conn.close()
                 return "Invalid file type. Please upload PNG, JPG, JPEG, GIF, or WEBP", 400
-        else:
-            # Keep existing image
-            cursor.execute('SELECT trip_image FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
-            result = cursor.fetchone()
-            trip_image = result['trip_image'] if result else None
 
         # Update database
         cursor.execute('''
@@ -334,16 +491,15 @@ def update(trip_id):
                 rating = ?
             WHERE trip_id = ? AND user_id = ?
         ''', (trip_location, trip_start, trip_end, trip_image, trip_description, rating, trip_id, session['user_id']))
+        locate_trip(conn, trip_id, session['user_id'], trip_location)
 
         conn.commit()
-        conn.close()
+        invalidate_trips(owned_from, trip_id)
         return redirect(url_for('index'))
     
     else:
         # Get existing trip data
-        cursor.execute('SELECT * FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
-        trip = cursor.fetchone()
-        conn.close()
+        trip = get_visible_trip(conn, trip_id, session['user_id'])
 
         if trip is None:
             return "Trip not found", 404
@@ -355,11 +511,19 @@ def update(trip_id):
 @app.route('/delete/<int:trip_id>')
 @login_required
 def delete(trip_id):
-    conn = sqlite3.connect('part_a.db')
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM Trips WHERE trip_id=? AND user_id=?', (trip_id, session['user_id']))
+    
+    trip = get_visible_trip(conn, trip_id, session['user_id'])
+    if trip is not None and trip['user_id'] != session['user_id']:
+        hide(conn, trip_id, session['user_id'])  # shared starter trip: just stop showing it
+    else:
+        cursor.execute('DELETE FROM Trips WHERE trip_id=? AND user_id=?', (trip_id, session['user_id']))
     conn.commit()
-    conn.close()
+    invalidate_trips(trip_id)
+    
+    # Remove the cover / album files no other trip uses
+    collect_garbage(conn)
     return redirect(url_for('index'))
 
 
@@ -370,17 +534,17 @@ def delete(trip_id):
 # READ: VIEW JOURNAL ENTRIES FOR TRIP
 @app.route('/journal/<int:trip_id>', methods=['GET', 'POST'])
 @login_required
+@idempotent
+@conditional(trip_version)
+@cached_page
 def journal(trip_id):
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Verify trip belongs to user
-    cursor.execute('SELECT * FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
-    trip = cursor.fetchone()
+    # Verify trip belongs to user (or is a shared starter trip)
+    trip = get_visible_trip(conn, trip_id, session['user_id'])
     
     if trip is None:
-        conn.close()
         return "Trip not found", 404
     
     if request.method == 'POST':
@@ -388,12 +552,16 @@ def journal(trip_id):
         entry_date = request.form.get('entry_date')
         journal_entry = request.form.get('journal_entry')
         
+        owned = own_trip(conn, trip_id, session['user_id'])
+        if owned is None:
+            return "Trip not found", 404  # hidden in another tab meanwhile
+        trip_id = owned[0]
         cursor.execute(
             'INSERT INTO Journal (entry_date, journal_entry, trip_id) VALUES (?, ?, ?)',
             (entry_date, journal_entry, trip_id)
         )
         conn.commit()
-        conn.close()
+        invalidate_trips(trip['trip_id'], trip_id)
         
         return redirect(url_for('journal', trip_id=trip_id))
     
@@ -412,8 +580,6 @@ def journal(trip_id):
     query = f'SELECT entry_date, journal_entry, journal_id FROM Journal WHERE trip_id = ? {order_clause}'
     cursor.execute(query, (trip_id,))
     entries = cursor.fetchall()
-    
-    conn.close()
 
     return render_template('journal.html', entries=entries, trip=trip, trip_id=trip_id)
 
@@ -421,14 +587,12 @@ def journal(trip_id):
 # CREATE: NEW JOURNAL ENTRY
 @app.route('/journal/add/<int:trip_id>', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def new_entry(trip_id):
-    # Verify trip belongs to user
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
+    # Verify trip belongs to user (or is a shared starter trip)
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
-    trip = cursor.fetchone()
-    conn.close()
+    trip = get_visible_trip(conn, trip_id, session['user_id'])
     
     if trip is None:
         return "Trip not found", 404
@@ -438,15 +602,18 @@ def new_entry(trip_id):
         entry_date = request.form.get('entry_date')
         journal_entry = request.form.get('journal_entry')
         
-        # Insert into database
-        conn = sqlite3.connect('part_a.db')
-        cursor = conn.cursor()
+        owned = own_trip(conn, trip_id, session['user_id'])
+        if owned is None:
+            return "Trip not found", 404  # hidden in another tab meanwhile
+        trip_id = owned[0]
+        
+        # Insert into database (same pooled connection as the ownership check)
         cursor.execute(
             'INSERT INTO Journal (entry_date, journal_entry, trip_id) VALUES (?, ?, ?)',
             (entry_date, journal_entry, trip_id)
         )
         conn.commit()
-        conn.close()
+        invalidate_trips(trip['trip_id'], trip_id)
         
         return redirect(url_for('journal', trip_id=trip_id))
     
@@ -457,8 +624,7 @@ def new_entry(trip_id):
 @app.route('/journal/update/<int:entry_id>', methods=['GET', 'POST'])
 @login_required
 def update_journal_entry(entry_id):
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     # Verify entry belongs to user's trip
@@ -470,8 +636,7 @@ def update_journal_entry(entry_id):
     ''', (entry_id,))
     entry = cursor.fetchone()
     
-    if entry is None or entry['user_id'] != session['user_id']:
-        conn.close()
+    if entry is None or not is_visible(conn, entry, session['user_id']):
         return "Journal entry not found", 404
     
     if request.method == 'POST':
@@ -479,6 +644,14 @@ def update_journal_entry(entry_id):
         entry_date = request.form.get('entry_date')
         journal_entry = request.form.get('journal_entry')
         
+        # Entry on a shared starter trip: edit the user's own copy of it
+        owned = own_trip(conn, entry['trip_id'], session['user_id'])
+        if owned is None:
+            return "Journal entry not found", 404  # hidden in another tab meanwhile
+        trip_id, journal_map, _ = owned
+        copied = trip_id != entry['trip_id']
+        entry_id = journal_map.get(entry_id, entry_id)
+        
         # Update database
         cursor.execute('''
             UPDATE Journal 
@@ -487,21 +660,19 @@ def update_journal_entry(entry_id):
         ''', (entry_date, journal_entry, entry_id))
         
         conn.commit()
-        conn.close()
+        invalidate_trips(entry['trip_id'], trip_id)
         
-        # Return success for AJAX requests
+        # Return success for AJAX requests (telling the page to reload if the
+        # trip was just copied, since its entry ids have changed)
         if request.headers.get('Content-Type') == 'application/x-www-form-urlencoded':
+            if copied:
+                return '', 200, {'X-Redirect-To': url_for('journal', trip_id=trip_id)}
             return '', 200
         
-        # Get trip_id for redirect (if not AJAX)
-        trip_id = entry['trip_id']
-        
         return redirect(url_for('journal', trip_id=trip_id))
     
     else:
         # GET request - render form (keep this for fallback)
-        conn.close()
-        
         if entry is None:
             return "Journal entry not found", 404
         
@@ -512,7 +683,7 @@ def update_journal_entry(entry_id):
 @app.route('/journal/delete/<int:entry_id>')
 @login_required
 def delete_journal_entry(entry_id):
-    conn = sqlite3.connect('part_a.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get trip_id and verify ownership before deleting
@@ -524,16 +695,19 @@ def delete_journal_entry(entry_id):
     ''', (entry_id,))
     result = cursor.fetchone()
     
-    if result is None or result[1] != session['user_id']:
-        conn.close()
+    if result is None or not is_visible(conn, result, session['user_id']):
         return "Journal entry not found", 404
     
-    trip_id = result[0]
+    owned = own_trip(conn, result['trip_id'], session['user_id'])
+    if owned is None:
+        return "Journal entry not found", 404  # hidden in another tab meanwhile
+    trip_id, journal_map, _ = owned
+    entry_id = journal_map.get(entry_id, entry_id)
     
     # Delete entry
     cursor.execute('DELETE FROM Journal WHERE journal_id = ?', (entry_id,))
     conn.commit()
-    conn.close()
+    invalidate_trips(result['trip_id'], trip_id)
     
     return redirect(url_for('journal', trip_id=trip_id))
 
@@ -544,17 +718,16 @@ def delete_journal_entry(entry_id):
 # READ: VIEW PHOTO ALBUM FOR TRIP
 @app.route('/album/<int:trip_id>')
 @login_required
+@conditional(trip_version)
+@cached_page
 def album(trip_id):
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get trip details and verify ownership
-    cursor.execute('SELECT * FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
-    trip = cursor.fetchone()
+    # Get trip details and verify ownership (or a shared starter trip)
+    trip = get_visible_trip(conn, trip_id, session['user_id'])
     
     if trip is None:
-        conn.close()
         return "Trip not found", 404
     
     # Get ALL photos for this trip, ordered by most recent first (NO LIMIT)
@@ -565,81 +738,150 @@ def album(trip_id):
     ''', (trip_id,))
     photos = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('album.html', trip=trip, trip_id=trip_id, photos=photos)
 
 
-# CREATE: UPLOAD PHOTO TO ALBUM
+# READ: PHOTOS IN THIS ALBUM THAT LOOK LIKE OTHER PHOTOS (RESIZED / RE-SAVED COPIES)
+@app.route('/album/<int:trip_id>/duplicates')
+@login_required
+def album_duplicates(trip_id):
+    conn = get_db()
+    trip = get_visible_trip(conn, trip_id, session['user_id'])
+    
+    if trip is None:
+        return "Trip not found", 404
+    
+    # Perceptual hash lookups, a few index probes per photo (see duplicates.py)
+    groups = trip_duplicates(conn, session['user_id'], trip_id)
+    return render_template('duplicates.html', trip=trip, trip_id=trip_id, groups=groups, max_distance=MAX_DISTANCE)
+
+
+# CREATE: UPLOAD PHOTOS TO ALBUM (ONE, MANY, OR A ZIP OF PHOTOS)
 @app.route('/album/<int:trip_id>/upload', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def upload_photo(trip_id):
-    # Verify trip ownership
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
+    # Several photos in one POST can be much bigger than a single upload
+    request.max_content_length = app.config['BULK_UPLOAD_MAX_LENGTH']
+    
+    # Verify trip ownership (once for the whole batch)
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Trips WHERE trip_id = ? AND user_id = ?', (trip_id, session['user_id']))
-    trip = cursor.fetchone()
+    trip = get_visible_trip(conn, trip_id, session['user_id'])
     
     if trip is None:
-        conn.close()
         return "Trip not found", 404
     
     if request.method == 'POST':
         if 'photo' not in request.files:
-            conn.close()
             return "No file uploaded", 400
         
-        file = request.files['photo']
+        uploads = [file for file in request.files.getlist('photo') if file.filename != '']
         
-        if file.filename == '':
-            conn.close()
+        if not uploads:
             return "No file selected", 400
         
-        if file and allowed_file(file.filename):
-            # Get alt text from form
-            photo_alt = request.form.get('photo_alt', '').strip()
-            if not photo_alt:
-                photo_alt = 'Travel photo'
+        # Collect every photo (zips are unpacked), noting what happens to each file
+        files, results, archives = [], [], []
+        try:
+            for file in uploads:
+                if file.filename.lower().endswith('.zip'):
+                    archive = open_photo_zip(file)
+                    if archive is None:
+                        results.append({'file': file.filename, 'status': 'rejected', 'reason': 'Not a valid zip file'})
+                        continue
+                    archives.append(archive)
+                    for info, reason in photos_in_zip(archive):
+                        if reason:
+                            results.append({'file': info.filename, 'status': 'rejected', 'reason': reason})
+                        else:
+                            files.append((os.path.basename(info.filename), archive.open(info)))
+                            results.append({'file': info.filename, 'status': 'queued'})
+                elif allowed_file(file.filename):
+                    files.append((file.filename, file.stream))
+                    results.append({'file': file.filename, 'status': 'queued'})
+                else:
+                    results.append({'file': file.filename, 'status': 'rejected', 'reason': 'Invalid file type'})
             
-            filename = secure_filename(file.filename)
-            filename = f"{int(time.time())}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            photo_path = f"uploads/{filename}"
+            if len(files) > app.config['BULK_UPLOAD_MAX_FILES']:
+                return f"Too many photos: upload at most {app.config['BULK_UPLOAD_MAX_FILES']} at once", 400
             
-            # Get current date
-            from datetime import datetime
-            current_date = datetime.now().strftime('%Y-%m-%d')
+            if not files:
+                return render_template('upload_photo.html', 
+                                     trip_id=trip_id, 
+                                     trip=trip, 
+                                     error='Invalid file type. Please upload PNG, JPG, JPEG, GIF, WEBP or a ZIP of photos')
             
-            # Insert into Album table
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO Album (photo_path, photo_alt, trip_id, date_added)
-                VALUES (?, ?, ?, ?)
-            ''', (photo_path, photo_alt, trip_id, current_date))
-            conn.commit()
-            conn.close()
-            
-            return redirect(url_for('album', trip_id=trip_id))
-        else:
-            conn.close()
-            return render_template('upload_photo.html', 
-                                 trip_id=trip_id, 
-                                 trip=trip, 
-                                 error='Invalid file type. Please upload PNG, JPG, JPEG, GIF, or WEBP')
+            # Copy the files into the upload queue (processed in parallel by jobs.py)
+            placeholders = queue_files(conn, files, session['user_id'])
+        finally:
+            for archive in archives:
+                archive.close()
+        
+        # Get alt text from form
+        photo_alt = request.form.get('photo_alt', '').strip()
+        if not photo_alt:
+            photo_alt = 'Travel photo'
+        
+        # Get current date
+        from datetime import datetime
+        current_date = datetime.now().strftime('%Y-%m-%d')
+        
+        # Photos added to a shared starter trip go on the user's own copy
+        owned = own_trip(conn, trip_id, session['user_id'])
+        if owned is None:
+            return "Trip not found", 404  # hidden in another tab meanwhile
+        trip_id = owned[0]
+        
+        # Insert every photo into Album table in one go (same transaction as the jobs)
+        cursor.executemany('''
+            INSERT INTO Album (photo_path, photo_alt, trip_id, date_added)
+            VALUES (?, ?, ?, ?)
+        ''', [(photo_path, photo_alt, trip_id, current_date) for photo_path in placeholders])
+        conn.commit()
+        invalidate_trips(trip['trip_id'], trip_id)
+        
+        # Upload page script wants the per-file results so it can show progress
+        if request.accept_mimetypes.best == 'application/json':
+            queued = iter(placeholder_job_id(path) for path in placeholders)
+            for result in results:
+                if result['status'] == 'queued':
+                    result['job_id'] = next(queued)
+            return jsonify(trip_id=trip_id, files=results)
+        
+        return redirect(url_for('album', trip_id=trip_id))
     
     # GET request - show upload form
-    conn.close()
     return render_template('upload_photo.html', trip_id=trip_id, trip=trip)
 
 
+# READ: STATUS OF A BACKGROUND UPLOAD (POLLED BY PHOTOS STILL PROCESSING)
+@app.route('/uploads/status/<int:job_id>')
+@login_required
+def upload_status(job_id):
+    job = job_status(get_db(), job_id, session['user_id'])
+    
+    if job is None:
+        return jsonify(error='Upload not found'), 404
+    
+    result = {'status': job['status']}
+    if job['status'] == 'done':
+        # Same markup the page would have rendered for the finished photo
+        picture = get_template_attribute('macros.html', 'picture')
+        result['html'] = str(picture(job['result_path'], request.args.get('alt', ''), request.args.get('sizes', '100vw')))
+        # Looks like photos the user already has (see duplicates.py)
+        if job['duplicates']:
+            result['duplicates'] = json.loads(job['duplicates'])
+    elif job['status'] == 'failed':
+        result['error'] = 'This photo could not be processed.'
+    return jsonify(result)
+
+
 # UPDATE: PHOTO IN ALBUM
 @app.route('/album/update/<int:photo_id>', methods=['GET', 'POST'])
 @login_required
 def update_photo(photo_id):
-    conn = sqlite3.connect('part_a.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     # Verify photo belongs to user's trip
@@ -651,11 +893,17 @@ def update_photo(photo_id):
     ''', (photo_id,))
     photo = cursor.fetchone()
     
-    if photo is None or photo['user_id'] != session['user_id']:
-        conn.close()
+    if photo is None or not is_visible(conn, photo, session['user_id']):
         return "Photo not found", 404
     
     if request.method == 'POST':
+        # Photo on a shared starter trip: change the user's own copy of it
+        owned = own_trip(conn, photo['trip_id'], session['user_id'])
+        if owned is None:
+            return "Photo not found", 404  # hidden in another tab meanwhile
+        trip_id, _, album_map = owned
+        photo_id = album_map.get(photo_id, photo_id)
+        
         # Get alt text from form
         photo_alt = request.form.get('photo_alt', '').strip()
         if not photo_alt:
@@ -666,11 +914,7 @@ def update_photo(photo_id):
             file = request.files['photo']
             
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filename = f"{int(time.time())}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                photo_path = f"uploads/{filename}"
+                photo_path = save_upload(file, previous_path=photo['photo_path'])
                 
                 # Get current date
                 from datetime import datetime
@@ -683,7 +927,6 @@ def update_photo(photo_id):
                     WHERE photo_id = ?
                 ''', (photo_path, photo_alt, current_date, photo_id))
             else:
-                conn.close()
                 return render_template('update_photo.html', 
                                      photo=photo, 
                                      error='Invalid file type. Please upload PNG, JPG, JPEG, GIF, or WEBP')
@@ -696,16 +939,12 @@ def update_photo(photo_id):
             ''', (photo_alt, photo_id))
         
         conn.commit()
-        
-        trip_id = photo['trip_id']
-        conn.close()
+        invalidate_trips(photo['trip_id'], trip_id)
         
         return redirect(url_for('album', trip_id=trip_id))
     
     else:
         # GET request
-        conn.close()
-        
         return render_template('update_photo.html', photo=photo)
 
 
@@ -713,7 +952,7 @@ def update_photo(photo_id):
 @app.route('/album/delete/<int:photo_id>')
 @login_required
 def delete_photo(photo_id):
-    conn = sqlite3.connect('part_a.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Verify ownership and get trip_id before deleting
@@ -725,23 +964,150 @@ def delete_photo(photo_id):
     ''', (photo_id,))
     result = cursor.fetchone()
     
-    if result is None or result[1] != session['user_id']:
-        conn.close()
+    if result is None or not is_visible(conn, result, session['user_id']):
         return "Photo not found", 404
     
-    trip_id = result[0]
+    owned = own_trip(conn, result['trip_id'], session['user_id'])
+    if owned is None:
+        return "Photo not found", 404  # hidden in another tab meanwhile
+    trip_id, _, album_map = owned
+    photo_id = album_map.get(photo_id, photo_id)
     
     # Delete photo
     cursor.execute('DELETE FROM Album WHERE photo_id = ?', (photo_id,))
     conn.commit()
-    conn.close()
+    invalidate_trips(result['trip_id'], trip_id)
+    collect_garbage(conn)  # remove the file if no other photo uses it
     
     return redirect(url_for('album', trip_id=trip_id))
 
 
+# ============================================================================
+# SEARCH
+# ============================================================================
+
+# READ: FULL-TEXT SEARCH OVER THE USER'S TRIPS, JOURNAL ENTRIES AND PHOTO CAPTIONS
+@app.route('/search')
+@login_required
+def search_trips():
+    query = request.args.get('q', '').strip()
+    after = request.args.get('after')
+    
+    # Best matches first (see search.py), one page at a time
+    try:
+        results, next_cursor = search(get_db(), session['user_id'], query, after, RESULTS_PER_PAGE)
+    except InvalidCursor:
+        return "Invalid page cursor", 400
+    
+    return render_template('search.html', query=query, results=results, next_cursor=next_cursor)
+
+
+# ============================================================================
+# CALENDAR
+# ============================================================================
+
+# READ: ONE MONTH OF TRIPS AND JOURNAL ENTRIES, PLUS "ON THIS DAY" MEMORIES
+@app.route('/calendar')
+@login_required
+def trip_calendar():
+    today = date.today()
+    try:
+        year, month = parse_month(request.args.get('month', f'{today.year}-{today.month:02d}'))
+    except InvalidDate:
+        return "Invalid month. Use YYYY-MM.", 400
+    
+    # One interval index query for the month, one for the memories (see intervals.py)
+    conn = get_db()
+    cal = month_calendar(conn, session['user_id'], year, month)
+    memories = on_this_day(conn, session['user_id'], today)
+    
+    previous_month = f'{year - 1}-12' if month == 1 else f'{year}-{month - 1:02d}'
+    next_month = f'{year + 1}-01' if month == 12 else f'{year}-{month + 1:02d}'
+    return render_template('calendar.html', cal=cal, memories=memories, month_name=calendar.month_name[month],
+                           previous_month=previous_month, next_month=next_month, excerpt_chars=EXCERPT_CHARS)
+
+
+# ============================================================================
+# BACKUP (EXPORT / IMPORT, SEE archive.py)
+# ============================================================================
+
+# READ: DOWNLOAD EVERYTHING AS ONE ZIP (STREAMED, RESUMABLE WITH RANGE)
+@app.route('/export')
+@login_required
+def export():
+    plan = plan_export(get_db(), app.config['DATABASE'], session['user_id'], app.static_folder)
+    return export_response(plan, 'triptrove-export.zip')
+
+
+# CREATE: LOAD AN EXPORTED ZIP INTO THIS ACCOUNT
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_trips():
+    if request.method == 'POST':
+        # A whole account's photos: far bigger than any single upload
+        request.max_content_length = app.config['IMPORT_MAX_LENGTH']
+
+        file = request.files.get('archive')
+        if file is None or file.filename == '':
+            return render_template('import.html', error="Please choose an exported .zip file"), 400
+        try:
+            counts = import_archive(get_db(), file, session['user_id'], app.config['UPLOAD_FOLDER'],
+                                    app.static_folder, ALLOWED_EXTENSIONS, app.config['MAX_CONTENT_LENGTH'])
+        except InvalidArchive as e:
+            return render_template('import.html', error=str(e)), 400
+        return render_template('import.html', counts=counts)
+
+    return render_template('import.html')
+
+
+# ============================================================================
+# CACHE STATS AND METRICS
+# ============================================================================
+
+# READ: RENDER CACHE HIT / MISS COUNTERS (THIS PROCESS ONLY)
+@app.route('/cache/stats')
+@login_required
+def cache_stats():
+    return jsonify(get_cache().stats())
+
+
+# READ: PROMETHEUS METRICS (ONLY WITH PROFILING ON, ONLY FROM METRICS_ALLOWED_IPS)
+@app.route('/metrics')
+def metrics():
+    if not app.config['PROFILING'] or request.remote_addr not in app.config['METRICS_ALLOWED_IPS']:
+        return "Not found", 404
+    return render_metrics(app), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# ============================================================================
+# OFFLINE SUPPORT (SERVICE WORKER, SEE templates/sw.js)
+# ============================================================================
+
+# READ: THE SERVICE WORKER (SERVED FROM / SO IT CAN HANDLE EVERY PAGE)
+@app.route('/sw.js')
+def service_worker():
+    precache = [url_for('offline'),
+                url_for('static', filename='css/bundle.css'),
+                url_for('static', filename='js/processing.js'),
+                url_for('static', filename='js/offline.js'),
+                url_for('static', filename='manifest.webmanifest'),
+                url_for('static', filename='icons/icon.svg')]
+    script = render_template('sw.js', version=f"{app.config['BUILD_TIME']:x}", precache=precache)
+    # Always revalidated: a new build must reach browsers straight away
+    return script, 200, {'Content-Type': 'text/javascript; charset=utf-8', 'Cache-Control': 'no-cache'}
+
+
+# READ: SHOWN BY THE SERVICE WORKER WHEN OFFLINE (OR AFTER QUEUEING A WRITE)
+@app.route('/offline')
+def offline():
+    return render_template('offline.html')
+
+
 # ============================================================================
 # RUN APP
 # ============================================================================
 
+# python app.py [--dev] [--workers N] [--threads N] [--keep-alive S] (see serve.py)
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    from serve import main
+    main(app=app)
\ No newline at end of file
@@ -0,0 +1,555 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import uuid
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from flask import Response, request
+
+from starter import visible_trips_clause, STARTER_USER_ID
+from blobs import store_files, release, collect_garbage
+from images import strip_metadata, generate_derivatives, image_sources
+from geo import locate_trips
+
+# ============================================================================
+# ACCOUNT EXPORT / IMPORT (STREAMED ZIP ARCHIVE)
+# ============================================================================
+#
+# GET /export downloads everything the user can see as one zip:
+#
+#   trips.ndjson     one JSON object per line (Trips columns)
+#   journal.ndjson   one per journal entry (with its trip_id)
+#   album.ndjson     one per photo (with its trip_id and photo_path)
+#   uploads/...      every upload those rows point at, under its static path
+#
+# Heavy users have gigabytes of photos, so nothing is built in memory or on
+# disk. The zip is written on the fly, one chunk at a time, with every entry
+# STORED (photos are compressed already). Its exact bytes are worked out
+# before sending: the NDJSON is generated once just to count its bytes and
+# CRC (all inside one read transaction, so the second pass matches), and the
+# photo sizes come from the file system. So the response has a
+# Content-Length, and a Range request (a resumed download) can start
+# anywhere: the parts before it are skipped without being sent - file data is
+# seek()ed past, only the CRCs still have to be known (cached per file).
+# The ETag changes with the data (sync log versions + file list), and
+# If-Range makes a resume of an out-of-date download start over.
+#
+# POST /import loads such an archive into the signed-in account (as new
+# trips). The uploads are copied out of the zip by a thread pool, each
+# through the same content-addressed store as a normal upload (blobs.py), and
+# the rows go in IMPORT_BATCH_SIZE at a time: one INSERT ... SELECT FROM
+# json_each() per batch, one transaction per batch.
+
+CHUNK_SIZE = 64 * 1024
+IMPORT_BATCH_SIZE = 500
+IMPORT_COPY_WORKERS = 4
+ZIP64_LIMIT = 0xFFFFFFFF
+DOS_DATE = (0 << 9) | (1 << 5) | 1  # 1980-01-01: fixed, so every download is byte-identical
+DOS_TIME = 0
+ZIP_FLAGS = 0x0808  # sizes/CRC in a data descriptor, UTF-8 names
+
+NDJSON_FILES = ('trips.ndjson', 'journal.ndjson', 'album.ndjson')
+
+TRIP_COLUMNS = ('trip_id', 'trip_location', 'trip_start', 'trip_end', 'trip_image', 'trip_description', 'rating')
+JOURNAL_COLUMNS = ('journal_id', 'trip_id', 'entry_date', 'journal_entry')
+ALBUM_COLUMNS = ('photo_id', 'trip_id', 'photo_path', 'photo_alt', 'date_added')
+
+# (path, size, mtime) -> CRC-32 of upload files, so resumed downloads don't re-read them
+_crc_cache = {}
+CRC_CACHE_SIZE = 10000
+
+
+# ============================================================================
+# EXPORT: PLANNING THE ARCHIVE
+# ============================================================================
+
+class _Entry:
+    __slots__ = ('name', 'size', 'crc', 'offset', 'header', 'query', 'path')
+
+    def __init__(self, name, size, crc=None, query=None, path=None):
+        self.name = name.encode()
+        self.size = size
+        self.crc = crc
+        self.query = query  # (sql, params) for NDJSON entries
+        self.path = path    # file on disk for uploads
+        self.offset = 0
+        self.header = b''
+
+    @property
+    def zip64(self):
+        return self.size >= ZIP64_LIMIT
+
+
+class ExportPlan:
+    def __init__(self, conn, entries, etag):
+        self.conn = conn
+        self.entries = entries
+        self.etag = etag
+        self.central_offset = 0
+        self.central_size = 0
+        self.length = 0
+
+    def close(self):
+        self.conn.close()
+
+
+def _queries(clause, params):
+    visible = f'SELECT trip_id FROM Trips WHERE {clause}'
+    return {
+        'trips.ndjson': (f'SELECT {", ".join(TRIP_COLUMNS)} FROM Trips WHERE {clause} ORDER BY trip_id', params),
+        'journal.ndjson': (f'''
+            SELECT {", ".join(JOURNAL_COLUMNS)} FROM Journal
+            WHERE trip_id IN ({visible}) ORDER BY journal_id
+        ''', params),
+        'album.ndjson': (f'''
+            SELECT {", ".join(ALBUM_COLUMNS)} FROM Album
+            WHERE trip_id IN ({visible}) ORDER BY photo_id
+        ''', params),
+        'uploads': (f'''
+            SELECT trip_image FROM Trips WHERE {clause} AND trip_image LIKE 'uploads/%'
+            UNION
+            SELECT photo_path FROM Album WHERE trip_id IN ({visible}) AND photo_path LIKE 'uploads/%'
+            ORDER BY 1
+        ''', params + params),
+    }
+
+
+def _ndjson_lines(conn, query):
+    sql, params = query
+    for row in conn.execute(sql, params):
+        yield (json.dumps(dict(row), ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+
+
+# Size and CRC of an NDJSON entry without keeping it
+def _measure(conn, query):
+    size, crc = 0, 0
+    for line in _ndjson_lines(conn, query):
+        size += len(line)
+        crc = zlib.crc32(line, crc)
+    return size, crc
+
+
+# Everything this user's export contains, read from one snapshot. `request_conn`
+# is only used to work out which trips are visible; the archive itself is read
+# through its own connection, kept open (in a read transaction) while it streams.
+def plan_export(request_conn, database, user_id, static_folder):
+    clause, params = visible_trips_clause(request_conn, user_id)
+
+    conn = sqlite3.connect(database, check_same_thread=False)  # the body may stream on another thread
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute('BEGIN')
+    queries = _queries(clause, params)
+
+    entries = []
+    for name in NDJSON_FILES:
+        size, crc = _measure(conn, queries[name])
+        entries.append(_Entry(name, size, crc, query=queries[name]))
+    for (path,) in conn.execute(*queries['uploads']):
+        full_path = os.path.join(static_folder, path)
+        try:
+            size = os.path.getsize(full_path)
+        except OSError:
+            continue  # missing upload: the rows still come through
+        entries.append(_Entry(path, size, path=full_path))
+
+    # Anything the user can see changing gives a new ETag (see migration 11)
+    versions = conn.execute('''
+        SELECT (SELECT MAX(version) FROM SyncLog WHERE user_id = ?),
+               (SELECT MAX(version) FROM SyncLog WHERE user_id = ?),
+               (SELECT MAX(sync_version) FROM StarterOverrides WHERE user_id = ?)
+    ''', (user_id, STARTER_USER_ID, user_id)).fetchone()
+    digest = hashlib.sha256(json.dumps([user_id, *versions]).encode())
+    for entry in entries:
+        digest.update(b'%s\0%d\0%d\n' % (entry.name, entry.size, entry.crc or 0))
+
+    plan = ExportPlan(conn, entries, digest.hexdigest()[:32])
+    _lay_out(plan)
+    return plan
+
+
+# ============================================================================
+# EXPORT: ZIP LAYOUT (STORED ENTRIES, ZIP64 WHEN NEEDED)
+# ============================================================================
+
+def _local_header(entry):
+    extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if entry.zip64 else b''
+    version = 45 if entry.zip64 else 20
+    sizes = ZIP64_LIMIT if entry.zip64 else 0
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, version, ZIP_FLAGS, 0, DOS_TIME, DOS_DATE,
+                       0, sizes, sizes, len(entry.name), len(extra)) + entry.name + extra
+
+
+def _descriptor_size(entry):
+    return 24 if entry.zip64 else 16
+
+
+def _descriptor(entry):
+    if entry.zip64:
+        return struct.pack('<IIQQ', 0x08074b50, _crc(entry), entry.size, entry.size)
+    return struct.pack('<IIII', 0x08074b50, _crc(entry), entry.size, entry.size)
+
+
+def _central_extra(entry):
+    fields = []
+    if entry.zip64:
+        fields += [entry.size, entry.size]
+    if entry.offset >= ZIP64_LIMIT:
+        fields.append(entry.offset)
+    if not fields:
+        return b''
+    return struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields)
+
+
+def _central_record(entry, crc):
+    extra = _central_extra(entry)
+    size = ZIP64_LIMIT if entry.zip64 else entry.size
+    offset = min(entry.offset, ZIP64_LIMIT)
+    version = 45 if extra else 20
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, ZIP_FLAGS, 0, DOS_TIME, DOS_DATE,
+                       crc, size, size, len(entry.name), len(extra), 0, 0, 0, 0, offset) + entry.name + extra
+
+
+def _needs_zip64_end(plan):
+    return (len(plan.entries) >= 0xFFFF or plan.central_offset >= ZIP64_LIMIT
+            or plan.central_size >= ZIP64_LIMIT)
+
+
+def _end_records(plan):
+    count = len(plan.entries)
+    end = b''
+    if _needs_zip64_end(plan):
+        zip64_end_offset = plan.central_offset + plan.central_size
+        end += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                           count, count, plan.central_size, plan.central_offset)
+        end += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+    end += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                       min(plan.central_size, ZIP64_LIMIT), min(plan.central_offset, ZIP64_LIMIT), 0)
+    return end
+
+
+def _end_size(plan):
+    return 22 + (56 + 20 if _needs_zip64_end(plan) else 0)
+
+
+# Work out where every byte goes (and so the total length)
+def _lay_out(plan):
+    offset = 0
+    for entry in plan.entries:
+        entry.offset = offset
+        entry.header = _local_header(entry)
+        offset += len(entry.header) + entry.size + _descriptor_size(entry)
+    plan.central_offset = offset
+    plan.central_size = sum(len(_central_record(entry, 0)) for entry in plan.entries)
+    plan.length = plan.central_offset + plan.central_size + _end_size(plan)
+
+
+def _crc(entry):
+    if entry.crc is None:
+        entry.crc = _file_crc(entry.path)
+    return entry.crc
+
+
+def _file_crc(path):
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _crc_cache:
+        crc = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+        if len(_crc_cache) >= CRC_CACHE_SIZE:
+            _crc_cache.clear()
+        _crc_cache[key] = crc
+    return _crc_cache[key]
+
+
+# ============================================================================
+# EXPORT: STREAMING (ANY BYTE RANGE)
+# ============================================================================
+
+def _from_bytes(data, skip):
+    yield data[skip:]
+
+
+def _ndjson_data(plan, entry, skip):
+    buffer = []
+    buffered = 0
+    for line in _ndjson_lines(plan.conn, entry.query):
+        if skip >= len(line):
+            skip -= len(line)
+            continue
+        if skip:
+            line, skip = line[skip:], 0
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+# File data from `skip` on. Read from the start, its CRC comes for free.
+def _file_data(entry, skip):
+    crc = 0 if skip == 0 and entry.crc is None else None
+    remaining = entry.size - skip
+    with open(entry.path, 'rb') as f:
+        f.seek(skip)
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise OSError(f'{entry.path} changed during the export')
+            if crc is not None:
+                crc = zlib.crc32(chunk, crc)
+            remaining -= len(chunk)
+            yield chunk
+    if crc is not None:
+        entry.crc = crc
+
+
+def _central_directory(plan, skip):
+    for entry in plan.entries:
+        record = _central_record(entry, _crc(entry))
+        if skip >= len(record):
+            skip -= len(record)
+            continue
+        yield record[skip:]
+        skip = 0
+
+
+# (length, produce(skip)) for each consecutive piece of the archive
+def _parts(plan):
+    for entry in plan.entries:
+        yield len(entry.header), lambda skip, entry=entry: _from_bytes(entry.header, skip)
+        if entry.path is None:
+            yield entry.size, lambda skip, entry=entry: _ndjson_data(plan, entry, skip)
+        else:
+            yield entry.size, lambda skip, entry=entry: _file_data(entry, skip)
+        yield _descriptor_size(entry), lambda skip, entry=entry: _from_bytes(_descriptor(entry), skip)
+    yield plan.central_size, lambda skip: _central_directory(plan, skip)
+    yield _end_size(plan), lambda skip: _from_bytes(_end_records(plan), skip)
+
+
+# The archive's bytes [start, stop)
+def stream_export(plan, start=0, stop=None):
+    stop = plan.length if stop is None else stop
+    position = 0
+    for length, produce in _parts(plan):
+        if position + length > start and length:
+            skip = max(0, start - position)
+            remaining = min(stop, position + length) - position - skip
+            with closing(produce(skip)) as chunks:
+                for chunk in chunks:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                    yield chunk
+                    if remaining <= 0:
+                        break
+        position += length
+        if position >= stop:
+            break
+
+
+# 200 with the whole archive, or 206 / 416 for a Range request
+def export_response(plan, filename):
+    start, stop, status = 0, plan.length, 200
+    byte_range = request.range
+    if_range = request.if_range
+    resumable = not (if_range.etag or if_range.date) or if_range.etag == plan.etag
+    if byte_range is not None and len(byte_range.ranges) == 1 and resumable:
+        bounds = byte_range.range_for_length(plan.length)
+        if bounds is None:
+            plan.close()
+            return Response(status=416, headers={'Content-Range': f'bytes */{plan.length}'})
+        (start, stop), status = bounds, 206
+
+    response = Response(stream_export(plan, start, stop), status, mimetype='application/zip',
+                        direct_passthrough=True)
+    response.content_length = stop - start
+    response.accept_ranges = 'bytes'
+    response.set_etag(plan.etag)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{plan.length}'
+    response.call_on_close(plan.close)
+    return response
+
+
+# ============================================================================
+# IMPORT
+# ============================================================================
+
+class InvalidArchive(ValueError):
+    pass
+
+
+# Copy one upload out of the zip to a temp file (runs on the thread pool).
+# Returns the temp path, or None if it isn't a usable image.
+def _extract_file(archive, name, upload_folder):
+    temp_path = os.path.join(upload_folder, f'.import-{uuid.uuid4().hex}')
+    try:
+        with archive.open(name) as source, open(temp_path, 'wb') as out:
+            shutil.copyfileobj(source, out, CHUNK_SIZE)
+        strip_metadata(temp_path)
+    except (OSError, zipfile.BadZipFile):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+    return temp_path
+
+
+def _thumbnails(blob_path, static_folder):
+    if not image_sources(blob_path, static_folder):
+        try:
+            generate_derivatives(blob_path, static_folder)
+        except OSError:
+            pass  # the original still works without thumbnails
+
+
+# Copy every upload into the content-addressed store: {path in the archive: new
+# static path}. Extracting and thumbnails run in parallel; storing is one batch
+# on `conn`, and each stored file holds a reference until import_archive()
+# releases it.
+def _import_files(conn, archive, allowed_extensions, max_file_size, upload_folder, static_folder):
+    members = [info for info in archive.infolist()
+               if info.filename.startswith('uploads/') and not info.is_dir()
+               and info.filename.count('/') == 1 and info.file_size <= max_file_size
+               and info.filename.rsplit('.', 1)[-1].lower() in allowed_extensions]
+    with ThreadPoolExecutor(max_workers=IMPORT_COPY_WORKERS) as pool:
+        extracted = pool.map(lambda info: _extract_file(archive, info.filename, upload_folder), members)
+        extracted = [(info.filename, temp_path) for info, temp_path in zip(members, extracted) if temp_path]
+        stored = store_files(conn, [(temp_path, name) for name, temp_path in extracted],
+                             upload_folder, static_folder)
+        list(pool.map(lambda blob_path: _thumbnails(blob_path, static_folder), set(stored)))
+    return {name: blob_path for (name, _), blob_path in zip(extracted, stored)}
+
+
+# A path from the archive -> the path to store (None if there's no such file)
+def _image_path(path, files, static_folder):
+    if not path:
+        return None
+    if path in files:
+        return files[path]
+    if path.startswith('uploads/') or not os.path.isfile(os.path.join(static_folder, path)):
+        return None  # a placeholder, or an upload the archive doesn't have
+    return path  # a file every install has (seed data)
+
+
+def _records(archive, name):
+    if name not in archive.namelist():
+        return
+    with archive.open(name) as f:
+        for line in f:
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise InvalidArchive(f'{name} is not valid NDJSON')
+                if isinstance(record, dict):
+                    yield record
+
+
+def _batches(records):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _text(value):
+    return value if isinstance(value, str) else None
+
+
+def _rating(value):
+    return value if isinstance(value, int) and 0 <= value <= 5 else 0
+
+
+# Insert one batch in one statement; new ids come out in order (AUTOINCREMENT,
+# single statement), which maps the archive's ids to ours
+def _insert_batch(conn, table, columns, rows):
+    cursor = conn.execute(f'''
+        INSERT INTO {table} ({", ".join(columns)})
+        SELECT {", ".join(f"json_extract(value, '$[{i}]')" for i in range(len(columns)))}
+        FROM json_each(?) ORDER BY key
+    ''', (json.dumps(rows),))
+    first_id = cursor.lastrowid - len(rows) + 1
+    conn.commit()
+    return first_id
+
+
+def import_archive(conn, file, user_id, upload_folder, static_folder, allowed_extensions, max_file_size):
+    try:
+        archive = zipfile.ZipFile(file.stream)
+    except zipfile.BadZipFile:
+        raise InvalidArchive('That file is not a zip archive')
+    with archive:
+        if 'trips.ndjson' not in archive.namelist():
+            raise InvalidArchive('That zip is not a TripTrove export (no trips.ndjson)')
+
+        files = _import_files(conn, archive, allowed_extensions, max_file_size, upload_folder, static_folder)
+        try:
+            counts = {'trips': 0, 'journal': 0, 'photos': 0, 'files': len(files), 'skipped': 0}
+
+            trip_ids = {}
+            for batch in _batches(_records(archive, 'trips.ndjson')):
+                rows, old_ids = [], []
+                for record in batch:
+                    location, start, end = (_text(record.get(key)) for key in ('trip_location', 'trip_start', 'trip_end'))
+                    if not (location and start and end):
+                        counts['skipped'] += 1
+                        continue
+                    rows.append([location, start, end, _image_path(record.get('trip_image'), files, static_folder),
+                                 _text(record.get('trip_description')), _rating(record.get('rating')), user_id])
+                    old_ids.append(record.get('trip_id'))
+                if rows:
+                    first_id = _insert_batch(conn, 'Trips', ('trip_location', 'trip_start', 'trip_end', 'trip_image',
+                                                             'trip_description', 'rating', 'user_id'), rows)
+                    trip_ids.update((old_id, first_id + i) for i, old_id in enumerate(old_ids))
+                    locate_trips(conn, [(first_id + i, user_id, row[0]) for i, row in enumerate(rows)])
+                    conn.commit()
+                    counts['trips'] += len(rows)
+
+            for batch in _batches(_records(archive, 'journal.ndjson')):
+                rows = [[trip_ids[record.get('trip_id')], _text(record.get('entry_date')), _text(record.get('journal_entry'))]
+                        for record in batch
+                        if record.get('trip_id') in trip_ids and _text(record.get('entry_date'))
+                        and _text(record.get('journal_entry'))]
+                counts['skipped'] += len(batch) - len(rows)
+                if rows:
+                    _insert_batch(conn, 'Journal', ('trip_id', 'entry_date', 'journal_entry'), rows)
+                    counts['journal'] += len(rows)
+
+            for batch in _batches(_records(archive, 'album.ndjson')):
+                rows = []
+                for record in batch:
+                    path = _image_path(record.get('photo_path'), files, static_folder)
+                    if record.get('trip_id') not in trip_ids or path is None or not _text(record.get('date_added')):
+                        continue
+                    rows.append([trip_ids[record.get('trip_id')], path, _text(record.get('photo_alt')),
+                                 record['date_added']])
+                counts['skipped'] += len(batch) - len(rows)
+                if rows:
+                    _insert_batch(conn, 'Album', ('trip_id', 'photo_path', 'photo_alt', 'date_added'), rows)
+                    counts['photos'] += len(rows)
+        finally:
+            # Give back the copied files' own references: the ones no row ended
+            # up using (or all of them, if the import failed) go to the garbage
+            # collector
+            if conn.in_transaction:
+                conn.rollback()
+            release(conn, files.values())
+            conn.commit()
+
+    collect_garbage(conn, static_folder)
+    return counts
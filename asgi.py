@@ -0,0 +1,276 @@
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import FileWrapper
+
+# ============================================================================
+# ASGI SERVING MODE
+# ============================================================================
+#
+# Runs the Flask app under an asyncio server (see serve.py). The event loop
+# does the waiting, so slow clients cost a coroutine rather than a thread:
+#
+#   1. The request body is read on the event loop. Small bodies stay in
+#      memory; bigger ones (uploads) spill to a temp file, written through
+#      a small file executor so the loop never blocks on the disk. The size
+#      limit is the one of the route being posted to (LARGE_BODY_ENDPOINTS),
+#      checked before and while reading: /login doesn't take 4GB because
+#      /import does.
+#   2. Only once the whole body has arrived is the Flask view run - on a
+#      dedicated, bounded executor, since that's where SQLite and Jinja work
+#      happens. Its size (threads) matches the connection pool.
+#   3. The response is sent back chunk by chunk from the loop.
+#   4. Files (send_file, i.e. photos from /media) come through
+#      wsgi.file_wrapper. If the server supports the ASGI zero-copy send
+#      extension, the open file is handed to it (sendfile) with the offset /
+#      length of the requested range. Otherwise the file is read on the file
+#      executor, so a multi-MB photo never holds a view thread.
+#
+# So thousands of half-finished uploads or slow downloads can be open at once
+# while only `threads` requests touch the database.
+#
+#   uvicorn asgi:application       (or: python serve.py, which sets it up)
+
+SPOOL_IN_MEMORY = 1024 * 1024  # bodies bigger than this go to a temp file
+FILE_THREADS = 4
+FILE_CHUNK_SIZE = 256 * 1024  # file responses are read this much at a time
+ZERO_COPY = 'http.response.zerocopysend'
+
+# Endpoints allowed more than MAX_CONTENT_LENGTH, and the setting their views
+# raise request.max_content_length to
+LARGE_BODY_ENDPOINTS = {
+    'upload_photo': 'BULK_UPLOAD_MAX_LENGTH',
+    'import_trips': 'IMPORT_MAX_LENGTH',
+}
+
+
+class AsgiAdapter:
+    # max_body: a size in bytes, or a function scope -> size (None: no limit)
+    def __init__(self, wsgi_app, threads=8, max_body=None):
+        self.wsgi_app = wsgi_app
+        self.max_body = max_body if callable(max_body) else lambda scope: max_body
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.file_executor = ThreadPoolExecutor(max_workers=FILE_THREADS, thread_name_prefix='spool')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                self.file_executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        max_body = self.max_body(scope)
+        declared = _header(scope, b'content-length')
+        if max_body and declared and declared.isdigit() and int(declared) > max_body:
+            await _plain_response(send, 413, b'Request Entity Too Large')
+            return
+
+        body = await self._read_body(receive, max_body)
+        if body is None:
+            return  # client went away
+        if body is False:
+            await _plain_response(send, 413, b'Request Entity Too Large')
+            return
+
+        try:
+            await self._run_wsgi(scope, body, send)
+        finally:
+            await self._run_file(body.close)
+
+    # Spool the request body. Returns the file (rewound), None if the client
+    # disconnected, or False if it went past max_body.
+    async def _read_body(self, receive, max_body):
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_IN_MEMORY)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                await self._run_file(body.close)
+                return None
+            chunk = message.get('body', b'')
+            if chunk:
+                size += len(chunk)
+                if max_body and size > max_body:
+                    await self._run_file(body.close)
+                    return False
+                if size > SPOOL_IN_MEMORY:
+                    await self._run_file(body.write, chunk)  # on disk now: don't block the loop
+                else:
+                    body.write(chunk)
+            if not message.get('more_body', False):
+                break
+        await self._run_file(body.seek, 0)
+        return body
+
+    async def _run_file(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.file_executor, func, *args)
+
+    async def _run_wsgi(self, scope, body, send):
+        loop = asyncio.get_running_loop()
+        environ = _environ(scope, body)
+        started = {}
+
+        # Remember a file response, so its body can skip the view executor
+        def file_wrapper(file, block_size=FILE_CHUNK_SIZE):
+            started['file'] = file
+            return FileWrapper(file, max(block_size, FILE_CHUNK_SIZE))
+        environ['wsgi.file_wrapper'] = file_wrapper
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+
+        # Call the app and pull the first chunk in the executor (views run here)
+        def begin():
+            result = self.wsgi_app(environ, start_response)
+            iterator = iter(result)
+            return result, iterator, next(iterator, None)
+
+        result, iterator, chunk = await loop.run_in_executor(self.executor, begin)
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+            started['sent'] = True
+            file_range = _file_range(scope, started)
+            if file_range is not None and ZERO_COPY in scope.get('extensions', {}) and _has_fileno(started['file']):
+                offset, count = file_range
+                await send({'type': ZERO_COPY, 'file': started['file'], 'offset': offset, 'count': count,
+                            'more_body': False})
+                return
+            body_executor = self.file_executor if file_range is not None else self.executor
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(body_executor, next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+
+def _header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+# (offset, count) of the file a file response sends, or None if it isn't one
+# (or sends no body: HEAD, 304, 416)
+def _file_range(scope, started):
+    file = started.get('file')
+    if file is None or scope['method'] == 'HEAD' or started['status'] not in (200, 206):
+        return None
+    headers = dict(started['headers'])
+    if started['status'] == 206:
+        content_range = headers.get(b'content-range', b'').decode('latin-1')
+        first, last = content_range.split(' ', 1)[-1].split('/', 1)[0].split('-')
+        return int(first), int(last) - int(first) + 1
+    if b'content-length' not in headers:
+        return None
+    return 0, int(headers[b'content-length'])
+
+
+def _has_fileno(file):
+    try:
+        file.fileno()
+        return True
+    except (AttributeError, OSError, ValueError):
+        return False  # io.BytesIO and friends
+
+
+async def _plain_response(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# PEP 3333 environ for an ASGI HTTP scope
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    body.seek(0, os.SEEK_END)
+    length = body.tell()
+    body.seek(0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue  # we know the real length
+        if name != 'CONTENT_TYPE':
+            name = f'HTTP_{name}'
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value  # HTTP/2 splits cookies
+        environ[name] = value
+    return environ
+
+
+# The body limit for a request: its route's (see LARGE_BODY_ENDPOINTS), or
+# MAX_CONTENT_LENGTH for everything else, unknown paths included
+def body_limits(app):
+    urls = app.url_map.bind('localhost')
+
+    def max_body(scope):
+        try:
+            endpoint, _ = urls.match(scope['path'], method=scope['method'])
+        except HTTPException:  # 404, 405, redirects: the app answers without reading the body
+            endpoint = None
+        setting = LARGE_BODY_ENDPOINTS.get(endpoint)
+        return app.config[setting] if setting else app.config['MAX_CONTENT_LENGTH']
+    return max_body
+
+
+# Wrap a Flask app (bodies are capped per route, before they are read)
+def wrap(app, threads):
+    return AsgiAdapter(app, threads=threads, max_body=body_limits(app))
+
+
+# The app, ready for any ASGI server: uvicorn asgi:application
+def create_application():
+    from app import app
+    return wrap(app, int(os.environ.get('TRIPTROVE_ASGI_THREADS', app.config['DB_POOL_SIZE'])))
+
+
+# Built on first use, so importing AsgiAdapter (serve.py) doesn't load the app
+def __getattr__(name):
+    global application
+    if name == 'application':
+        application = create_application()
+        return application
+    raise AttributeError(name)
@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import sys
+from flask import current_app, request, send_file, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # no brotli package: only the gzip copies are written
+    brotli = None
+
+# ============================================================================
+# STATIC ASSETS: ONE MINIFIED, FINGERPRINTED CSS BUNDLE
+# ============================================================================
+#
+# Every page used to link each stylesheet separately, with no version in the
+# URL, so browsers revalidated all of them on every page. At startup (or with
+# python assets.py as a deploy step) the stylesheets are concatenated in
+# order, minified and written under their content hash:
+#
+#   static/css/*.css  ->  static/dist/bundle.3f9a0c1e2b7d.css  (+ .gz, .br)
+#   static/js/processing.js  ->  static/dist/processing.8c21d4e0a9f3.js
+#
+# Templates keep asking for url_for('static', filename='css/bundle.css'); a
+# url_defaults hook swaps in the fingerprinted name. A changed file gets a new
+# name, so the fingerprinted files are served as immutable for a year, and
+# the precompressed copy is sent when the browser accepts it.
+#
+# New stylesheets go in BUNDLES (order matters: responsive.css stays last).
+
+STATIC_FOLDER = 'static'
+DIST_DIR = 'dist'
+BUNDLES = {
+    'css/bundle.css': [
+        'css/base.css',
+        'css/header.css', 'css/footer.css',
+        'css/trip-cards.css', 'css/trip-buttons.css', 'css/forms.css', 'css/popups.css',
+        'css/journal.css', 'css/album.css', 'css/login.css', 'css/photo-update.css',
+        'css/search.css', 'css/dashboard.css', 'css/calendar.css',
+        'css/responsive.css',
+    ],
+}
+FINGERPRINTED = ['js/processing.js', 'js/offline.js']  # served as they are, just under a hashed name
+HASH_LENGTH = 12
+ONE_YEAR = 365 * 24 * 60 * 60
+
+# Precompressed copies, best first: (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')] if brotli else [('gzip', '.gz')]
+
+_STRING_OR_COMMENT = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+_STRING = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+# Drop comments and unneeded whitespace (strings are left alone). Spaces
+# before ':' are kept: "a :hover" and "a:hover" are different selectors.
+def minify_css(css):
+    css = _STRING_OR_COMMENT.sub(lambda m: m.group(1) or '', css)
+    parts = _STRING.split(css)
+    for i in range(0, len(parts), 2):  # even parts are outside strings
+        text = re.sub(r'\s+', ' ', parts[i])
+        text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+        text = re.sub(r':\s+', ':', text)
+        parts[i] = text.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+# Relative url(...)s point from the stylesheet's folder; the bundle is in dist/
+def _rebase_urls(css, source):
+    def rebase(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source), url))
+        return f'url({quote}{posixpath.relpath(target, DIST_DIR)}{quote})'
+    return _URL.sub(rebase, css)
+
+
+def _fingerprinted_name(name, content):
+    stem, extension = posixpath.splitext(posixpath.basename(name))
+    return f'{DIST_DIR}/{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+# Write a file (and its compressed copies) unless it's already there. Temp
+# file + rename, so several worker processes starting at once don't clash.
+def _write(static_folder, name, content):
+    path = os.path.join(static_folder, name)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    copies = [('.gz', gzip.compress(content, 9, mtime=0))]
+    if brotli:
+        copies.append(('.br', brotli.compress(content)))
+    for suffix, data in copies + [('', content)]:  # the plain file last: it marks the set as complete
+        temp_path = f'{path}{suffix}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path + suffix)
+
+
+# Build everything; returns the manifest {'css/bundle.css': 'dist/bundle.<hash>.css', ...}
+def build(static_folder=STATIC_FOLDER):
+    manifest = {}
+    for bundle, sources in BUNDLES.items():
+        css = []
+        for source in sources:
+            with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+                css.append(minify_css(_rebase_urls(f.read(), source)))
+        content = '\n'.join(css).encode('utf-8')
+        manifest[bundle] = _fingerprinted_name(bundle, content)
+        _write(static_folder, manifest[bundle], content)
+
+    for source in FINGERPRINTED:
+        with open(os.path.join(static_folder, source), 'rb') as f:
+            content = f.read()
+        manifest[source] = _fingerprinted_name(source, content)
+        _write(static_folder, manifest[source], content)
+    return manifest
+
+
+# Newest source mtime (the dev server rebuilds when it changes)
+def _sources_mtime(static_folder):
+    sources = [source for sources in BUNDLES.values() for source in sources] + FINGERPRINTED
+    return max(os.path.getmtime(os.path.join(static_folder, source)) for source in sources)
+
+
+# Delete dist/ files that aren't part of the current build (deploy step)
+def clean(manifest, static_folder=STATIC_FOLDER):
+    current = {posixpath.basename(name) for name in manifest.values()}
+    folder = os.path.join(static_folder, DIST_DIR)
+    removed = []
+    for name in os.listdir(folder):
+        if name.removesuffix('.gz').removesuffix('.br') not in current:
+            os.remove(os.path.join(folder, name))
+            removed.append(name)
+    return removed
+
+
+# ============================================================================
+# FLASK WIRING
+# ============================================================================
+
+def _state(app):
+    state = app.extensions['assets']
+    if app.debug:
+        mtime = _sources_mtime(app.static_folder)
+        if mtime != state['mtime']:  # a stylesheet was edited under the dev server
+            state['manifest'], state['mtime'] = build(app.static_folder), mtime
+    return state
+
+
+# Fingerprinted file, precompressed if the browser accepts it, cached for a year
+def send_asset(filename):
+    path = safe_join(current_app.static_folder, DIST_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = next((name for name, suffix in ENCODINGS
+                     if request.accept_encodings[name] and os.path.isfile(path + suffix)), None)
+    response = send_file(path + dict(ENCODINGS)[encoding] if encoding else path,
+                         mimetype=mimetype, max_age=ONE_YEAR, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    app.extensions['assets'] = {'manifest': build(app.static_folder), 'mtime': _sources_mtime(app.static_folder)}
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static':
+            name = _state(app)['manifest'].get(values.get('filename'))
+            if name:
+                values['filename'] = name
+
+    app.add_url_rule(f'{app.static_url_path}/{DIST_DIR}/<path:filename>', endpoint='assets', view_func=send_asset)
+
+
+# python assets.py: build the bundle ahead of a deploy and drop old builds
+if __name__ == '__main__':
+    manifest = build(sys.argv[1] if len(sys.argv) > 1 else STATIC_FOLDER)
+    for source, name in manifest.items():
+        print(f'{source} -> {name}')
+    for name in clean(manifest, sys.argv[1] if len(sys.argv) > 1 else STATIC_FOLDER):
+        print(f'removed {name}')
@@ -0,0 +1,101 @@
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+from migrations import migrate
+from geo import locate_trips
+
+# ============================================================================
+# SYNTHETIC DATA FOR BENCHMARKS
+# ============================================================================
+#
+# Copies a database (normally part_a.db) and adds N users with M trips each,
+# plus journal entries and photos on every trip. The copy is what the load
+# test runs against, so the real database is never touched. Same seed = same
+# data, so runs can be compared.
+#
+#   python benchmarks/generate.py out.db [users] [trips_per_user] [--from part_a.db]
+
+USERNAME = 'bench_user_{}'
+PASSWORD = 'bench'
+PLACES = ['Paris', 'Tokyo', 'Bali', 'Rome', 'London', 'Sydney', 'Dubai', 'Iceland', 'Lisbon', 'Kyoto']
+WORDS = ('walked market museum sunset beach temple train river castle food night harbour '
+         'mountain lake island street coffee festival garden bridge cathedral view').split()
+
+
+# Copy `source` to `database` (backup API, so a live WAL database copies cleanly)
+def copy_database(source, database):
+    if os.path.exists(database):
+        os.remove(database)
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(database)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+# Add the synthetic users. Returns their [(user_id, username)], password PASSWORD.
+def generate(database, users=200, trips_per_user=40, entries_per_trip=5, photos_per_trip=5, seed=42):
+    migrate(database)
+    rng = random.Random(seed)
+    password = generate_password_hash(PASSWORD)  # hashed once: it's the same for everyone
+
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA foreign_keys = ON')
+    try:
+        first_user = conn.execute('SELECT COALESCE(MAX(user_id), 0) + 1 FROM Users').fetchone()[0]
+        accounts = [(first_user + i, USERNAME.format(first_user + i)) for i in range(users)]
+        conn.executemany('INSERT INTO Users (user_id, username, password) VALUES (?, ?, ?)',
+                         [(user_id, username, password) for user_id, username in accounts])
+
+        first_trip = conn.execute('SELECT COALESCE(MAX(trip_id), 0) + 1 FROM Trips').fetchone()[0]
+        trips, entries, photos = [], [], []
+        trip_id = first_trip
+        for user_id, _ in accounts:
+            for _ in range(trips_per_user):
+                year, month, day = rng.randint(2015, 2025), rng.randint(1, 12), rng.randint(1, 20)
+                start = f'{year}-{month:02d}-{day:02d}'
+                end = f'{year}-{month:02d}-{day + rng.randint(0, 8):02d}'
+                trips.append((trip_id, rng.choice(PLACES), start, end, f'uploads/bench-{trip_id % 50}.jpg',
+                              _sentence(rng, 8), rng.randint(1, 5), user_id))
+                for _ in range(entries_per_trip):
+                    entries.append((start, _sentence(rng, rng.randint(20, 60)), trip_id))
+                for _ in range(photos_per_trip):
+                    photos.append((f'uploads/bench-{rng.randint(0, 499)}.jpg', _sentence(rng, 4), trip_id, start))
+                trip_id += 1
+
+        conn.executemany('''
+            INSERT INTO Trips (trip_id, trip_location, trip_start, trip_end, trip_image, trip_description, rating, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', trips)
+        conn.executemany('INSERT INTO Journal (entry_date, journal_entry, trip_id) VALUES (?, ?, ?)', entries)
+        conn.executemany('INSERT INTO Album (photo_path, photo_alt, trip_id, date_added) VALUES (?, ?, ?, ?)', photos)
+        locate_trips(conn, [(trip[0], trip[7], trip[1]) for trip in trips])
+        conn.commit()
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+    print(f'{users} users, {len(trips)} trips, {len(entries)} journal entries, {len(photos)} photos')
+    return accounts
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not args:
+        sys.exit('usage: python benchmarks/generate.py out.db [users] [trips_per_user] [--from part_a.db]')
+    source = sys.argv[sys.argv.index('--from') + 1] if '--from' in sys.argv else 'part_a.db'
+    args = [arg for arg in args if arg != source]
+    copy_database(source, args[0])
+    generate(args[0], *(int(arg) for arg in args[1:3]))
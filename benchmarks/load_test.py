@@ -0,0 +1,315 @@
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from http.cookies import SimpleCookie
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate import PASSWORD, copy_database, generate
+
+# ============================================================================
+# LOAD TEST
+# ============================================================================
+#
+# Builds a synthetic copy of part_a.db (generate.py), then hammers one route at
+# a time from --concurrency threads for --duration seconds, each thread logged
+# in as a different generated user. Prints requests, errors, throughput and
+# p50 / p95 / p99 latency per route.
+#
+#   --client test     Flask's test client, in process (no sockets: measures the
+#                     app itself - queries, templates, caches)
+#   --client server   a real threaded WSGI server on a local port, over
+#                     keep-alive HTTP connections (adds parsing and sockets)
+#
+# --save baseline.json keeps the numbers; --baseline baseline.json compares a
+# later run against them and exits 1 if any route's p95 got more than
+# --tolerance slower, so a change can be checked before it's merged.
+#
+#   python benchmarks/load_test.py [--users 50] [--trips 20] [--concurrency 8] [--duration 5]
+
+ROUTES = ['index', 'trips_page', 'trip', 'journal', 'album', 'search', 'new_entry', 'upload_photo', 'register']
+SEARCH_WORDS = ['market', 'sunset', 'temple beach', 'castle river', 'coffee']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the TripTrove routes.')
+    parser.add_argument('--users', type=int, default=50, help='synthetic users to generate')
+    parser.add_argument('--trips', type=int, default=20, help='trips per synthetic user')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per route')
+    parser.add_argument('--client', choices=['test', 'server'], default='test')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma-separated subset of: ' + ', '.join(ROUTES))
+    parser.add_argument('--source', default=os.path.join(ROOT, 'part_a.db'), help='database to copy')
+    parser.add_argument('--no-cache', action='store_true', help='switch the render cache off')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown vs the baseline (0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+
+# A tiny valid PNG (solid colour), so uploads go through the real processing
+def png_bytes(rng, size=32):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    row = b'\x00' + bytes([rng.randrange(256), rng.randrange(256), rng.randrange(256)]) * size
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * size))
+            + chunk(b'IEND', b''))
+
+
+# ============================================================================
+# CLIENTS (same get / post for both modes; both return the status code)
+# ============================================================================
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        response.close()
+        return response.status_code
+
+    def post(self, path, data, files=None):
+        data = dict(data)
+        for name, (filename, content) in (files or {}).items():
+            data[name] = (io.BytesIO(content), filename)
+        response = self.client.post(path, data=data, content_type='multipart/form-data' if files else None)
+        response.close()
+        return response.status_code
+
+
+class HttpClient:
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+        self.connection = None
+
+    def _request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()  # server closed the keep-alive connection: reconnect once
+                self.connection = None
+                if attempt:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+        return response.status
+
+    def get(self, path):
+        return self._request('GET', path)
+
+    def post(self, path, data, files=None):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in data.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, (filename, content) in (files or {}).items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                         f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return self._request('POST', path, body=b''.join(parts),
+                             headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+# ============================================================================
+# ROUTES: one request each, for a logged-in user with some trips
+# ============================================================================
+
+def _request(route, client, user, rng):
+    trip_id = rng.choice(user['trips'])
+    if route == 'index':
+        return client.get('/')
+    if route == 'trips_page':
+        return client.get(f'/trips/page?sort={rng.choice(["date_desc", "date_asc", "rating_desc", "location_asc"])}')
+    if route == 'trip':
+        return client.get(f'/trip/{trip_id}')
+    if route == 'journal':
+        return client.get(f'/journal/{trip_id}')
+    if route == 'album':
+        return client.get(f'/album/{trip_id}')
+    if route == 'search':
+        return client.get(f'/search?q={rng.choice(SEARCH_WORDS).replace(" ", "+")}')
+    if route == 'new_entry':
+        return client.post(f'/journal/add/{trip_id}', {'entry_date': '2024-05-01',
+                                                       'journal_entry': 'Load test entry, walked to the market.'})
+    if route == 'upload_photo':
+        return client.post(f'/album/{trip_id}/upload', {'photo_alt': 'Load test photo'},
+                           files={'photo': ('load.png', png_bytes(rng))})
+    if route == 'register':
+        name = f'load_{uuid.uuid4().hex[:12]}'
+        return client.post('/register', {'username': name, 'password': PASSWORD, 'confirm_password': PASSWORD})
+    raise ValueError(route)
+
+
+def run_route(route, make_client, users, concurrency, duration):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    clock = {}
+
+    # The clock starts once every thread has logged in (hashing isn't the route's time)
+    def start_clock():
+        clock['started'] = time.perf_counter()
+        clock['deadline'] = clock['started'] + duration
+    ready = threading.Barrier(concurrency, action=start_clock)
+
+    def worker(number):
+        rng = random.Random(number)
+        user = users[number % len(users)]
+        client = make_client()
+        client.post('/login', {'username': user['username'], 'password': PASSWORD})
+        ready.wait()
+        mine, failed = [], 0
+        while time.perf_counter() < clock['deadline']:
+            started = time.perf_counter()
+            try:
+                status = _request(route, client, user, rng)
+            except Exception:
+                status = None
+            mine.append(time.perf_counter() - started)
+            if status is None or status >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarise(latencies, sum(errors), time.perf_counter() - clock['started'])
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000 if ordered else 0.0
+
+
+def summarise(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'rps': len(ordered) / elapsed if elapsed else 0.0,
+        'p50': _percentile(ordered, 0.50),
+        'p95': _percentile(ordered, 0.95),
+        'p99': _percentile(ordered, 0.99),
+        'max': ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+def report(results, baseline=None):
+    print(f'\n{"route":<14}{"requests":>9}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}')
+    for route, r in results.items():
+        line = (f'{route:<14}{r["requests"]:>9}{r["errors"]:>8}{r["rps"]:>9.1f}'
+                f'{r["p50"]:>9.1f}{r["p95"]:>9.1f}{r["p99"]:>9.1f}{r["max"]:>9.1f}')
+        if baseline and route in baseline and baseline[route]['p95']:
+            line += f'   p95 {(r["p95"] / baseline[route]["p95"] - 1) * 100:+.0f}% vs baseline'
+        print(line)
+
+
+# Routes whose p95 got slower than the baseline allows
+def regressions(results, baseline, tolerance):
+    return [route for route, r in results.items()
+            if route in baseline and r['p95'] > baseline[route]['p95'] * (1 + tolerance)]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    routes = [route for route in args.routes.split(',') if route]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        sys.exit(f'unknown routes: {", ".join(sorted(unknown))}')
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = os.path.join(folder, 'load.db')
+        copy_database(args.source, database)
+        accounts = generate(database, users=args.users, trips_per_user=args.trips)
+
+        conn = sqlite3.connect(database)
+        users = [{'username': username,
+                  'trips': [row[0] for row in conn.execute('SELECT trip_id FROM Trips WHERE user_id = ?', (user_id,))]}
+                 for user_id, username in accounts]
+        conn.close()
+
+        # Settings are read when app.py is imported; uploads go to the temp folder
+        os.environ['TRIPTROVE_DATABASE'] = database
+        if args.no_cache:
+            os.environ['TRIPTROVE_RENDER_CACHE_BYTES'] = '0'
+        os.chdir(ROOT)  # app.py uses paths relative to the repo (templates, static)
+        from app import app
+        app.config['UPLOAD_FOLDER'] = os.path.join(folder, 'uploads')
+        app.config['UPLOAD_QUEUE_FOLDER'] = os.path.join(folder, 'upload_queue')
+        app.config['UPLOAD_QUEUE_SIZE'] = 10 ** 6  # measure the request, not the 503
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+        os.makedirs(app.config['UPLOAD_QUEUE_FOLDER'])
+
+        server = None
+        if args.client == 'server':
+            from werkzeug.serving import make_server
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no line per request
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            make_client = lambda: HttpClient(server.server_port)
+        else:
+            make_client = lambda: TestClient(app)
+
+        print(f'{args.client} client, {args.concurrency} threads, {args.duration:g}s per route'
+              f'{", render cache off" if args.no_cache else ""}')
+        results = {}
+        try:
+            for route in routes:
+                results[route] = run_route(route, make_client, users, args.concurrency, args.duration)
+                print(f'  {route}: {results[route]["requests"]} requests')
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nSaved to {args.save}')
+
+    if baseline:
+        slower = regressions(results, baseline, args.tolerance)
+        if slower:
+            print(f'\np95 regressed more than {args.tolerance:.0%}: {", ".join(slower)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
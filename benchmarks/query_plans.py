@@ -0,0 +1,95 @@
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+from pagination import TRIP_SORTS, TRIPS_PER_PAGE, trip_order_clause
+
+# ============================================================================
+# QUERY PLAN BENCHMARK
+# ============================================================================
+#
+# Builds a throwaway database with lots of users, runs the read queries from
+# app.py before (schema version 1) and after (latest) the index migration, and
+# prints the EXPLAIN QUERY PLAN plus the average time for each.
+#
+#   python benchmarks/query_plans.py [users] [trips_per_user]
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+TRIPS_PER_USER = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+ENTRIES_PER_TRIP = 5
+PHOTOS_PER_TRIP = 5
+RUNS = 200
+
+# Same queries the routes run (index() for each sort, journal(), album())
+QUERIES = {
+    f'index {sort}': f'SELECT * FROM Trips WHERE user_id = ? {trip_order_clause(sort)} LIMIT {TRIPS_PER_PAGE + 1}'
+    for sort in TRIP_SORTS
+}
+QUERIES['journal'] = 'SELECT entry_date, journal_entry, journal_id FROM Journal WHERE trip_id = ? ORDER BY entry_date DESC'
+QUERIES['album'] = 'SELECT * FROM Album WHERE trip_id = ? ORDER BY date_added DESC'
+
+
+def fill(database):
+    rng = random.Random(42)
+    conn = sqlite3.connect(database)
+    places = ['Paris', 'Tokyo', 'Bali', 'Rome', 'London', 'Sydney', 'Dubai', 'Iceland']
+
+    trips = []
+    for user_id in range(1, USERS + 1):
+        for _ in range(TRIPS_PER_USER):
+            start = f'20{rng.randint(10, 25)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+            trips.append((rng.choice(places), start, start, 'uploads/x.jpg', 'desc', rng.randint(1, 5), user_id))
+    conn.executemany('''
+        INSERT INTO Trips (trip_location, trip_start, trip_end, trip_image, trip_description, rating, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', trips)
+
+    trip_count = len(trips)
+    conn.executemany(
+        'INSERT INTO Journal (entry_date, journal_entry, trip_id) VALUES (?, ?, ?)',
+        [('2024-01-%02d' % rng.randint(1, 28), 'entry', trip_id)
+         for trip_id in range(1, trip_count + 1) for _ in range(ENTRIES_PER_TRIP)]
+    )
+    conn.executemany(
+        'INSERT INTO Album (photo_path, photo_alt, trip_id, date_added) VALUES (?, ?, ?, ?)',
+        [('uploads/x.jpg', 'photo', trip_id, '2024-01-%02d' % rng.randint(1, 28))
+         for trip_id in range(1, trip_count + 1) for _ in range(PHOTOS_PER_TRIP)]
+    )
+    conn.commit()
+    conn.close()
+    return trip_count
+
+
+def report(database, label, trip_count):
+    conn = sqlite3.connect(database)
+    print(f'\n=== {label} ===')
+    for name, sql in QUERIES.items():
+        param = USERS // 2 if name.startswith('index') else trip_count // 2
+        plan = ' / '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, (param,)))
+
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            conn.execute(sql, (param,)).fetchall()
+        avg_ms = (time.perf_counter() - start) / RUNS * 1000
+
+        print(f'{name:20} {avg_ms:8.3f} ms   {plan}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        migrate(database, target=1)
+        trip_count = fill(database)
+        print(f'{USERS} users, {trip_count} trips, '
+              f'{trip_count * ENTRIES_PER_TRIP} journal entries, {trip_count * PHOTOS_PER_TRIP} photos')
+
+        report(database, 'before (schema v1, no indexes)', trip_count)
+        migrate(database)
+        report(database, 'after (latest schema)', trip_count)
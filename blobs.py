@@ -0,0 +1,210 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import uuid
+from werkzeug.utils import secure_filename
+
+from images import generate_derivatives, image_sources, remove_derivatives
+
+# ============================================================================
+# CONTENT-ADDRESSED UPLOAD STORE
+# ============================================================================
+#
+# Uploads are stored ONCE under the SHA-256 of their bytes:
+#
+#   static/uploads/3f2a...c9.png
+#
+# so uploading the same screenshot again (or on another trip) just points a
+# new Album / Trips row at the existing file. The Blobs table counts how many
+# rows point at each file; triggers (migration 4) keep the counts in sync on
+# every insert / update / delete, including cascades and starter trip copies.
+# A file being stored holds a reference of its own until its rows are written.
+# Files whose count drops to 0 are removed by collect_garbage().
+
+STATIC_FOLDER = 'static'
+CHUNK_SIZE = 64 * 1024
+
+# Files in uploads/ that the templates use directly (never garbage)
+SITE_FILES = {'login-bg.jpg'}
+
+# File extensions that mean the same thing (so .jpeg and .jpg dedupe together)
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+
+def _extension(filename):
+    ext = secure_filename(filename).rsplit('.', 1)[-1].lower()
+    return EXTENSION_ALIASES.get(ext, ext)
+
+
+# Hash the upload while streaming it to disk, then keep one copy per hash.
+# Returns the static-relative path to store in the database, with a reference
+# held on it (see _keep_copies) that the caller gives back with release().
+def store_upload(conn, file, upload_folder, static_folder=STATIC_FOLDER):
+    temp_path = os.path.join(upload_folder, f'.upload-{uuid.uuid4().hex}')
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return _keep_copies(conn, [(temp_path, digest.hexdigest(), file.filename)], upload_folder, static_folder)[0]
+
+
+# Same as store_upload() for a file that is already on disk (it gets moved)
+def store_file(conn, path, filename, upload_folder, static_folder=STATIC_FOLDER):
+    return store_files(conn, [(path, filename)], upload_folder, static_folder)[0]
+
+
+# store_file() for many files at once: [(path, filename), ...] -> [path, ...]
+def store_files(conn, files, upload_folder, static_folder=STATIC_FOLDER):
+    return _keep_copies(conn, [(path, _file_hash(path), filename) for path, filename in files],
+                        upload_folder, static_folder)
+
+
+# Take a reference on every file (committed) BEFORE looking at what is on disk.
+# collect_garbage() only removes files nothing references, and only while it
+# holds the write lock - so a copy we find on disk can't go away any more, and
+# one it already removed is put back from our temp copy.
+def _keep_copies(conn, files, upload_folder, static_folder):
+    final_paths = [os.path.join(upload_folder, f'{hexdigest}.{_extension(filename)}')
+                   for _, hexdigest, filename in files]
+    blob_paths = [os.path.relpath(path, static_folder).replace(os.sep, '/') for path in final_paths]
+    claimed = False
+    try:
+        conn.executemany('''
+            INSERT INTO Blobs (blob_path, ref_count) VALUES (?, 1)
+            ON CONFLICT(blob_path) DO UPDATE SET ref_count = ref_count + 1
+        ''', [(blob_path,) for blob_path in blob_paths])
+        conn.commit()
+        claimed = True
+        for (temp_path, _, _), final_path in zip(files, final_paths):
+            if os.path.exists(final_path):
+                os.remove(temp_path)  # already have these bytes
+            else:
+                os.replace(temp_path, final_path)
+    except BaseException:
+        for temp_path, _, _ in files:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if claimed:
+            release(conn, blob_paths)
+            conn.commit()
+        raise
+    return blob_paths
+
+
+# Give back the references store_upload() / store_file(s) took, once the rows
+# point at the files (doesn't commit - it goes with the caller's row changes)
+def release(conn, blob_paths):
+    conn.executemany('UPDATE Blobs SET ref_count = ref_count - 1 WHERE blob_path = ?',
+                     [(blob_path,) for blob_path in blob_paths])
+
+
+# Delete files nobody references any more (call after committing a delete/replace).
+# The files go before the commit, while the DELETE still holds the write lock,
+# so an upload of the same bytes waits for it in _keep_copies().
+def collect_garbage(conn, static_folder=STATIC_FOLDER):
+    orphans = conn.execute('DELETE FROM Blobs WHERE ref_count <= 0 RETURNING blob_path').fetchall()
+
+    removed = []
+    try:
+        for (blob_path,) in orphans:
+            # Only ever delete user uploads (seed data points at other static files)
+            if not blob_path.startswith('uploads/'):
+                continue
+            full_path = os.path.join(static_folder, blob_path)
+            if os.path.exists(full_path):
+                os.remove(full_path)
+            remove_derivatives(blob_path, static_folder)
+            removed.append(blob_path)
+    finally:
+        conn.commit()
+    return removed
+
+
+# ============================================================================
+# DEDUPE EXISTING UPLOADS: python blobs.py [database] [--delete-unreferenced]
+# ============================================================================
+#
+# Older uploads are named "<timestamp>_<filename>", so the same photo can be
+# stored many times. This moves every referenced upload to its hash name,
+# repoints the rows (the triggers move the counts across) and removes the
+# copies nothing points at any more.
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dedupe_existing(database, static_folder=STATIC_FOLDER, delete_unreferenced=False):
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA foreign_keys = ON')
+    try:
+        paths = [row[0] for row in conn.execute(
+            "SELECT blob_path FROM Blobs WHERE blob_path LIKE 'uploads/%' AND ref_count > 0")]
+
+        moved = 0
+        for old_path in paths:
+            full_path = os.path.join(static_folder, old_path)
+            if not os.path.isfile(full_path):
+                print(f'Missing file, skipping: {old_path}')
+                continue
+
+            filename = f'{_file_hash(full_path)}.{_extension(old_path)}'
+            new_path = f'uploads/{filename}'
+            if new_path == old_path:
+                continue
+
+            new_full_path = os.path.join(static_folder, new_path)
+            if not os.path.exists(new_full_path):
+                os.replace(full_path, new_full_path)
+                if not image_sources(new_path, static_folder):
+                    try:
+                        generate_derivatives(new_path, static_folder)
+                    except OSError as e:
+                        print(f'No thumbnails for {new_path}: {e}')
+            conn.execute('UPDATE Album SET photo_path = ? WHERE photo_path = ?', (new_path, old_path))
+            conn.execute('UPDATE Trips SET trip_image = ? WHERE trip_image = ?', (new_path, old_path))
+            conn.commit()
+            moved += 1
+
+        removed = collect_garbage(conn, static_folder)
+        print(f'Repointed {moved} uploads, removed {len(removed)} duplicate files')
+
+        # Files in uploads/ that no row has ever pointed at
+        referenced = {row[0] for row in conn.execute('SELECT blob_path FROM Blobs')}
+        upload_folder = os.path.join(static_folder, 'uploads')
+        unreferenced = [name for name in sorted(os.listdir(upload_folder))
+                        if os.path.isfile(os.path.join(upload_folder, name))
+                        and f'uploads/{name}' not in referenced
+                        and name not in SITE_FILES]
+        for name in unreferenced:
+            if delete_unreferenced:
+                os.remove(os.path.join(upload_folder, name))
+                remove_derivatives(f'uploads/{name}', static_folder)
+            else:
+                print(f'Unreferenced: uploads/{name}')
+        if unreferenced and delete_unreferenced:
+            print(f'Deleted {len(unreferenced)} unreferenced files')
+        elif unreferenced:
+            print('Re-run with --delete-unreferenced to remove these')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    dedupe_existing(args[0] if args else 'part_a.db',
+                    delete_unreferenced='--delete-unreferenced' in sys.argv)
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+# ============================================================================
+# RENDER CACHE (TRIP, JOURNAL AND ALBUM PAGES)
+# ============================================================================
+#
+# Those pages only change when someone writes to the trip, so the rendered
+# HTML is kept in memory, keyed by (user_id, route, trip_id, sort). A hit
+# skips both SQLite and Jinja. Entries are tagged with their trip_id and every
+# route (or upload job) that changes a trip drops that trip's pages with
+# invalidate_trips() - for all users, since starter trips are shared.
+#
+# Least recently used pages are evicted once the cached HTML passes
+# RENDER_CACHE_MAX_BYTES. The cache is per process: each worker process warms
+# its own, and a write in one process only clears that process's copy, so run
+# with RENDER_CACHE_MAX_BYTES = 0 (off) when serving from several processes.
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class RenderCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()  # key -> html, least recently used first
+        self._by_trip = {}  # trip_id -> set of keys
+        self._generations = {}  # trip_id -> times invalidated
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._pages.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return html
+
+    # Read before querying the database; hand it back to put() so a page
+    # rendered from data that changed in the meantime isn't stored
+    def generation(self, trip_id):
+        with self._lock:
+            return self._generations.get(trip_id, 0)
+
+    def put(self, key, html, generation):
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._generations.get(key[2], 0) != generation:
+                return
+            if key in self._pages:
+                self._remove(key)
+            self._pages[key] = html
+            self._by_trip.setdefault(key[2], set()).add(key)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._pages)))
+                self.evictions += 1
+
+    # Drop every cached page for these trips (call after the write commits)
+    def invalidate_trips(self, *trip_ids):
+        with self._lock:
+            for trip_id in trip_ids:
+                self._generations[trip_id] = self._generations.get(trip_id, 0) + 1
+                for key in self._by_trip.pop(trip_id, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._by_trip.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._pages), 'bytes': self._size, 'max_bytes': self.max_bytes}
+
+    def _remove(self, key):
+        html = self._pages.pop(key, None)
+        if html is None:
+            return
+        self._size -= len(html)
+        keys = self._by_trip.get(key[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_trip[key[2]]
+
+
+# Keys are always built here: the trip_id must stay at index 2 (see _remove)
+def page_key(user_id, route, trip_id, sort=None):
+    return (user_id, route, trip_id, sort)
+
+
+def get_cache(app=None):
+    app = app or current_app
+    return app.extensions['render_cache']
+
+
+# Called from background jobs and write routes alike
+def invalidate_trips(*trip_ids):
+    get_cache().invalidate_trips(*trip_ids)
+
+
+def init_app(app):
+    app.config.setdefault('RENDER_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    app.extensions['render_cache'] = RenderCache(app.config['RENDER_CACHE_MAX_BYTES'])
@@ -0,0 +1,107 @@
+import sqlite3
+import queue
+import threading
+from flask import g, current_app
+
+# ============================================================================
+# DATABASE CONNECTION POOL
+# ============================================================================
+#
+# Every route used to open (and close) its own sqlite3 connection, re-running
+# the connection setup on every hit. Instead we keep a small pool of warm
+# connections per process. Each request borrows ONE connection (stored on
+# flask.g) and hands it back in teardown_appcontext.
+
+DEFAULT_DATABASE = 'part_a.db'
+DEFAULT_POOL_SIZE = 8
+DEFAULT_STATEMENT_CACHE = 128
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, database, size=DEFAULT_POOL_SIZE, cached_statements=DEFAULT_STATEMENT_CACHE,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.cached_statements = cached_statements
+        self.factory = factory  # profiling.ProfiledConnection when profiling is on
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    # Open and configure a brand-new connection (only done when the pool is empty)
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            check_same_thread=False,  # connections move between worker threads via the pool
+            cached_statements=self.cached_statements,
+            factory=self.factory,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute('PRAGMA busy_timeout = 5000')
+        return conn
+
+    # Borrow a connection (reuse an idle one if we have it)
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    # Give a connection back, or close it if the pool is already full
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    # Close every idle connection (used by tests / scripts / shutdown)
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Get (or lazily build) the pool for the current app's database
+def get_pool(app=None):
+    app = app or current_app
+    database = app.config.get('DATABASE', DEFAULT_DATABASE)
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = ConnectionPool(
+                database,
+                size=app.config.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE),
+                cached_statements=app.config.get('DB_STATEMENT_CACHE', DEFAULT_STATEMENT_CACHE),
+                factory=app.config.get('DB_CONNECTION_FACTORY', sqlite3.Connection),
+            )
+            _pools[database] = pool
+        return pool
+
+
+# Connection for the current request (one per request / app context)
+def get_db():
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+# Return the request's connection to the pool
+def close_db(e=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', DEFAULT_DATABASE)
+    app.config.setdefault('DB_POOL_SIZE', DEFAULT_POOL_SIZE)
+    app.config.setdefault('DB_STATEMENT_CACHE', DEFAULT_STATEMENT_CACHE)
+    app.teardown_appcontext(close_db)
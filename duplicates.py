@@ -0,0 +1,234 @@
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow not installed: no hashes, so no duplicate warnings
+    Image = None
+
+from starter import visible_trips_clause
+
+# ============================================================================
+# NEAR-DUPLICATE PHOTOS (PERCEPTUAL HASHES)
+# ============================================================================
+#
+# Byte-identical uploads already share one file (blobs.py), but a screenshot
+# saved again, resized or re-encoded is a new file. Every processed upload
+# also gets a 64-bit difference hash (dHash): the photo shrunk to 9 x 8 grey
+# pixels, one bit per "is this pixel brighter than the one to its right".
+# Copies of the same picture end up a few bits apart; different pictures
+# about half the bits apart.
+#
+# ImageHashes (migration 16) stores the hash per file, split into four 16-bit
+# bands with an index each (a multi-index hash table). If two hashes are at
+# most MAX_DISTANCE = 7 bits apart, one of the four bands differs by at most
+# 1 bit (7 // 4), so a lookup only probes each band's index for its value and
+# the 16 values one bit away - 68 index probes, then the exact distance is
+# checked on the handful of rows they find. No scan over everyone's hashes.
+#
+# Where it shows up:
+#   - upload jobs (jobs.py) hash the photo and note what it looks like, so the
+#     upload page can warn "you already have this one"
+#   - /album/<trip_id>/duplicates lists the trip's photos with their look-alikes
+#   - python duplicates.py hashes existing uploads on a process pool
+
+HASH_WIDTH, HASH_HEIGHT = 9, 8  # 8 comparisons per row, 8 rows: 64 bits
+BANDS = 4
+BAND_BITS = 16
+MAX_DISTANCE = 7  # must stay below 2 * BANDS: the probes cover one flipped bit per band
+BACKFILL_WORKERS = os.cpu_count() or 2
+BACKFILL_BATCH = 500
+
+_BAND_MASK = (1 << BAND_BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+
+
+# 64-bit dHash of an image file (as an unsigned int), or None if it isn't one
+def dhash(path):
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (HASH_WIDTH * 8, HASH_HEIGHT * 8))  # JPEGs: decode at a fraction of the size
+            pixels = image.convert('L').resize((HASH_WIDTH, HASH_HEIGHT), Image.LANCZOS).tobytes()  # one byte per pixel
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    bits = 0
+    for row in range(HASH_HEIGHT):
+        for col in range(HASH_WIDTH - 1):
+            left, right = pixels[row * HASH_WIDTH + col], pixels[row * HASH_WIDTH + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def _bands(bits):
+    return [(bits >> (BAND_BITS * band)) & _BAND_MASK for band in range(BANDS)]
+
+
+# SQLite integers are signed 64-bit
+def _to_signed(bits):
+    return bits - (1 << 64) if bits >= 1 << 63 else bits
+
+
+def _distance(a, b):
+    return ((a ^ b) & _HASH_MASK).bit_count()
+
+
+# Store a file's hash (computing it unless given). Returns the hash or None.
+# Doesn't commit.
+def save_hash(conn, blob_path, static_folder='static', bits=None):
+    if bits is None:
+        bits = dhash(os.path.join(static_folder, blob_path))
+    if bits is None:
+        return None
+    conn.execute('''
+        INSERT INTO ImageHashes (blob_path, dhash, band0, band1, band2, band3) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(blob_path) DO NOTHING
+    ''', (blob_path, _to_signed(bits), *_bands(bits)))
+    return bits
+
+
+# ============================================================================
+# LOOKUPS
+# ============================================================================
+
+# Files that look like each given hash: {key: {blob_path: distance}}, for
+# hashes = {key: bits}. One query for all of them (the probes go in as JSON).
+def _look_alikes(conn, hashes):
+    probes = []
+    for key, bits in hashes.items():
+        for band, value in enumerate(_bands(bits)):
+            for candidate in (value, *(value ^ (1 << bit) for bit in range(BAND_BITS))):
+                probes.append([key, band, candidate])
+    if not probes:
+        return {}
+    per_band = ' UNION '.join(f'''
+        SELECT probes.probe, ImageHashes.blob_path, ImageHashes.dhash
+        FROM probes JOIN ImageHashes ON ImageHashes.band{band} = probes.bits
+        WHERE probes.band = {band}
+    ''' for band in range(BANDS))
+    rows = conn.execute(f'''
+        WITH probes AS MATERIALIZED (
+            SELECT json_extract(value, '$[0]') AS probe, json_extract(value, '$[1]') AS band,
+                   json_extract(value, '$[2]') AS bits
+            FROM json_each(?)
+        )
+        {per_band}
+    ''', (json.dumps(probes),)).fetchall()
+
+    found = {key: {} for key in hashes}
+    for key, blob_path, other in rows:
+        distance = _distance(hashes[key], other)
+        if distance <= MAX_DISTANCE:
+            found[key][blob_path] = distance
+    return found
+
+
+# Album photos the user can see that use any of these files:
+# {blob_path: [row, ...]} (rows have photo_id, photo_path, photo_alt, trip_id, trip_location)
+def _visible_photos(conn, user_id, blob_paths):
+    if not blob_paths:
+        return {}
+    visible, params = visible_trips_clause(conn, user_id)
+    rows = conn.execute(f'''
+        SELECT Album.photo_id, Album.photo_path, Album.photo_alt, Album.trip_id, visible_trips.trip_location
+        FROM Album
+        JOIN (SELECT trip_id, trip_location FROM Trips WHERE {visible}) AS visible_trips
+          ON visible_trips.trip_id = Album.trip_id
+        WHERE Album.photo_path IN (SELECT value FROM json_each(?))
+        ORDER BY Album.photo_id
+    ''', (*params, json.dumps(sorted(blob_paths)))).fetchall()
+    photos = {}
+    for row in rows:
+        photos.setdefault(row['photo_path'], []).append(row)
+    return photos
+
+
+# The user's photos that look like the file at blob_path (other than the
+# photo ids in `exclude`), closest first: [{photo_id, trip_id, trip_location, distance}]
+def similar_photos(conn, user_id, blob_path, exclude=()):
+    row = conn.execute('SELECT dhash FROM ImageHashes WHERE blob_path = ?', (blob_path,)).fetchone()
+    if row is None:
+        return []
+    matches = _look_alikes(conn, {0: row[0] & _HASH_MASK})[0]
+    photos = _visible_photos(conn, user_id, matches)
+    similar = [{'photo_id': photo['photo_id'], 'trip_id': photo['trip_id'],
+                'trip_location': photo['trip_location'], 'distance': distance}
+               for path, distance in matches.items() for photo in photos.get(path, ())
+               if photo['photo_id'] not in exclude]
+    return sorted(similar, key=lambda photo: (photo['distance'], photo['photo_id']))
+
+
+# Possible duplicates for a trip's album: [(photo, [(other photo, distance), ...])]
+# for every photo of the trip that looks like another photo the user has
+# (in this trip or any other). A pair inside the trip is listed once.
+def trip_duplicates(conn, user_id, trip_id):
+    photos = conn.execute('''
+        SELECT Album.photo_id, Album.photo_path, Album.photo_alt, Album.trip_id, ImageHashes.dhash
+        FROM Album JOIN ImageHashes ON ImageHashes.blob_path = Album.photo_path
+        WHERE Album.trip_id = ?
+        ORDER BY Album.date_added DESC, Album.photo_id DESC
+    ''', (trip_id,)).fetchall()
+    matches = _look_alikes(conn, {photo['photo_id']: photo['dhash'] & _HASH_MASK for photo in photos})
+    others = _visible_photos(conn, user_id, {path for found in matches.values() for path in found})
+
+    groups, listed = [], set()
+    for photo in photos:
+        found = sorted(((other, distance) for path, distance in matches[photo['photo_id']].items()
+                        for other in others.get(path, ()) if other['photo_id'] != photo['photo_id']
+                        and (other['photo_id'], photo['photo_id']) not in listed),
+                       key=lambda match: (match[1], match[0]['photo_id']))
+        listed.update((photo['photo_id'], other['photo_id']) for other, _ in found)
+        if found:
+            groups.append((photo, found))
+    return groups
+
+
+# ============================================================================
+# BACKFILL: python duplicates.py [database] [--workers N]
+# ============================================================================
+#
+# Hashes every album photo that has no hash yet. Decoding is CPU-bound, so it
+# runs on a process pool; the database is only written from this process.
+
+def _hash_file(args):
+    blob_path, static_folder = args
+    return blob_path, dhash(os.path.join(static_folder, blob_path))
+
+
+def backfill(database, static_folder='static', workers=BACKFILL_WORKERS):
+    conn = sqlite3.connect(database)
+    try:
+        paths = [row[0] for row in conn.execute('''
+            SELECT DISTINCT photo_path FROM Album
+            WHERE photo_path NOT IN (SELECT blob_path FROM ImageHashes)
+        ''') if os.path.isfile(os.path.join(static_folder, row[0]))]
+        hashed = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_hash_file, [(path, static_folder) for path in paths], chunksize=16)
+            for blob_path, bits in results:
+                if bits is None:
+                    print(f'Skipping {blob_path}: not an image Pillow can read')
+                    continue
+                save_hash(conn, blob_path, bits=bits)
+                hashed += 1
+                if hashed % BACKFILL_BATCH == 0:
+                    conn.commit()
+        conn.commit()
+        print(f'Hashed {hashed} of {len(paths)} photos')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    if Image is None:
+        sys.exit('Pillow is required: pip install Pillow')
+    args, workers = sys.argv[1:], BACKFILL_WORKERS
+    if '--workers' in args:
+        index = args.index('--workers')
+        workers = int(args[index + 1])
+        del args[index:index + 2]
+    backfill(args[0] if args else 'part_a.db', workers=workers)
@@ -0,0 +1,247 @@
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+
+from starter import has_starter_content, STARTER_USER_ID
+
+# ============================================================================
+# TRIP LOCATIONS ON A MAP (OFFLINE GAZETTEER + R*TREE)
+# ============================================================================
+#
+# Trips.trip_location is free text ("New York", "Bali", "Paris, France"). It
+# is looked up once, when the trip is saved, in data/places.csv - a small
+# gazetteer bundled with the app (countries, big cities, islands and the
+# usual destinations), so there is no geocoding service to call or wait for.
+# The point found goes into TripPoints (migration 13), an R*Tree with
+# three dimensions: the owner's user_id, latitude and longitude. "This user's
+# trips inside this box" is then one R*Tree search, however many trips other
+# users have. The tree's dimensions are 32-bit floats, rounded outward, so
+# they only narrow the search: the exact user_id / lat / lon are kept in
+# auxiliary columns, checked on the rows it finds and returned. Locations
+# the gazetteer doesn't know simply have no point.
+#
+# The map asks for a bounding box and a zoom level:
+#
+#   GET /api/v1/map?bbox=<west>,<south>,<east>,<north>&zoom=<0-22>
+#
+# and gets clustered markers back: the points are grouped into a fixed grid
+# of cells CLUSTER_PIXELS wide at that zoom (by GROUP BY, in SQLite), one
+# marker per cell. Cells are counted from -180 / -90, not from the box, so
+# markers don't jump around as the map is dragged. The answer is bounded by
+# the number of cells on screen, not the number of trips.
+#
+# Triggers drop a trip's point when it is deleted or its location changes,
+# and copy it along with a starter trip (see starter.py). create() / update()
+# / imports call locate_trip(); `python geo.py` locates any trips left over.
+
+PLACES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'places.csv')
+
+TILE_SIZE = 256  # pixels per map tile (Web Mercator, the world is one tile at zoom 0)
+CLUSTER_PIXELS = 64  # cell size on screen
+MAX_ZOOM = 22
+MAX_CELLS = 256  # per side of the box: a bigger box needs a lower zoom
+
+_places = None  # normalized name -> [(population, lat, lon, country), ...], biggest first
+_countries = None  # normalized country name or alias ("uk") -> country
+_places_lock = threading.Lock()
+
+
+# "São Paulo, Brazil" -> "sao paulo brazil"
+def _normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def _load_places():
+    global _places, _countries
+    with _places_lock:
+        if _places is None:
+            places, countries = {}, {}
+            with open(PLACES_FILE, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    country = _normalize(row['country'])
+                    place = (int(row['population']), float(row['lat']), float(row['lon']), country)
+                    names = [_normalize(name) for name in (row['name'], *row['alternate_names'].split('|')) if name]
+                    for name in dict.fromkeys(names):
+                        places.setdefault(name, []).append(place)
+                        if names[0] == country:
+                            countries[name] = country
+            for candidates in places.values():
+                candidates.sort(reverse=True)
+            _places, _countries = places, countries
+        return _places, _countries
+
+
+# (lat, lon) for a trip location, or None. Tries the whole text, then
+# "place, country" (the biggest place of that name in that country), then the
+# first part alone, then the last part ("A little village, Italy" -> Italy).
+def geocode(location):
+    places, countries = _load_places()
+    whole = _normalize(location)
+    if whole in places:
+        return places[whole][0][1:3]
+
+    parts = [_normalize(part) for part in location.split(',')]
+    parts = [part for part in parts if part]
+    if len(parts) < 2:
+        return None
+    first, last = parts[0], parts[-1]
+    country = countries.get(last)
+    if country and first in places:
+        for _, lat, lon, place_country in places[first]:
+            if place_country == country:
+                return lat, lon
+    for part in (first, last):
+        if part in places:
+            return places[part][0][1:3]
+    return None
+
+
+# ============================================================================
+# TRIP POINTS
+# ============================================================================
+
+# Store (or clear) the point for a trip. Doesn't commit.
+def locate_trip(conn, trip_id, user_id, location):
+    point = geocode(location or '')
+    if point is None:
+        conn.execute('DELETE FROM TripPoints WHERE trip_id = ?', (trip_id,))
+        return None
+    lat, lon = point
+    conn.execute('''
+        INSERT OR REPLACE INTO TripPoints (trip_id, min_user, max_user, min_lat, max_lat, min_lon, max_lon, user_id, lat, lon)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (trip_id, user_id, user_id, lat, lat, lon, lon, user_id, lat, lon))
+    return point
+
+
+# Store the points for many new trips at once: [(trip_id, user_id, location)].
+# Returns how many were found. Doesn't commit.
+def locate_trips(conn, trips):
+    points = []
+    for trip_id, user_id, location in trips:
+        point = geocode(location or '')
+        if point is not None:
+            lat, lon = point
+            points.append((trip_id, user_id, user_id, lat, lat, lon, lon, user_id, lat, lon))
+    conn.executemany('''
+        INSERT OR REPLACE INTO TripPoints (trip_id, min_user, max_user, min_lat, max_lat, min_lon, max_lon, user_id, lat, lon)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', points)
+    return len(points)
+
+
+# Locate every trip that has no point yet (all of them with relocate=True).
+# Returns (trips looked at, trips located). Doesn't commit.
+def locate_missing(conn, relocate=False):
+    if relocate:
+        conn.execute('DELETE FROM TripPoints')
+    trips = conn.execute('''
+        SELECT trip_id, user_id, trip_location FROM Trips
+        WHERE trip_id NOT IN (SELECT trip_id FROM TripPoints)
+    ''').fetchall()
+    return len(trips), locate_trips(conn, trips)
+
+
+# ============================================================================
+# CLUSTERED MARKERS FOR A BOUNDING BOX
+# ============================================================================
+
+class InvalidBox(ValueError):
+    pass
+
+
+def cell_size(zoom):
+    return 360 / (TILE_SIZE * 2 ** zoom) * CLUSTER_PIXELS
+
+
+# One R*Tree search per owner: the user's own points, plus the starter
+# trips they still share. The (rounded) boxes are searched for overlap, then
+# the exact auxiliary values decide.
+def _points_sql(conn, user_id):
+    branch = '''
+        SELECT trip_id, lat, lon FROM TripPoints
+        WHERE min_user <= {owner} AND max_user >= {owner} AND user_id = {owner}
+          AND max_lat >= :south AND min_lat <= :north AND max_lon >= :west AND min_lon <= :east
+          AND lat BETWEEN :south AND :north AND lon BETWEEN :west AND :east
+    '''
+    own = branch.format(owner=':user')
+    if user_id == STARTER_USER_ID or not has_starter_content(conn, user_id):
+        return own
+    return own + 'UNION ALL' + branch.format(owner=':starter') + '''
+          AND trip_id NOT IN (SELECT template_trip_id FROM StarterOverrides WHERE user_id = :user)
+    '''
+
+
+def _clusters(conn, user_id, south, west, north, east, cell):
+    return conn.execute(f'''
+        SELECT CAST((lat + 90) / :cell AS INTEGER) AS cell_row,
+               CAST((lon + 180) / :cell AS INTEGER) AS cell_col,
+               COUNT(*) AS count, AVG(lat) AS lat, AVG(lon) AS lon,
+               MIN(lat) AS south, MIN(lon) AS west, MAX(lat) AS north, MAX(lon) AS east,
+               MIN(trip_id) AS trip_id
+        FROM ({_points_sql(conn, user_id)})
+        GROUP BY cell_row, cell_col
+    ''', {'user': user_id, 'starter': STARTER_USER_ID, 'cell': cell,
+          'south': south, 'west': west, 'north': north, 'east': east}).fetchall()
+
+
+# Markers for the trips the user can see inside the box, biggest clusters
+# first: {'lat', 'lon', 'count'} plus 'trip_id' and 'trip_location' for a
+# single trip, or the cluster's own 'bbox' (zoom in to it) for several.
+# A box with west > east crosses the 180th meridian.
+def markers(conn, user_id, west, south, east, north, zoom):
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise InvalidBox('bbox must be west,south,east,north in degrees')
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise InvalidBox(f'zoom must be from 0 to {MAX_ZOOM}')
+    cell = cell_size(zoom)
+    width = east - west if west <= east else 360 - (west - east)
+    if max(width, north - south) / cell > MAX_CELLS:
+        raise InvalidBox('bbox is too large for this zoom level')
+
+    spans = [(west, east)] if west <= east else [(west, 180), (-180, east)]
+    rows = [row for span_west, span_east in spans
+            for row in _clusters(conn, user_id, south, span_west, north, span_east, cell)]
+    rows.sort(key=lambda row: (-row['count'], row['trip_id']))
+
+    # Names for the single-trip markers (one query)
+    single = [row['trip_id'] for row in rows if row['count'] == 1]
+    names = dict(conn.execute('''
+        SELECT trip_id, trip_location FROM Trips WHERE trip_id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(single),)).fetchall()) if single else {}
+
+    result = []
+    for row in rows:
+        marker = {'lat': round(row['lat'], 5), 'lon': round(row['lon'], 5), 'count': row['count']}
+        if row['count'] == 1:
+            marker['trip_id'] = row['trip_id']
+            marker['trip_location'] = names.get(row['trip_id'])
+        else:
+            marker['bbox'] = [round(row[key], 5) for key in ('west', 'south', 'east', 'north')]
+        result.append(marker)
+    return result
+
+
+# ============================================================================
+# COMMAND LINE: python geo.py [database] [--relocate]
+# ============================================================================
+#
+# Locates trips that have no point (after the gazetteer gains places, or for
+# rows written by scripts); --relocate looks every trip up again.
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    conn = sqlite3.connect(args[0] if args else 'part_a.db')
+    try:
+        checked, located = locate_missing(conn, relocate='--relocate' in sys.argv)
+        conn.commit()
+        print(f'Located {located} of {checked} trips')
+    finally:
+        conn.close()
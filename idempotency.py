@@ -0,0 +1,119 @@
+import re
+import time
+from functools import wraps
+from flask import request, session, make_response
+
+from db import get_db
+
+# ============================================================================
+# IDEMPOTENCY KEYS (REPLAYED OFFLINE WRITES)
+# ============================================================================
+#
+# The service worker queues journal entries and photo uploads made offline
+# and sends them again once the connection is back - possibly more than once
+# (the first attempt may have reached the server before the connection
+# dropped). Each submission carries a key (Idempotency-Key header, or
+# ?idempotency_key= on the form action, set by static/js/offline.js), and
+# @idempotent routes run at most once per user and key:
+#
+#   1. The key is claimed (inserted with no response yet) and committed.
+#   2. The route runs.
+#   3. Its response (status, redirect, small bodies) is stored with the key.
+#
+# A repeat gets the stored response back without running the route again, or
+# 409 while the first one is still running. Errors (5xx, exceptions) release
+# the key so the request can be retried. Keys are kept for KEEP_FOR.
+
+KEY_HEADER = 'Idempotency-Key'
+KEY_ARG = 'idempotency_key'
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,100}$')
+KEEP_FOR = 24 * 60 * 60
+STALE_AFTER = 5 * 60  # still "running" after this long: that process died
+MAX_STORED_BODY = 64 * 1024
+
+
+def _request_key():
+    key = request.headers.get(KEY_HEADER) or request.args.get(KEY_ARG)
+    return key if key and KEY_PATTERN.match(key) else None
+
+
+# True if this request now owns the key
+def _claim(conn, user_id, key):
+    now = int(time.time())
+    conn.execute('DELETE FROM IdempotencyKeys WHERE created_at < ?', (now - KEEP_FOR,))
+    conn.execute('''
+        DELETE FROM IdempotencyKeys
+        WHERE user_id = ? AND idempotency_key = ? AND response_status IS NULL AND created_at < ?
+    ''', (user_id, key, now - STALE_AFTER))
+    claimed = conn.execute('''
+        INSERT INTO IdempotencyKeys (user_id, idempotency_key, endpoint, created_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+    ''', (user_id, key, request.endpoint, now))
+    conn.commit()
+    return claimed.rowcount == 1
+
+
+def _release(conn, user_id, key):
+    if conn.in_transaction:
+        conn.rollback()
+    conn.execute('DELETE FROM IdempotencyKeys WHERE user_id = ? AND idempotency_key = ?', (user_id, key))
+    conn.commit()
+
+
+def _store(conn, user_id, key, response):
+    body = None
+    if not response.direct_passthrough and not response.is_streamed:
+        data = response.get_data()
+        body = data if len(data) <= MAX_STORED_BODY else None
+    conn.execute('''
+        UPDATE IdempotencyKeys
+        SET response_status = ?, response_location = ?, response_type = ?, response_body = ?
+        WHERE user_id = ? AND idempotency_key = ?
+    ''', (response.status_code, response.headers.get('Location'), response.headers.get('Content-Type'),
+          body, user_id, key))
+    conn.commit()
+
+
+def _replay(row):
+    response = make_response(row['response_body'] or b'', row['response_status'])
+    if row['response_location']:
+        response.headers['Location'] = row['response_location']
+    if row['response_type']:
+        response.headers['Content-Type'] = row['response_type']
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+# Route decorator (after @login_required). Requests without a key run as usual.
+def idempotent(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = _request_key()
+        if request.method != 'POST' or key is None:
+            return f(*args, **kwargs)
+
+        conn = get_db()
+        user_id = session['user_id']
+        if not _claim(conn, user_id, key):
+            row = conn.execute('''
+                SELECT endpoint, response_status, response_location, response_type, response_body
+                FROM IdempotencyKeys WHERE user_id = ? AND idempotency_key = ?
+            ''', (user_id, key)).fetchone()
+            if row is None or row['response_status'] is None:
+                return "This request is still being processed", 409, {'Retry-After': '2'}
+            if row['endpoint'] != request.endpoint:
+                return "Idempotency key was already used for a different request", 422
+            return _replay(row)
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except BaseException:
+            _release(conn, user_id, key)
+            raise
+        if response.status_code >= 500:
+            _release(conn, user_id, key)
+        else:
+            _store(conn, user_id, key, response)
+        return response
+    return decorated_function
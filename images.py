@@ -0,0 +1,161 @@
+import os
+import posixpath
+import sys
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow not installed: uploads still work, just no thumbnails
+    Image = None
+
+# ============================================================================
+# RESPONSIVE IMAGE DERIVATIVES
+# ============================================================================
+#
+# Uploads can be up to 16MB, but the home page cards and album grid only show
+# them a few hundred pixels wide. When a photo is uploaded we also write
+# smaller WebP (and AVIF, if Pillow supports it) copies:
+#
+#   static/uploads/1762936892_paris.jpg
+#   static/uploads/derived/1762936892_paris-320.webp
+#   static/uploads/derived/1762936892_paris-640.avif   ...
+#
+# The templates list them in srcset/sizes so the browser picks the smallest
+# one that fits, and fall back to the original for anything else.
+
+STATIC_FOLDER = 'static'
+DERIVED_DIR = 'derived'
+WIDTHS = (320, 640, 1280)
+QUALITY = {'webp': 80, 'avif': 60}
+ORIENTATION_TAG = 0x0112
+
+# Remembers which derivatives exist for an image (only once they've been found)
+_sources_cache = {}
+
+
+def available_formats():
+    if Image is None:
+        return []
+    formats = []
+    if features.check('avif'):
+        formats.append('avif')  # smallest, listed first so browsers prefer it
+    if features.check('webp'):
+        formats.append('webp')
+    return formats
+
+
+# static-relative path of one derivative, e.g. uploads/derived/x-640.webp
+def derivative_path(image_path, width, fmt):
+    folder, filename = os.path.split(image_path)
+    stem = os.path.splitext(filename)[0]
+    return posixpath.join(folder, DERIVED_DIR, f"{stem}-{width}.{fmt}")
+
+
+# Write every width/format for one uploaded image (path relative to static/)
+def generate_derivatives(image_path, static_folder=STATIC_FOLDER):
+    formats = available_formats()
+    if not formats:
+        return []
+
+    source = os.path.join(static_folder, image_path)
+    os.makedirs(os.path.join(os.path.dirname(source), DERIVED_DIR), exist_ok=True)
+
+    written = []
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)  # phone photos store rotation in EXIF
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        # Never upscale: a small original gets one derivative (in the smallest slot)
+        widths = [w for w in WIDTHS if w < image.width] or [WIDTHS[0]]
+
+        for width in widths:
+            size = (min(width, image.width), round(image.height * min(width, image.width) / image.width))
+            resized = image.resize(size, Image.LANCZOS)
+            for fmt in formats:
+                path = derivative_path(image_path, width, fmt)
+                resized.save(os.path.join(static_folder, path), fmt.upper(), quality=QUALITY[fmt])
+                written.append(path)
+
+    _sources_cache.pop(image_path, None)
+    return written
+
+
+# {format: [(width, path), ...]} for the derivatives that exist on disk
+def image_sources(image_path, static_folder=STATIC_FOLDER):
+    if not image_path:
+        return {}
+    if image_path in _sources_cache:
+        return _sources_cache[image_path]
+
+    sources = {}
+    for fmt in ('avif', 'webp'):
+        found = [(w, derivative_path(image_path, w, fmt)) for w in WIDTHS
+                 if os.path.exists(os.path.join(static_folder, derivative_path(image_path, w, fmt)))]
+        if found:
+            sources[fmt] = found
+
+    if sources:
+        _sources_cache[image_path] = sources
+    return sources
+
+
+# Remove EXIF (GPS position, camera serials...) from an upload, in place.
+# Any rotation stored in EXIF is applied first so the photo still looks right.
+def strip_metadata(path):
+    if Image is None:
+        return False
+    with Image.open(path) as original:
+        if 'exif' not in original.info or getattr(original, 'n_frames', 1) > 1:
+            return False
+        fmt = original.format
+        original.load()
+        if original.getexif().get(ORIENTATION_TAG, 1) == 1:
+            # Nothing to rotate: JPEGs can keep their exact quantization tables
+            image, options = original, ({'quality': 'keep'} if fmt == 'JPEG' else {})
+        else:
+            image, options = ImageOps.exif_transpose(original), ({'quality': 95} if fmt == 'JPEG' else {})
+        image.info.pop('exif', None)
+        image.save(path, fmt, **options)  # no exif= argument, so none is written
+    return True
+
+
+# Delete an image's derivatives (used when the original goes away)
+def remove_derivatives(image_path, static_folder=STATIC_FOLDER):
+    folder, filename = os.path.split(image_path)
+    stem = os.path.splitext(filename)[0]
+    derived = os.path.join(static_folder, folder, DERIVED_DIR)
+    if os.path.isdir(derived):
+        for name in os.listdir(derived):
+            if name.rsplit('-', 1)[0] == stem:
+                os.remove(os.path.join(derived, name))
+    _sources_cache.pop(image_path, None)
+
+
+# ============================================================================
+# BACKFILL: python images.py [uploads folder]
+# ============================================================================
+
+def backfill(upload_folder=os.path.join(STATIC_FOLDER, 'uploads'), static_folder=STATIC_FOLDER):
+    done, skipped = 0, 0
+    for name in sorted(os.listdir(upload_folder)):
+        full = os.path.join(upload_folder, name)
+        if not os.path.isfile(full):
+            continue
+        image_path = os.path.relpath(full, static_folder).replace(os.sep, '/')
+        if image_sources(image_path, static_folder):
+            skipped += 1
+            continue
+        try:
+            written = generate_derivatives(image_path, static_folder)
+        except OSError as e:
+            print(f'Skipping {name}: {e}')
+            continue
+        print(f'{name}: {len(written)} derivatives')
+        done += 1
+    print(f'Backfill finished: {done} processed, {skipped} already done')
+
+
+if __name__ == '__main__':
+    if Image is None:
+        sys.exit('Pillow is required: pip install Pillow')
+    backfill(*sys.argv[1:2])
@@ -0,0 +1,150 @@
+import calendar
+import json
+from datetime import date
+
+from starter import has_starter_content, STARTER_USER_ID
+
+# ============================================================================
+# CALENDAR (INTERVAL INDEX OVER TRIP DATES AND JOURNAL ENTRIES)
+# ============================================================================
+#
+# Trip dates and journal entry dates are TEXT ("2024-06-01"), fine for ORDER
+# BY but no use for "what was on during these days": every calendar cell
+# would be a BETWEEN scan over all the user's rows. Migration 15 keeps them
+# as whole day numbers (days since 1970-01-01) in CalendarIndex, an R*Tree
+# over (user_id, first day, last day) - a trip is its [start, end] interval,
+# a journal entry the one day it was written. Both questions the calendar
+# asks are then a tree search, O(log n + matches):
+#
+#   overlap   first_day <= :last AND last_day >= :first   (a month, a new trip)
+#   stabbing  first_day <= :day AND last_day >= :day      (where was I on X)
+#
+# A month is one query, whatever the number of days or trips. "On this day"
+# stabs the same date in each of the last MEMORY_YEARS years at once: the day
+# numbers go in as one JSON array, and the R*Tree is searched once per day.
+#
+# Starter trips the user still shares are searched under their owner (see
+# starter.py), like everywhere else.
+
+MEMORY_YEARS = 50
+EXCERPT_CHARS = 160
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+class InvalidDate(ValueError):
+    pass
+
+
+# "2024-06-01" (or a date) -> days since 1970-01-01
+def day_number(value):
+    if isinstance(value, str):
+        try:
+            value = date.fromisoformat(value)
+        except ValueError:
+            raise InvalidDate(value)
+    return value.toordinal() - _EPOCH
+
+
+def day_date(number):
+    return date.fromordinal(number + _EPOCH)
+
+
+# "2024-06" -> (2024, 6)
+def parse_month(value):
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        date(year, month, 1)
+    except ValueError:
+        raise InvalidDate(value)
+    return year, month
+
+
+# ============================================================================
+# SEARCHES
+# ============================================================================
+
+# Index rows matching `condition` for the trips the user can see, with their
+# trip (and journal entry) columns. `days` (a list of day numbers) makes it a
+# stabbing search per day; each hit then says which day it matched.
+def _search(conn, user_id, condition, params, days=None):
+    if days is None:
+        source, day = 'CalendarIndex', 'NULL'
+    else:
+        # json_each first: one R*Tree search per day (not a scan per day)
+        source, day = 'json_each(:days) AS days CROSS JOIN CalendarIndex', 'days.value'
+    branch = f'''
+        SELECT {day} AS day, CalendarIndex.id AS id, CalendarIndex.trip_id AS trip_id, first_day, last_day
+        FROM {source}
+        WHERE min_user >= {{owner}} AND max_user <= {{owner}} AND {condition}
+    '''
+    hits = branch.format(owner=':user')
+    if user_id != STARTER_USER_ID and has_starter_content(conn, user_id):
+        hits += 'UNION ALL' + branch.format(owner=':starter') + '''
+          AND CalendarIndex.trip_id NOT IN (SELECT template_trip_id FROM StarterOverrides WHERE user_id = :user)
+        '''
+    return conn.execute(f'''
+        SELECT hits.day, hits.first_day, hits.last_day, hits.trip_id,
+               Trips.trip_location, Trips.trip_start, Trips.trip_end,
+               Journal.journal_id, Journal.entry_date,
+               substr(Journal.journal_entry, 1, :excerpt) AS excerpt
+        FROM ({hits}) AS hits
+        JOIN Trips ON Trips.trip_id = hits.trip_id
+        LEFT JOIN Journal ON hits.id % 2 = 1 AND Journal.journal_id = hits.id / 2
+        ORDER BY hits.day, hits.first_day, hits.id
+    ''', {**params, 'user': user_id, 'starter': STARTER_USER_ID, 'excerpt': EXCERPT_CHARS,
+          'days': json.dumps(days)}).fetchall()
+
+
+# Trips and journal entries overlapping [first, last] (day numbers)
+def _overlapping(conn, user_id, first, last):
+    rows = _search(conn, user_id, 'first_day <= :last AND last_day >= :first', {'first': first, 'last': last})
+    trips = [row for row in rows if row['journal_id'] is None]
+    entries = [row for row in rows if row['journal_id'] is not None]
+    return trips, entries
+
+
+# Trips the user was on at some point between start and end (dates; one date
+# for "where was I on X"). For warning about overlaps when adding a trip.
+def trips_during(conn, user_id, start, end=None):
+    first, last = day_number(start), day_number(end or start)
+    return _overlapping(conn, user_id, min(first, last), max(first, last))[0]
+
+
+# One month: the trips that overlap it and the journal entries written in it
+# (one query), plus the grid to draw - a list of weeks, each 7 x
+# {'date', 'in_month', 'trips', 'entries'}, Monday first.
+def month_calendar(conn, user_id, year, month):
+    first = day_number(date(year, month, 1))
+    last = first + calendar.monthrange(year, month)[1] - 1
+    trips, entries = _overlapping(conn, user_id, first, last)
+
+    weeks = []
+    for week in calendar.Calendar().monthdatescalendar(year, month):
+        cells = []
+        for day in week:
+            number = day_number(day)
+            cells.append({
+                'date': day,
+                'in_month': day.month == month,
+                'trips': [trip for trip in trips if trip['first_day'] <= number <= trip['last_day']],
+                'entries': [entry for entry in entries if entry['first_day'] == number],
+            })
+        weeks.append(cells)
+    return {'year': year, 'month': month, 'trips': trips, 'entries': entries, 'weeks': weeks}
+
+
+# "On this day": trips under way and journal entries written on today's date
+# in each earlier year (29 February only comes round in leap years). Each row
+# has `years_ago`, newest first.
+def on_this_day(conn, user_id, today=None):
+    today = today or date.today()
+    days = {}
+    for years_ago in range(1, MEMORY_YEARS + 1):
+        try:
+            days[day_number(today.replace(year=today.year - years_ago))] = years_ago
+        except ValueError:
+            continue
+    rows = _search(conn, user_id, 'first_day <= days.value AND last_day >= days.value', {}, list(days))
+    return sorted(({**dict(row), 'years_ago': days[row['day']]} for row in rows),
+                  key=lambda memory: (memory['years_ago'], memory['journal_id'] is not None, memory['trip_id']))
@@ -0,0 +1,248 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import after_this_request
+
+from db import get_db
+from blobs import store_file, release, collect_garbage
+from images import strip_metadata, generate_derivatives, image_sources, STATIC_FOLDER
+from duplicates import dhash, save_hash, similar_photos
+from cache import invalidate_trips
+from profiling import timed
+
+# ============================================================================
+# BACKGROUND UPLOAD PROCESSING
+# ============================================================================
+#
+# A request that uploads a photo only copies the file into UPLOAD_QUEUE_FOLDER,
+# records a job in UploadJobs and points the Album / Trips row at a
+# placeholder path ("processing/<job_id>"). The slow part - EXIF stripping,
+# hashing, thumbnails, the perceptual hash, swapping the real path into the
+# row - runs on a small thread pool, so request time doesn't depend on the
+# size of the photo. A finished album photo also records which of the user's
+# photos it looks like (see duplicates.py), for the upload page to warn about.
+#
+# At most UPLOAD_QUEUE_SIZE jobs may be waiting (more are refused with
+# QueueFull); each worker keeps taking the oldest waiting job until none are left.
+#
+# Jobs live in the database, so anything still queued when the server stops
+# is picked up again on the next start (resume_jobs).
+
+PLACEHOLDER_PREFIX = 'processing/'
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 500  # most jobs allowed to be waiting at once
+STALE_AFTER = 10 * 60  # seconds before a 'processing' job is assumed abandoned
+MAX_DUPLICATES = 5  # look-alikes remembered per upload
+
+_app = None
+_executor = None
+_slots = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+def placeholder_path(job_id):
+    return f'{PLACEHOLDER_PREFIX}{job_id}'
+
+
+def placeholder_job_id(path):
+    if path and path.startswith(PLACEHOLDER_PREFIX):
+        return int(path[len(PLACEHOLDER_PREFIX):])
+    return None
+
+
+# ============================================================================
+# REQUEST SIDE
+# ============================================================================
+
+# Queue an uploaded file. Returns the placeholder path to save in the row;
+# processing starts once the request has finished (after the row is committed).
+def queue_upload(conn, file, user_id, previous_path=None):
+    return queue_files(conn, [(file.filename, file.stream)], user_id, previous_path)[0]
+
+
+# Queue several files at once: [(filename, readable stream), ...]. Returns one
+# placeholder path per file, in the same order.
+def queue_files(conn, files, user_id, previous_path=None):
+    pending = conn.execute(
+        "SELECT COUNT(*) FROM UploadJobs WHERE status IN ('queued', 'processing')").fetchone()[0]
+    if pending + len(files) > _app.config['UPLOAD_QUEUE_SIZE']:
+        raise QueueFull()
+
+    job_ids, temp_paths = [], []
+    try:
+        for filename, stream in files:
+            temp_path = os.path.join(_app.config['UPLOAD_QUEUE_FOLDER'], uuid.uuid4().hex)
+            temp_paths.append(temp_path)
+            with timed('upload'), open(temp_path, 'wb') as out:
+                shutil.copyfileobj(stream, out)
+            cursor = conn.execute('''
+                INSERT INTO UploadJobs (user_id, temp_path, original_name, previous_path, status, created_at)
+                VALUES (?, ?, ?, ?, 'queued', ?)
+            ''', (user_id, temp_path, filename, previous_path, time.time()))
+            job_ids.append(cursor.lastrowid)
+        
+        # The job holds a reference to the file it replaces, so the old file
+        # survives until the new one is in place (or is put back on failure)
+        if previous_path:
+            conn.execute('UPDATE Blobs SET ref_count = ref_count + 1 WHERE blob_path = ?', (previous_path,))
+    except BaseException:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+
+    @after_this_request
+    def start_jobs(response):
+        _schedule(job_ids)
+        return response
+
+    return [placeholder_path(job_id) for job_id in job_ids]
+
+
+# Current state of a job (only for the user who uploaded it)
+def job_status(conn, job_id, user_id):
+    return conn.execute('''
+        SELECT job_id, status, result_path, error, duplicates FROM UploadJobs
+        WHERE job_id = ? AND user_id = ?
+    ''', (job_id, user_id)).fetchone()
+
+
+# ============================================================================
+# WORKER SIDE
+# ============================================================================
+
+# Hand jobs to the thread pool while it has room. Anything that doesn't fit
+# stays 'queued' in the database and is picked up by _run_job's drain loop.
+def _schedule(job_ids):
+    for job_id in job_ids:
+        if not _slots.acquire(blocking=False):
+            break
+        _executor.submit(_run_job, job_id)
+
+
+def _run_job(job_id):
+    try:
+        with _app.app_context():
+            conn = get_db()
+            while job_id is not None:
+                _process(conn, job_id)
+                job_id = _next_queued(conn)
+    except Exception:
+        _app.logger.exception('Upload job %s crashed', job_id)
+    finally:
+        _slots.release()
+
+
+# Oldest job still waiting, if any (claimed properly by _process)
+def _next_queued(conn):
+    row = conn.execute(
+        "SELECT job_id FROM UploadJobs WHERE status = 'queued' ORDER BY job_id LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def _process(conn, job_id):
+    # Claim the job (another worker process may have resumed it already)
+    claimed = conn.execute('''
+        UPDATE UploadJobs SET status = 'processing', claimed_at = ?
+        WHERE job_id = ? AND status = 'queued'
+    ''', (time.time(), job_id))
+    conn.commit()
+    if claimed.rowcount == 0:
+        return
+
+    job = conn.execute('SELECT * FROM UploadJobs WHERE job_id = ?', (job_id,)).fetchone()
+    placeholder = placeholder_path(job_id)
+
+    blob_path = None
+    try:
+        with timed('upload_processing'):
+            strip_metadata(job['temp_path'])
+            blob_path = store_file(conn, job['temp_path'], job['original_name'], _app.config['UPLOAD_FOLDER'])
+            if not image_sources(blob_path):
+                generate_derivatives(blob_path)
+            bits = dhash(os.path.join(STATIC_FOLDER, blob_path))
+    except Exception as e:
+        _app.logger.warning('Upload job %s failed: %s', job_id, e)
+        if os.path.exists(job['temp_path']):
+            os.remove(job['temp_path'])
+        # Put the row back how it was (or drop a photo that never arrived)
+        trip_ids = conn.execute('UPDATE Trips SET trip_image = ? WHERE trip_image = ? RETURNING trip_id',
+                                (job['previous_path'], placeholder)).fetchall()
+        if job['previous_path']:
+            trip_ids += conn.execute('UPDATE Album SET photo_path = ? WHERE photo_path = ? RETURNING trip_id',
+                                     (job['previous_path'], placeholder)).fetchall()
+        else:
+            trip_ids += conn.execute('DELETE FROM Album WHERE photo_path = ? RETURNING trip_id',
+                                     (placeholder,)).fetchall()
+        conn.execute("UPDATE UploadJobs SET status = 'failed', error = ? WHERE job_id = ?", (str(e), job_id))
+        _release_previous(conn, job)
+        if blob_path is not None:
+            release(conn, [blob_path])
+        conn.commit()
+        invalidate_trips(*{row[0] for row in trip_ids})
+        collect_garbage(conn)
+        return
+
+    # Swap the real file into whichever row is waiting for it
+    photos = conn.execute('UPDATE Album SET photo_path = ? WHERE photo_path = ? RETURNING trip_id, photo_id',
+                          (blob_path, placeholder)).fetchall()
+    trip_ids = [(row[0],) for row in photos]
+    trip_ids += conn.execute('UPDATE Trips SET trip_image = ? WHERE trip_image = ? RETURNING trip_id',
+                             (blob_path, placeholder)).fetchall()
+    # The rows hold their own references now (if the row was deleted while we
+    # worked, this leaves the file to the garbage collector)
+    release(conn, [blob_path])
+    # Album photos: which of the user's other photos does it look like?
+    duplicates = None
+    if save_hash(conn, blob_path, bits=bits) is not None and photos:
+        duplicates = json.dumps(similar_photos(conn, job['user_id'], blob_path,
+                                               exclude={row[1] for row in photos})[:MAX_DUPLICATES])
+    conn.execute('''
+        UPDATE UploadJobs SET status = 'done', result_path = ?, temp_path = NULL, duplicates = ?
+        WHERE job_id = ?
+    ''', (blob_path, duplicates, job_id))
+    _release_previous(conn, job)
+    conn.commit()
+    invalidate_trips(*{row[0] for row in trip_ids})  # cached pages still show the placeholder
+    collect_garbage(conn)  # replaced file + placeholder reference, if now unused
+
+
+def _release_previous(conn, job):
+    if job['previous_path']:
+        conn.execute('UPDATE Blobs SET ref_count = ref_count - 1 WHERE blob_path = ?', (job['previous_path'],))
+
+
+# Re-queue jobs left over from a previous run (queued, or stuck 'processing')
+def resume_jobs():
+    with _app.app_context():
+        conn = get_db()
+        conn.execute('''
+            UPDATE UploadJobs SET status = 'queued'
+            WHERE status = 'processing' AND claimed_at < ?
+        ''', (time.time() - STALE_AFTER,))
+        conn.commit()
+        job_ids = [row[0] for row in conn.execute(
+            "SELECT job_id FROM UploadJobs WHERE status = 'queued' ORDER BY job_id LIMIT ?",
+            (_app.config['UPLOAD_WORKERS'],))]
+
+    _schedule(job_ids)
+
+
+def init_app(app):
+    global _app, _executor, _slots
+    app.config.setdefault('UPLOAD_QUEUE_FOLDER', 'upload_queue')
+    app.config.setdefault('UPLOAD_WORKERS', DEFAULT_WORKERS)
+    app.config.setdefault('UPLOAD_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+    os.makedirs(app.config['UPLOAD_QUEUE_FOLDER'], exist_ok=True)
+
+    _app = app
+    _executor = ThreadPoolExecutor(max_workers=app.config['UPLOAD_WORKERS'], thread_name_prefix='upload')
+    _slots = threading.BoundedSemaphore(app.config['UPLOAD_WORKERS'])
+    threading.Thread(target=resume_jobs, name='upload-resume', daemon=True).start()
@@ -0,0 +1,186 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import abort, current_app, request, session, send_from_directory, url_for, Response, redirect
+from werkzeug.security import safe_join
+
+from db import get_db
+from starter import is_visible
+from blobs import SITE_FILES
+
+# ============================================================================
+# AUTHENTICATED MEDIA (UPLOADED PHOTOS)
+# ============================================================================
+#
+# Uploads used to be plain static files: anyone with a photo's URL could
+# fetch it. They are now served from
+#
+#   /media/<file>            (static/uploads/<file>)
+#   /media/derived/<file>    (its thumbnails, see images.py)
+#
+# and only to a signed-in user who can see a trip that uses the file (as its
+# cover or in its album; starter trips count, see starter.py). /static/uploads/
+# answers 404, apart from the SITE_FILES the templates use directly.
+#
+# The ownership check is one indexed lookup (migration 5), remembered per
+# (user, file) for ACCESS_TTL seconds, so a page full of thumbnails costs a
+# handful of queries the first time and none after that.
+#
+# The transfer itself is handed off, depending on MEDIA_OFFLOAD:
+#
+#   None                send_file(): Range, If-None-Match / If-Modified-Since
+#                       and If-Range handled by Werkzeug, the body sent by the
+#                       server's wsgi.file_wrapper (sendfile where supported;
+#                       under asgi.py zero-copy send, or the file executor)
+#   'x-accel-redirect'  nginx sends the file from an internal location:
+#                           location /_protected/uploads/ {
+#                               internal;
+#                               alias /path/to/static/uploads/;
+#                           }
+#   'x-sendfile'        Apache mod_xsendfile / lighttpd
+#
+# Uploads are named after the SHA-256 of their bytes (blobs.py), so a URL's
+# content never changes: those are cached for a year (private - they're
+# behind a login) and their hash is the ETag.
+
+MEDIA_FOLDER = 'uploads'
+ACCESS_TTL = 60  # seconds a yes / no for (user, file) is reused
+ACCESS_CACHE_SIZE = 10000
+ACCEL_PREFIX = '/_protected/uploads/'
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+OFFLOAD_MODES = (None, 'x-accel-redirect', 'x-sendfile')
+
+CONTENT_HASH = re.compile(r'^[0-9a-f]{64}$')
+DERIVED_NAME = re.compile(r'^(?P<stem>.+)-\d+\.(avif|webp)$')
+
+_access = OrderedDict()  # (user_id, blob_path) -> (allowed, expires), least recently used first
+_access_lock = threading.Lock()
+
+
+# URL for a static-relative image path: /media/... for uploads, /static/... otherwise
+def media_url(path):
+    if path.startswith(MEDIA_FOLDER + '/') and path[len(MEDIA_FOLDER) + 1:] not in SITE_FILES:
+        return url_for('media', filename=path[len(MEDIA_FOLDER) + 1:])
+    return url_for('static', filename=path)
+
+
+# ============================================================================
+# OWNERSHIP CHECK (CACHED)
+# ============================================================================
+
+# The upload a /media file belongs to (a thumbnail belongs to its original)
+def _blob_path(conn, filename):
+    folder, name = os.path.split(filename)
+    if not folder:
+        return f'{MEDIA_FOLDER}/{name}'
+    match = DERIVED_NAME.match(name)
+    if folder != 'derived' or match is None:
+        return None
+    # uploads/<stem>.<any extension>: a range scan of the Blobs primary key
+    prefix = f"{MEDIA_FOLDER}/{match['stem']}."
+    row = conn.execute('SELECT blob_path FROM Blobs WHERE blob_path > ? AND blob_path < ? LIMIT 1',
+                       (prefix, prefix[:-1] + '/')).fetchone()
+    return row[0] if row else None
+
+
+# Does any trip this user can see use the file?
+def _can_view(conn, user_id, blob_path):
+    rows = conn.execute('''
+        SELECT trip_id, user_id FROM Trips WHERE trip_image = ?
+        UNION
+        SELECT Trips.trip_id, Trips.user_id FROM Album JOIN Trips ON Trips.trip_id = Album.trip_id
+        WHERE Album.photo_path = ?
+    ''', (blob_path, blob_path)).fetchall()
+    return any(is_visible(conn, row, user_id) for row in rows)
+
+
+def can_view(conn, user_id, blob_path):
+    key = (user_id, blob_path)
+    now = time.monotonic()
+    with _access_lock:
+        cached = _access.get(key)
+        if cached is not None and cached[1] > now:
+            _access.move_to_end(key)
+            return cached[0]
+
+    allowed = _can_view(conn, user_id, blob_path)
+    with _access_lock:
+        _access[key] = (allowed, now + ACCESS_TTL)
+        _access.move_to_end(key)
+        while len(_access) > ACCESS_CACHE_SIZE:
+            _access.popitem(last=False)
+    return allowed
+
+
+# ============================================================================
+# ROUTES
+# ============================================================================
+
+# The content hash in a file's name (thumbnails: their original's), or None
+def _content_hash(filename):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if filename.startswith('derived/'):
+        stem = stem.rsplit('-', 1)[0]
+    return stem if CONTENT_HASH.match(stem) else None
+
+
+def _cache_headers(response, filename):
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    if _content_hash(filename):
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True  # older uploads: revalidate (ETag / Last-Modified)
+    response.vary.add('Cookie')
+    return response
+
+
+# READ: ONE UPLOADED PHOTO (OR THUMBNAIL), FOR USERS WHO CAN SEE IT
+def media(filename):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    conn = get_db()
+    blob_path = _blob_path(conn, filename)
+    if blob_path is None or not can_view(conn, session['user_id'], blob_path):
+        abort(404)  # not "403": don't confirm the file exists
+
+    folder = os.path.join(current_app.static_folder, MEDIA_FOLDER)
+    full_path = safe_join(folder, filename)
+    if full_path is None or not os.path.isfile(full_path):
+        abort(404)
+
+    if current_app.config['MEDIA_OFFLOAD'] == 'x-accel-redirect':
+        # nginx does Range / conditional requests itself (and picks the Content-Type)
+        response = Response()
+        del response.headers['Content-Type']
+        response.headers['X-Accel-Redirect'] = current_app.config['MEDIA_ACCEL_PREFIX'] + filename
+        return _cache_headers(response, filename)
+
+    # X-Sendfile (app.use_x_sendfile) or the file itself, with Range + conditional
+    # A thumbnail's ETag is its own name; an original's, its hash
+    content_hash = _content_hash(filename)
+    etag = (os.path.basename(filename) if filename.startswith('derived/') else content_hash) if content_hash else True
+    response = send_from_directory(folder, filename, etag=etag, max_age=None, conditional=True)
+    return _cache_headers(response, filename)
+
+
+# Photos aren't public static files any more (site images still are)
+def _hide_uploads():
+    if request.endpoint == 'static':
+        filename = (request.view_args or {}).get('filename', '')
+        if filename.startswith(MEDIA_FOLDER + '/') and filename[len(MEDIA_FOLDER) + 1:] not in SITE_FILES:
+            abort(404)
+
+
+def init_app(app):
+    app.config.setdefault('MEDIA_OFFLOAD', None)
+    app.config.setdefault('MEDIA_ACCEL_PREFIX', ACCEL_PREFIX)
+    if app.config['MEDIA_OFFLOAD'] not in OFFLOAD_MODES:
+        raise ValueError(f"MEDIA_OFFLOAD must be one of {OFFLOAD_MODES}")
+    app.use_x_sendfile = app.config['MEDIA_OFFLOAD'] == 'x-sendfile'
+    app.add_url_rule('/media/<path:filename>', 'media', media)
+    app.before_request(_hide_uploads)
+    app.jinja_env.globals['media_url'] = media_url
@@ -0,0 +1,1057 @@
+import sqlite3
+import sys
+
+from geo import locate_missing
+
+# ============================================================================
+# SCHEMA MIGRATIONS
+# ============================================================================
+#
+# Replaces the old schema.sql / sql.py scripts (which had drifted apart from
+# the live database). Each migration has a version number; the version the
+# database is at is stored in PRAGMA user_version, so on startup we only run
+# the migrations the database hasn't seen yet.
+#
+# A migration is either a SQL script or a function taking the connection.
+# Never edit a migration that has shipped - add a new one instead.
+#
+# Every worker process migrates at startup (serve.py --workers N), so each
+# step takes the write lock first (BEGIN IMMEDIATE) and re-reads the version
+# under it: the other workers wait, then find the step already done.
+
+
+# 1: Base tables (matches the live part_a.db, including Users + Trips.user_id)
+INITIAL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS Users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS Trips (
+    trip_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trip_location TEXT NOT NULL,
+    trip_start TEXT NOT NULL,
+    trip_end TEXT NOT NULL,
+    trip_image TEXT,
+    trip_description TEXT,
+    rating INTEGER DEFAULT 0 CHECK(rating >= 0 AND rating <= 5),
+    user_id INTEGER DEFAULT 1 NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS Journal (
+    journal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_date TEXT NOT NULL,
+    journal_entry TEXT NOT NULL,
+    trip_id INTEGER NOT NULL,
+    FOREIGN KEY(trip_id) REFERENCES Trips(trip_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS Album (
+    photo_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    photo_path TEXT NOT NULL,
+    photo_alt TEXT,
+    trip_id INTEGER NOT NULL,
+    date_added TEXT NOT NULL,
+    FOREIGN KEY(trip_id) REFERENCES Trips(trip_id) ON DELETE CASCADE
+);
+'''
+
+
+def initial_schema(conn):
+    for statement in INITIAL_SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+    # Databases built by the old sql.py have no Trips.user_id column
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(Trips)')]
+    if 'user_id' not in columns:
+        conn.execute('ALTER TABLE Trips ADD COLUMN user_id INTEGER DEFAULT 1 NOT NULL')
+
+
+# 2: Secondary indexes, one per query shape the routes actually run.
+# Each ends in the tiebreaker column so the ORDER BY is read straight off the
+# index instead of sorting every row the user owns.
+TRIP_AND_CHILD_INDEXES = '''
+-- index(): sort=id_asc / id_desc (rowid order within a user)
+CREATE INDEX IF NOT EXISTS idx_trips_user ON Trips (user_id);
+
+-- index(): sort=date_asc / date_desc
+CREATE INDEX IF NOT EXISTS idx_trips_user_start ON Trips (user_id, trip_start, trip_id);
+
+-- index(): sort=rating_asc / rating_desc (unrated = 0, as pagination.py sorts)
+CREATE INDEX IF NOT EXISTS idx_trips_user_rating ON Trips (user_id, COALESCE(rating, 0), trip_id);
+
+-- index(): sort=location_asc
+CREATE INDEX IF NOT EXISTS idx_trips_user_location ON Trips (user_id, trip_location COLLATE NOCASE, trip_id);
+
+-- journal(): WHERE trip_id = ? ORDER BY entry_date
+CREATE INDEX IF NOT EXISTS idx_journal_trip_date ON Journal (trip_id, entry_date);
+
+-- album(): WHERE trip_id = ? ORDER BY date_added DESC
+CREATE INDEX IF NOT EXISTS idx_album_trip_date ON Album (trip_id, date_added);
+
+ANALYZE;
+'''
+
+
+# 3: rating_asc sorts rating ASC but trip_id DESC, which idx_trips_user_rating
+# can't give in one pass - so keyset pages would sort a whole rating group
+RATING_ASC_INDEX = '''
+CREATE INDEX IF NOT EXISTS idx_trips_user_rating_asc ON Trips (user_id, COALESCE(rating, 0) ASC, trip_id DESC);
+
+ANALYZE;
+'''
+
+
+# 4: Reference counts for content-addressed uploads (see blobs.py). Every row
+# that points at a file holds one reference; triggers keep the counts right
+# for inserts, updates and deletes (FK cascades fire them too).
+UPLOAD_REFERENCE_COUNTS = '''
+CREATE TABLE IF NOT EXISTS Blobs (
+    blob_path TEXT PRIMARY KEY,
+    ref_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- collect_garbage() only looks at unreferenced files
+CREATE INDEX IF NOT EXISTS idx_blobs_orphans ON Blobs (blob_path) WHERE ref_count <= 0;
+
+-- Existing references
+INSERT INTO Blobs (blob_path, ref_count)
+SELECT path, COUNT(*) FROM (
+    SELECT photo_path AS path FROM Album
+    UNION ALL
+    SELECT trip_image AS path FROM Trips WHERE trip_image IS NOT NULL
+)
+GROUP BY path;
+
+CREATE TRIGGER IF NOT EXISTS album_blob_insert AFTER INSERT ON Album
+BEGIN
+    INSERT INTO Blobs (blob_path, ref_count) VALUES (NEW.photo_path, 1)
+    ON CONFLICT(blob_path) DO UPDATE SET ref_count = ref_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_blob_delete AFTER DELETE ON Album
+BEGIN
+    UPDATE Blobs SET ref_count = ref_count - 1 WHERE blob_path = OLD.photo_path;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_blob_update AFTER UPDATE OF photo_path ON Album
+WHEN OLD.photo_path IS NOT NEW.photo_path
+BEGIN
+    UPDATE Blobs SET ref_count = ref_count - 1 WHERE blob_path = OLD.photo_path;
+    INSERT INTO Blobs (blob_path, ref_count) VALUES (NEW.photo_path, 1)
+    ON CONFLICT(blob_path) DO UPDATE SET ref_count = ref_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_blob_insert AFTER INSERT ON Trips
+WHEN NEW.trip_image IS NOT NULL
+BEGIN
+    INSERT INTO Blobs (blob_path, ref_count) VALUES (NEW.trip_image, 1)
+    ON CONFLICT(blob_path) DO UPDATE SET ref_count = ref_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_blob_delete AFTER DELETE ON Trips
+WHEN OLD.trip_image IS NOT NULL
+BEGIN
+    UPDATE Blobs SET ref_count = ref_count - 1 WHERE blob_path = OLD.trip_image;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_blob_update AFTER UPDATE OF trip_image ON Trips
+WHEN OLD.trip_image IS NOT NEW.trip_image
+BEGIN
+    UPDATE Blobs SET ref_count = ref_count - 1 WHERE blob_path = OLD.trip_image;
+    INSERT INTO Blobs (blob_path, ref_count) SELECT NEW.trip_image, 1 WHERE NEW.trip_image IS NOT NULL
+    ON CONFLICT(blob_path) DO UPDATE SET ref_count = ref_count + 1;
+END;
+'''
+
+
+# 5: Background upload jobs (see jobs.py). Rows point at "processing/<job_id>"
+# until the worker swaps the real path in, so look-ups by path need indexes.
+UPLOAD_JOBS = '''
+CREATE TABLE IF NOT EXISTS UploadJobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    temp_path TEXT,
+    original_name TEXT NOT NULL,
+    previous_path TEXT,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK(status IN ('queued', 'processing', 'done', 'failed')),
+    result_path TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    claimed_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_pending ON UploadJobs (status) WHERE status IN ('queued', 'processing');
+
+CREATE INDEX IF NOT EXISTS idx_album_photo_path ON Album (photo_path);
+CREATE INDEX IF NOT EXISTS idx_trips_image ON Trips (trip_image);
+'''
+
+
+# 6: Starter trips are shared with new accounts instead of copied (see
+# starter.py). StarterOverrides lists the ones a user has copied or deleted.
+# Accounts made before this already have their own copies, so they stay at 0.
+STARTER_TRIPS = '''
+ALTER TABLE Users ADD COLUMN starter_content INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS StarterOverrides (
+    user_id INTEGER NOT NULL,
+    template_trip_id INTEGER NOT NULL,
+    trip_id INTEGER,
+    PRIMARY KEY (user_id, template_trip_id)
+) WITHOUT ROWID;
+'''
+
+
+# 7: Modification counters for conditional GET (see versions.py). Triggers
+# bump them on every write, so routes, starter copies and upload jobs all
+# count. A trip's version covers its journal and album; a user's version
+# covers their list of trips (home page).
+MODIFICATION_COUNTERS = '''
+CREATE TABLE IF NOT EXISTS TripVersions (
+    trip_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    modified_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS UserVersions (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    modified_at INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO TripVersions (trip_id, version, modified_at) SELECT trip_id, 1, unixepoch() FROM Trips;
+INSERT OR IGNORE INTO UserVersions (user_id, version, modified_at) SELECT user_id, 1, unixepoch() FROM Users;
+
+CREATE TRIGGER IF NOT EXISTS trips_version_insert AFTER INSERT ON Trips
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (NEW.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+    INSERT INTO UserVersions (user_id, version, modified_at) VALUES (NEW.user_id, 1, unixepoch())
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_version_update AFTER UPDATE ON Trips
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (NEW.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+    INSERT INTO UserVersions (user_id, version, modified_at) VALUES (NEW.user_id, 1, unixepoch())
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_version_delete AFTER DELETE ON Trips
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (OLD.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+    INSERT INTO UserVersions (user_id, version, modified_at) VALUES (OLD.user_id, 1, unixepoch())
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_version_insert AFTER INSERT ON Journal
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (NEW.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_version_update AFTER UPDATE ON Journal
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (NEW.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_version_delete AFTER DELETE ON Journal
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (OLD.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_version_insert AFTER INSERT ON Album
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (NEW.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_version_update AFTER UPDATE ON Album
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (NEW.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_version_delete AFTER DELETE ON Album
+BEGIN
+    INSERT INTO TripVersions (trip_id, version, modified_at) VALUES (OLD.trip_id, 1, unixepoch())
+    ON CONFLICT(trip_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+-- Hiding or copying a starter trip changes that user's home page
+CREATE TRIGGER IF NOT EXISTS starter_overrides_version_insert AFTER INSERT ON StarterOverrides
+BEGIN
+    INSERT INTO UserVersions (user_id, version, modified_at) VALUES (NEW.user_id, 1, unixepoch())
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+'''
+
+
+
+# 8: Full-text search over trips, journal entries and photo captions (see
+# search.py). One FTS5 table for all three; the rowid is derived from the
+# source row (trip_id * 4, journal_id * 4 + 1, photo_id * 4 + 2) so triggers
+# can update and delete entries by rowid. `owner` holds a "u<user_id>" token
+# so a search only walks the posting lists of the user's own rows.
+SEARCH_INDEX = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS SearchIndex USING fts5(
+    kind UNINDEXED,
+    item_id UNINDEXED,
+    trip_id UNINDEXED,
+    owner,
+    title,
+    body,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+
+INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+SELECT trip_id * 4, 'trip', trip_id, trip_id, 'u' || user_id, trip_location, COALESCE(trip_description, '')
+FROM Trips;
+
+INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+SELECT journal_id * 4 + 1, 'journal', journal_id, Journal.trip_id, 'u' || Trips.user_id, '', journal_entry
+FROM Journal JOIN Trips ON Trips.trip_id = Journal.trip_id;
+
+INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+SELECT photo_id * 4 + 2, 'photo', photo_id, Album.trip_id, 'u' || Trips.user_id, '', COALESCE(photo_alt, '')
+FROM Album JOIN Trips ON Trips.trip_id = Album.trip_id;
+
+INSERT INTO SearchIndex (SearchIndex) VALUES ('optimize');
+
+CREATE TRIGGER IF NOT EXISTS trips_search_insert AFTER INSERT ON Trips
+BEGIN
+    INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+    VALUES (NEW.trip_id * 4, 'trip', NEW.trip_id, NEW.trip_id, 'u' || NEW.user_id,
+            NEW.trip_location, COALESCE(NEW.trip_description, ''));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_search_update AFTER UPDATE OF trip_location, trip_description, user_id ON Trips
+BEGIN
+    DELETE FROM SearchIndex WHERE rowid = OLD.trip_id * 4;
+    INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+    VALUES (NEW.trip_id * 4, 'trip', NEW.trip_id, NEW.trip_id, 'u' || NEW.user_id,
+            NEW.trip_location, COALESCE(NEW.trip_description, ''));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_search_delete AFTER DELETE ON Trips
+BEGIN
+    DELETE FROM SearchIndex WHERE rowid = OLD.trip_id * 4;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_search_insert AFTER INSERT ON Journal
+BEGIN
+    INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+    SELECT NEW.journal_id * 4 + 1, 'journal', NEW.journal_id, NEW.trip_id, 'u' || user_id, '', NEW.journal_entry
+    FROM Trips WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_search_update AFTER UPDATE OF journal_entry, trip_id ON Journal
+BEGIN
+    DELETE FROM SearchIndex WHERE rowid = OLD.journal_id * 4 + 1;
+    INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+    SELECT NEW.journal_id * 4 + 1, 'journal', NEW.journal_id, NEW.trip_id, 'u' || user_id, '', NEW.journal_entry
+    FROM Trips WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_search_delete AFTER DELETE ON Journal
+BEGIN
+    DELETE FROM SearchIndex WHERE rowid = OLD.journal_id * 4 + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_search_insert AFTER INSERT ON Album
+BEGIN
+    INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+    SELECT NEW.photo_id * 4 + 2, 'photo', NEW.photo_id, NEW.trip_id, 'u' || user_id, '', COALESCE(NEW.photo_alt, '')
+    FROM Trips WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_search_update AFTER UPDATE OF photo_alt, trip_id ON Album
+BEGIN
+    DELETE FROM SearchIndex WHERE rowid = OLD.photo_id * 4 + 2;
+    INSERT INTO SearchIndex (rowid, kind, item_id, trip_id, owner, title, body)
+    SELECT NEW.photo_id * 4 + 2, 'photo', NEW.photo_id, NEW.trip_id, 'u' || user_id, '', COALESCE(NEW.photo_alt, '')
+    FROM Trips WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_search_delete AFTER DELETE ON Album
+BEGIN
+    DELETE FROM SearchIndex WHERE rowid = OLD.photo_id * 4 + 2;
+END;
+'''
+
+
+# 9: Dashboard numbers kept up to date by triggers (see stats.py), so the home
+# page reads one UserStats row (+ one UserYearStats row per year) instead of
+# aggregating the user's whole history. TripStats holds each trip's owner and
+# journal / photo counts, which lets the Journal and Album triggers find the
+# user even while a trip delete is cascading.
+# Days travelled count both ends (a trip from the 1st to the 3rd is 3 days).
+# Journal entries and photos never move between trips, so only their inserts
+# and deletes need triggers. Those also bump the owner's home page version: a
+# trip delete bumps it itself, so the cascaded child deletes needn't find one.
+USER_STATS = '''
+CREATE TABLE IF NOT EXISTS TripStats (
+    trip_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    journal_count INTEGER NOT NULL DEFAULT 0,
+    photo_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS UserStats (
+    user_id INTEGER PRIMARY KEY,
+    trip_count INTEGER NOT NULL DEFAULT 0,
+    days_travelled INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    rated_count INTEGER NOT NULL DEFAULT 0,
+    journal_count INTEGER NOT NULL DEFAULT 0,
+    photo_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS UserYearStats (
+    user_id INTEGER NOT NULL,
+    year TEXT NOT NULL,
+    trip_count INTEGER NOT NULL DEFAULT 0,
+    days_travelled INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, year)
+) WITHOUT ROWID;
+
+-- Existing data
+INSERT OR IGNORE INTO TripStats (trip_id, user_id, journal_count, photo_count)
+SELECT trip_id, user_id,
+       (SELECT COUNT(*) FROM Journal WHERE Journal.trip_id = Trips.trip_id),
+       (SELECT COUNT(*) FROM Album WHERE Album.trip_id = Trips.trip_id)
+FROM Trips;
+
+INSERT OR IGNORE INTO UserStats (user_id, trip_count, days_travelled, rating_sum, rated_count, journal_count, photo_count)
+SELECT Trips.user_id, COUNT(*),
+       SUM(MAX(0, COALESCE(CAST(julianday(trip_end) - julianday(trip_start) AS INTEGER) + 1, 0))),
+       SUM(COALESCE(rating, 0)), SUM(COALESCE(rating, 0) > 0),
+       SUM(journal_count), SUM(photo_count)
+FROM Trips JOIN TripStats ON TripStats.trip_id = Trips.trip_id
+GROUP BY Trips.user_id;
+
+INSERT OR IGNORE INTO UserYearStats (user_id, year, trip_count, days_travelled)
+SELECT user_id, substr(trip_start, 1, 4), COUNT(*),
+       SUM(MAX(0, COALESCE(CAST(julianday(trip_end) - julianday(trip_start) AS INTEGER) + 1, 0)))
+FROM Trips
+GROUP BY user_id, substr(trip_start, 1, 4);
+
+CREATE TRIGGER IF NOT EXISTS trips_stats_insert AFTER INSERT ON Trips
+BEGIN
+    INSERT OR REPLACE INTO TripStats (trip_id, user_id) VALUES (NEW.trip_id, NEW.user_id);
+    INSERT INTO UserStats (user_id, trip_count, days_travelled, rating_sum, rated_count)
+    VALUES (NEW.user_id, 1, MAX(0, COALESCE(CAST(julianday(NEW.trip_end) - julianday(NEW.trip_start) AS INTEGER) + 1, 0)), COALESCE(NEW.rating, 0), COALESCE(NEW.rating, 0) > 0)
+    ON CONFLICT(user_id) DO UPDATE SET
+        trip_count = trip_count + 1,
+        days_travelled = days_travelled + excluded.days_travelled,
+        rating_sum = rating_sum + excluded.rating_sum,
+        rated_count = rated_count + excluded.rated_count;
+    INSERT INTO UserYearStats (user_id, year, trip_count, days_travelled)
+    VALUES (NEW.user_id, substr(NEW.trip_start, 1, 4), 1, MAX(0, COALESCE(CAST(julianday(NEW.trip_end) - julianday(NEW.trip_start) AS INTEGER) + 1, 0)))
+    ON CONFLICT(user_id, year) DO UPDATE SET
+        trip_count = trip_count + 1,
+        days_travelled = days_travelled + excluded.days_travelled;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_stats_update AFTER UPDATE OF trip_start, trip_end, rating ON Trips
+BEGIN
+    UPDATE UserStats SET
+        days_travelled = days_travelled - MAX(0, COALESCE(CAST(julianday(OLD.trip_end) - julianday(OLD.trip_start) AS INTEGER) + 1, 0)) + MAX(0, COALESCE(CAST(julianday(NEW.trip_end) - julianday(NEW.trip_start) AS INTEGER) + 1, 0)),
+        rating_sum = rating_sum - COALESCE(OLD.rating, 0) + COALESCE(NEW.rating, 0),
+        rated_count = rated_count - (COALESCE(OLD.rating, 0) > 0) + (COALESCE(NEW.rating, 0) > 0)
+    WHERE user_id = NEW.user_id;
+    UPDATE UserYearStats SET
+        trip_count = trip_count - 1,
+        days_travelled = days_travelled - MAX(0, COALESCE(CAST(julianday(OLD.trip_end) - julianday(OLD.trip_start) AS INTEGER) + 1, 0))
+    WHERE user_id = OLD.user_id AND year = substr(OLD.trip_start, 1, 4);
+    INSERT INTO UserYearStats (user_id, year, trip_count, days_travelled)
+    VALUES (NEW.user_id, substr(NEW.trip_start, 1, 4), 1, MAX(0, COALESCE(CAST(julianday(NEW.trip_end) - julianday(NEW.trip_start) AS INTEGER) + 1, 0)))
+    ON CONFLICT(user_id, year) DO UPDATE SET
+        trip_count = trip_count + 1,
+        days_travelled = days_travelled + excluded.days_travelled;
+END;
+
+-- Journal / photo counts still on the trip go with it (whichever of this and
+-- the cascaded child deletes runs first, each count is only taken off once)
+CREATE TRIGGER IF NOT EXISTS trips_stats_delete AFTER DELETE ON Trips
+BEGIN
+    UPDATE UserStats SET
+        trip_count = trip_count - 1,
+        days_travelled = days_travelled - MAX(0, COALESCE(CAST(julianday(OLD.trip_end) - julianday(OLD.trip_start) AS INTEGER) + 1, 0)),
+        rating_sum = rating_sum - COALESCE(OLD.rating, 0),
+        rated_count = rated_count - (COALESCE(OLD.rating, 0) > 0),
+        journal_count = journal_count - COALESCE((SELECT journal_count FROM TripStats WHERE trip_id = OLD.trip_id), 0),
+        photo_count = photo_count - COALESCE((SELECT photo_count FROM TripStats WHERE trip_id = OLD.trip_id), 0)
+    WHERE user_id = OLD.user_id;
+    UPDATE UserYearStats SET
+        trip_count = trip_count - 1,
+        days_travelled = days_travelled - MAX(0, COALESCE(CAST(julianday(OLD.trip_end) - julianday(OLD.trip_start) AS INTEGER) + 1, 0))
+    WHERE user_id = OLD.user_id AND year = substr(OLD.trip_start, 1, 4);
+    DELETE FROM TripStats WHERE trip_id = OLD.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_stats_insert AFTER INSERT ON Journal
+BEGIN
+    UPDATE TripStats SET journal_count = journal_count + 1 WHERE trip_id = NEW.trip_id;
+    UPDATE UserStats SET journal_count = journal_count + 1
+    WHERE user_id = (SELECT user_id FROM TripStats WHERE trip_id = NEW.trip_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_stats_delete AFTER DELETE ON Journal
+BEGIN
+    UPDATE UserStats SET journal_count = journal_count - 1
+    WHERE user_id = (SELECT user_id FROM TripStats WHERE trip_id = OLD.trip_id);
+    UPDATE TripStats SET journal_count = journal_count - 1 WHERE trip_id = OLD.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_stats_insert AFTER INSERT ON Album
+BEGIN
+    UPDATE TripStats SET photo_count = photo_count + 1 WHERE trip_id = NEW.trip_id;
+    UPDATE UserStats SET photo_count = photo_count + 1
+    WHERE user_id = (SELECT user_id FROM TripStats WHERE trip_id = NEW.trip_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_stats_delete AFTER DELETE ON Album
+BEGIN
+    UPDATE UserStats SET photo_count = photo_count - 1
+    WHERE user_id = (SELECT user_id FROM TripStats WHERE trip_id = OLD.trip_id);
+    UPDATE TripStats SET photo_count = photo_count - 1 WHERE trip_id = OLD.trip_id;
+END;
+
+-- The home page shows these counts, so its version (migration 7) moves too
+CREATE TRIGGER IF NOT EXISTS journal_user_version_insert AFTER INSERT ON Journal
+BEGIN
+    INSERT INTO UserVersions (user_id, version, modified_at)
+    SELECT user_id, 1, unixepoch() FROM TripStats WHERE trip_id = NEW.trip_id
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_user_version_delete AFTER DELETE ON Journal
+BEGIN
+    INSERT INTO UserVersions (user_id, version, modified_at)
+    SELECT user_id, 1, unixepoch() FROM TripStats WHERE trip_id = OLD.trip_id
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_user_version_insert AFTER INSERT ON Album
+BEGIN
+    INSERT INTO UserVersions (user_id, version, modified_at)
+    SELECT user_id, 1, unixepoch() FROM TripStats WHERE trip_id = NEW.trip_id
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_user_version_delete AFTER DELETE ON Album
+BEGIN
+    INSERT INTO UserVersions (user_id, version, modified_at)
+    SELECT user_id, 1, unixepoch() FROM TripStats WHERE trip_id = OLD.trip_id
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;
+END;
+'''
+
+# 10: Idempotency keys for the write routes the offline queue replays (see
+# idempotency.py). response_status stays NULL while the request is running.
+IDEMPOTENCY_KEYS = '''
+CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+    user_id INTEGER NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    response_status INTEGER,
+    response_location TEXT,
+    response_type TEXT,
+    response_body BLOB,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, idempotency_key)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON IdempotencyKeys (created_at);
+'''
+
+# 11: Change log for /api/v1/sync (see sync.py). One SyncLog row per trip,
+# journal entry and photo - the latest change wins, so the log never grows
+# past the number of rows (plus tombstones). Every change takes the next
+# number from SyncCounter, which only moves forward. Journal / photo rows are
+# dropped from the log with their trip: a trip's tombstone covers them.
+# Hiding or copying a starter trip is a tombstone for that user alone, so it
+# is stamped on the StarterOverrides row instead.
+SYNC_LOG = '''
+CREATE TABLE IF NOT EXISTS SyncCounter (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS SyncLog (
+    entity TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    trip_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (entity, entity_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_sync_log_user_version ON SyncLog (user_id, version);
+
+ALTER TABLE StarterOverrides ADD COLUMN sync_version INTEGER;
+CREATE INDEX IF NOT EXISTS idx_starter_overrides_sync ON StarterOverrides (user_id, sync_version);
+
+-- Existing data: every row is "inserted", numbered 1, 2, 3, ...
+INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+SELECT 'trip', trip_id, user_id, trip_id, ROW_NUMBER() OVER (ORDER BY trip_id)
+FROM Trips;
+
+INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+SELECT 'journal', journal_id, Trips.user_id, Journal.trip_id,
+       (SELECT COUNT(*) FROM SyncLog) + ROW_NUMBER() OVER (ORDER BY journal_id)
+FROM Journal JOIN Trips ON Trips.trip_id = Journal.trip_id;
+
+INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+SELECT 'photo', photo_id, Trips.user_id, Album.trip_id,
+       (SELECT COUNT(*) FROM SyncLog) + ROW_NUMBER() OVER (ORDER BY photo_id)
+FROM Album JOIN Trips ON Trips.trip_id = Album.trip_id;
+
+INSERT INTO SyncCounter (id, version) SELECT 1, COUNT(*) FROM SyncLog;
+
+CREATE TRIGGER IF NOT EXISTS trips_sync_insert AFTER INSERT ON Trips
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+    VALUES ('trip', NEW.trip_id, NEW.user_id, NEW.trip_id, (SELECT version FROM SyncCounter))
+    ON CONFLICT(entity, entity_id) DO UPDATE SET
+        user_id = excluded.user_id, trip_id = excluded.trip_id, version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_sync_update AFTER UPDATE ON Trips
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+    VALUES ('trip', NEW.trip_id, NEW.user_id, NEW.trip_id, (SELECT version FROM SyncCounter))
+    ON CONFLICT(entity, entity_id) DO UPDATE SET
+        user_id = excluded.user_id, trip_id = excluded.trip_id, version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_sync_delete AFTER DELETE ON Trips
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    DELETE FROM SyncLog WHERE trip_id = OLD.trip_id AND entity != 'trip';
+    INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version, deleted)
+    VALUES ('trip', OLD.trip_id, OLD.user_id, OLD.trip_id, (SELECT version FROM SyncCounter), 1)
+    ON CONFLICT(entity, entity_id) DO UPDATE SET version = excluded.version, deleted = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_sync_insert AFTER INSERT ON Journal
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+    SELECT 'journal', NEW.journal_id, user_id, NEW.trip_id, (SELECT version FROM SyncCounter)
+    FROM Trips WHERE trip_id = NEW.trip_id
+    ON CONFLICT(entity, entity_id) DO UPDATE SET
+        user_id = excluded.user_id, trip_id = excluded.trip_id, version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_sync_update AFTER UPDATE ON Journal
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+    SELECT 'journal', NEW.journal_id, user_id, NEW.trip_id, (SELECT version FROM SyncCounter)
+    FROM Trips WHERE trip_id = NEW.trip_id
+    ON CONFLICT(entity, entity_id) DO UPDATE SET
+        user_id = excluded.user_id, trip_id = excluded.trip_id, version = excluded.version, deleted = 0;
+END;
+
+-- The log row already knows the owner (the trip may be gone mid-cascade)
+CREATE TRIGGER IF NOT EXISTS journal_sync_delete AFTER DELETE ON Journal
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    UPDATE SyncLog SET version = (SELECT version FROM SyncCounter), deleted = 1
+    WHERE entity = 'journal' AND entity_id = OLD.journal_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_sync_insert AFTER INSERT ON Album
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+    SELECT 'photo', NEW.photo_id, user_id, NEW.trip_id, (SELECT version FROM SyncCounter)
+    FROM Trips WHERE trip_id = NEW.trip_id
+    ON CONFLICT(entity, entity_id) DO UPDATE SET
+        user_id = excluded.user_id, trip_id = excluded.trip_id, version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_sync_update AFTER UPDATE ON Album
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    INSERT INTO SyncLog (entity, entity_id, user_id, trip_id, version)
+    SELECT 'photo', NEW.photo_id, user_id, NEW.trip_id, (SELECT version FROM SyncCounter)
+    FROM Trips WHERE trip_id = NEW.trip_id
+    ON CONFLICT(entity, entity_id) DO UPDATE SET
+        user_id = excluded.user_id, trip_id = excluded.trip_id, version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_sync_delete AFTER DELETE ON Album
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    UPDATE SyncLog SET version = (SELECT version FROM SyncCounter), deleted = 1
+    WHERE entity = 'photo' AND entity_id = OLD.photo_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS starter_overrides_sync_insert AFTER INSERT ON StarterOverrides
+BEGIN
+    UPDATE SyncCounter SET version = version + 1;
+    UPDATE StarterOverrides SET sync_version = (SELECT version FROM SyncCounter)
+    WHERE user_id = NEW.user_id AND template_trip_id = NEW.template_trip_id;
+END;
+'''
+
+# 12: Fresh planner statistics for the tables and indexes added since 3
+# (media.py's photo_path / trip_image lookups use migration 5's indexes).
+PLANNER_STATISTICS = '''
+ANALYZE;
+'''
+
+# 13: Where each trip is, for the map (see geo.py). An R*Tree over (user_id,
+# lat, lon) - every point is a zero-size box - so a bounding box query only
+# walks the user's own part of the tree. An R*Tree keeps its dimensions as
+# 32-bit floats, rounded outward, so the box only narrows the search:
+# +user_id / +lat / +lon hold the exact values, which geo.py filters on and
+# returns. The point is looked up in Python when a trip is saved; triggers
+# drop it when the trip goes or its location changes, and give a starter
+# trip's copy the same point.
+TRIP_POINTS = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS TripPoints USING rtree(
+    trip_id,
+    min_user, max_user,
+    min_lat, max_lat,
+    min_lon, max_lon,
+    +user_id,
+    +lat,
+    +lon
+);
+
+CREATE TRIGGER IF NOT EXISTS trips_point_delete AFTER DELETE ON Trips
+BEGIN
+    DELETE FROM TripPoints WHERE trip_id = OLD.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_point_relocate AFTER UPDATE OF trip_location ON Trips
+WHEN OLD.trip_location IS NOT NEW.trip_location
+BEGIN
+    DELETE FROM TripPoints WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS starter_overrides_point_copy AFTER INSERT ON StarterOverrides
+WHEN NEW.trip_id IS NOT NULL
+BEGIN
+    INSERT INTO TripPoints (trip_id, min_user, max_user, min_lat, max_lat, min_lon, max_lon, user_id, lat, lon)
+    SELECT NEW.trip_id, NEW.user_id, NEW.user_id, min_lat, max_lat, min_lon, max_lon, NEW.user_id, lat, lon
+    FROM TripPoints WHERE trip_id = NEW.template_trip_id;
+END;
+'''
+
+
+# 14: Points for the trips saved before 13 (python geo.py does the same later)
+def locate_existing_trips(conn):
+    locate_missing(conn)
+
+
+# 15: Trip date ranges and journal entry dates as whole day numbers (days
+# since 1970-01-01), in an interval index for the calendar (see intervals.py).
+# A trip is the interval [start, end], a journal entry the single day it was
+# written; both sit in one R*Tree under their owner's user_id, so "what was
+# on during these days" is a tree search, not a scan. Row ids: trip_id * 2
+# for trips, journal_id * 2 + 1 for entries. Dates that aren't dates get no
+# row; an end before the start is taken as the other way round.
+CALENDAR_INDEX = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS CalendarIndex USING rtree_i32(
+    id,
+    min_user, max_user,
+    first_day, last_day,
+    +trip_id
+);
+
+INSERT INTO CalendarIndex (id, min_user, max_user, first_day, last_day, trip_id)
+SELECT trip_id * 2, user_id, user_id, MIN(start_day, end_day), MAX(start_day, end_day), trip_id
+FROM (
+    SELECT trip_id, user_id,
+           CAST(julianday(trip_start) - 2440587.5 AS INTEGER) AS start_day,
+           CAST(COALESCE(julianday(trip_end), julianday(trip_start)) - 2440587.5 AS INTEGER) AS end_day
+    FROM Trips
+)
+WHERE start_day IS NOT NULL;
+
+INSERT INTO CalendarIndex (id, min_user, max_user, first_day, last_day, trip_id)
+SELECT Journal.journal_id * 2 + 1, Trips.user_id, Trips.user_id,
+       CAST(julianday(Journal.entry_date) - 2440587.5 AS INTEGER),
+       CAST(julianday(Journal.entry_date) - 2440587.5 AS INTEGER), Journal.trip_id
+FROM Journal JOIN Trips ON Trips.trip_id = Journal.trip_id
+WHERE julianday(Journal.entry_date) IS NOT NULL;
+
+CREATE TRIGGER IF NOT EXISTS trips_calendar_insert AFTER INSERT ON Trips
+WHEN julianday(NEW.trip_start) IS NOT NULL
+BEGIN
+    INSERT OR REPLACE INTO CalendarIndex (id, min_user, max_user, first_day, last_day, trip_id)
+    SELECT NEW.trip_id * 2, NEW.user_id, NEW.user_id, MIN(start_day, end_day), MAX(start_day, end_day), NEW.trip_id
+    FROM (SELECT CAST(julianday(NEW.trip_start) - 2440587.5 AS INTEGER) AS start_day,
+                 CAST(COALESCE(julianday(NEW.trip_end), julianday(NEW.trip_start)) - 2440587.5 AS INTEGER) AS end_day);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trips_calendar_update AFTER UPDATE OF trip_start, trip_end ON Trips
+BEGIN
+    DELETE FROM CalendarIndex WHERE id = NEW.trip_id * 2;
+    INSERT INTO CalendarIndex (id, min_user, max_user, first_day, last_day, trip_id)
+    SELECT NEW.trip_id * 2, NEW.user_id, NEW.user_id, MIN(start_day, end_day), MAX(start_day, end_day), NEW.trip_id
+    FROM (SELECT CAST(julianday(NEW.trip_start) - 2440587.5 AS INTEGER) AS start_day,
+                 CAST(COALESCE(julianday(NEW.trip_end), julianday(NEW.trip_start)) - 2440587.5 AS INTEGER) AS end_day)
+    WHERE start_day IS NOT NULL;
+END;
+
+-- Before the delete: with foreign keys off there is no cascade to do it
+CREATE TRIGGER IF NOT EXISTS trips_calendar_delete BEFORE DELETE ON Trips
+BEGIN
+    DELETE FROM CalendarIndex WHERE id = OLD.trip_id * 2;
+    DELETE FROM CalendarIndex WHERE id IN (SELECT journal_id * 2 + 1 FROM Journal WHERE trip_id = OLD.trip_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_calendar_insert AFTER INSERT ON Journal
+WHEN julianday(NEW.entry_date) IS NOT NULL
+BEGIN
+    INSERT OR REPLACE INTO CalendarIndex (id, min_user, max_user, first_day, last_day, trip_id)
+    SELECT NEW.journal_id * 2 + 1, user_id, user_id,
+           CAST(julianday(NEW.entry_date) - 2440587.5 AS INTEGER),
+           CAST(julianday(NEW.entry_date) - 2440587.5 AS INTEGER), NEW.trip_id
+    FROM Trips WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_calendar_update AFTER UPDATE OF entry_date ON Journal
+BEGIN
+    DELETE FROM CalendarIndex WHERE id = NEW.journal_id * 2 + 1;
+    INSERT INTO CalendarIndex (id, min_user, max_user, first_day, last_day, trip_id)
+    SELECT NEW.journal_id * 2 + 1, user_id, user_id,
+           CAST(julianday(NEW.entry_date) - 2440587.5 AS INTEGER),
+           CAST(julianday(NEW.entry_date) - 2440587.5 AS INTEGER), NEW.trip_id
+    FROM Trips WHERE trip_id = NEW.trip_id AND julianday(NEW.entry_date) IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_calendar_delete AFTER DELETE ON Journal
+BEGIN
+    DELETE FROM CalendarIndex WHERE id = OLD.journal_id * 2 + 1;
+END;
+'''
+
+# 16: Perceptual hashes of uploaded photos (see duplicates.py). Uploads are
+# stored once per file (migration 4), so the hash sits next to Album by its
+# photo_path, one row per file, and goes when Blobs lets go of the file. The
+# 64 bits are also kept as four 16-bit bands, each indexed: two hashes a few
+# bits apart always share a band that is (almost) the same. UploadJobs keeps
+# what an upload turned out to look like, for the warning on the upload page.
+IMAGE_HASHES = '''
+CREATE TABLE IF NOT EXISTS ImageHashes (
+    blob_path TEXT PRIMARY KEY,
+    dhash INTEGER NOT NULL,
+    band0 INTEGER NOT NULL,
+    band1 INTEGER NOT NULL,
+    band2 INTEGER NOT NULL,
+    band3 INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_image_hashes_band0 ON ImageHashes (band0);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_band1 ON ImageHashes (band1);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_band2 ON ImageHashes (band2);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_band3 ON ImageHashes (band3);
+
+CREATE TRIGGER IF NOT EXISTS blobs_hash_delete AFTER DELETE ON Blobs
+BEGIN
+    DELETE FROM ImageHashes WHERE blob_path = OLD.blob_path;
+END;
+
+ALTER TABLE UploadJobs ADD COLUMN duplicates TEXT;
+'''
+
+MIGRATIONS = [
+    (1, 'initial schema', initial_schema),
+    (2, 'trip, journal and album indexes', TRIP_AND_CHILD_INDEXES),
+    (3, 'home page rating_asc index', RATING_ASC_INDEX),
+    (4, 'upload reference counts', UPLOAD_REFERENCE_COUNTS),
+    (5, 'background upload jobs', UPLOAD_JOBS),
+    (6, 'shared starter trips', STARTER_TRIPS),
+    (7, 'modification counters', MODIFICATION_COUNTERS),
+    (8, 'full-text search index', SEARCH_INDEX),
+    (9, 'dashboard statistics', USER_STATS),
+    (10, 'idempotency keys', IDEMPOTENCY_KEYS),
+    (11, 'sync change log', SYNC_LOG),
+    (12, 'planner statistics', PLANNER_STATISTICS),
+    (13, 'trip map points', TRIP_POINTS),
+    (14, 'locate existing trips', locate_existing_trips),
+    (15, 'calendar interval index', CALENDAR_INDEX),
+    (16, 'photo perceptual hashes', IMAGE_HASHES),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK_TIMEOUT = 600  # seconds a worker waits for another one's migration
+
+
+# ============================================================================
+# RUNNER
+# ============================================================================
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+# The statements of a SQL script, one at a time (executescript() would
+# commit the transaction apply_migration() holds). Trigger bodies and quoted
+# semicolons stay whole: a piece only ends once SQLite says it's complete.
+def _statements(script):
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
+
+
+# Apply one migration and bump user_version inside the same transaction.
+# Returns False if another process applied it first.
+def apply_migration(conn, version, step):
+    conn.execute('BEGIN IMMEDIATE')  # one migrating process at a time
+    try:
+        if get_version(conn) >= version:
+            conn.execute('ROLLBACK')
+            return False
+        if callable(step):
+            step(conn)
+        else:
+            for statement in _statements(step):
+                conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    return True
+
+
+# Bring the database up to `target` (default: latest). Returns the versions applied.
+def migrate(database, target=None, verbose=False):
+    target = LATEST_VERSION if target is None else target
+    # Long timeout: another worker may be in the middle of a slow step
+    conn = sqlite3.connect(database, isolation_level=None, timeout=MIGRATION_LOCK_TIMEOUT)
+    applied = []
+    try:
+        current = get_version(conn)
+        for version, name, step in MIGRATIONS:
+            if current < version <= target:
+                if verbose:
+                    print(f'Applying migration {version}: {name}')
+                if apply_migration(conn, version, step):
+                    applied.append(version)
+    finally:
+        conn.close()
+    return applied
+
+
+# Flask hook: migrate the app's database once at startup
+def init_app(app):
+    migrate(app.config['DATABASE'])
+
+
+# ============================================================================
+# DEMO DATA (python migrations.py --seed)
+# ============================================================================
+
+# Sample trips for user 1 (the starter content copied to new accounts)
+SEED_TRIPS = [
+    ("New York", "2024-12-29", "2025-01-06", "images/newyork.jpg", "Winter trip to the Big Apple", 5),
+    ("Thailand", "2025-01-02", "2025-01-15", "images/thailand.jpg", "Beach paradise and cultural temples", 4),
+    ("Singapore", "2023-12-01", "2024-01-11", "images/singapore.jpg", "Modern city-state exploration", 5),
+    ("Tokyo", "2024-03-15", "2024-03-25", "images/tokyo.jpg", "Cherry blossom season", 5),
+    ("Paris", "2024-06-10", "2024-06-20", "images/paris.jpg", "Romance and culture", 4),
+    ("Barcelona", "2024-07-05", "2024-07-15", "images/barcelona.jpg", "Gaudi architecture", 4),
+    ("Iceland", "2024-09-01", "2024-09-10", "images/iceland.jpg", "Northern lights adventure", 5),
+    ("Bali", "2024-10-12", "2024-10-22", "images/bali.jpg", "Island paradise", 5),
+    ("Dubai", "2024-11-05", "2024-11-12", "images/dubai.jpg", "Luxury and desert", 3),
+    ("Sydney", "2023-11-20", "2023-12-05", "images/sydney.jpg", "Harbour and beaches", 4),
+    ("Rome", "2024-04-01", "2024-04-10", "images/rome.jpg", "Ancient history tour", 5),
+    ("London", "2024-08-15", "2024-08-25", "images/london.jpg", "British culture immersion", 4),
+]
+
+# (entry_date, journal_entry, index into SEED_TRIPS)
+SEED_JOURNAL = [
+    ("2024-12-30", "Arrived in New York! Times Square was absolutely incredible at night. The energy here is unlike anything I have experienced before.", 0),
+    ("2024-12-31", "Celebrated New Years Eve in Times Square. Freezing cold but completely worth it. The ball drop was magical!", 0),
+    ("2025-01-03", "Visited the Grand Palace today. The architecture is breathtaking and the golden stupas gleam in the sunlight.", 1),
+    ("2025-01-05", "Beach day at Phuket! Crystal clear water and white sand. Paradise found.", 1),
+    ("2023-12-02", "Marina Bay Sands light show was amazing! The Singapore skyline is futuristic.", 2),
+    ("2024-03-16", "Saw cherry blossoms at Ueno Park. Absolutely magical pink canopy everywhere.", 3),
+    ("2024-06-11", "Climbed the Eiffel Tower today. View was worth the two-hour wait!", 4),
+    ("2024-07-06", "Visited La Sagrada Familia. Gaudi was a genius. Still under construction after 140 years!", 5),
+    ("2024-09-02", "Saw the Northern Lights tonight! Dancing green curtains across the sky. Speechless.", 6),
+    ("2024-10-13", "Temple hopping in Ubud. The rice terraces are stunning.", 7),
+]
+
+# (photo_path, photo_alt, index into SEED_TRIPS, date_added)
+SEED_ALBUM = [
+    ("images/statue-liberty.jpg", "Statue of Liberty at sunset", 0, "2024-12-31"),
+    ("images/times-square-night.jpg", "Times Square lights at night", 0, "2024-12-30"),
+    ("images/thai-temple.jpg", "Ornate Thai temple with gold details", 1, "2025-01-04"),
+    ("images/thai-beach.jpg", "Crystal clear beach in Phuket", 1, "2025-01-06"),
+    ("images/merlion.jpg", "Merlion statue at Marina Bay", 2, "2023-12-03"),
+    ("images/cherry-blossoms.jpg", "Cherry blossom trees in full bloom", 3, "2024-03-17"),
+    ("images/eiffel-tower.jpg", "Eiffel Tower from Trocadero", 4, "2024-06-12"),
+    ("images/sagrada-familia.jpg", "La Sagrada Familia exterior", 5, "2024-07-06"),
+    ("images/northern-lights.jpg", "Green aurora borealis over Iceland", 6, "2024-09-02"),
+    ("images/bali-temple.jpg", "Balinese temple at sunset", 7, "2024-10-14"),
+]
+
+
+# Insert the demo data for user 1 (skipped if user 1 already has trips)
+def seed(database):
+    conn = sqlite3.connect(database)
+    try:
+        if conn.execute('SELECT 1 FROM Trips WHERE user_id = 1 LIMIT 1').fetchone():
+            print('User 1 already has trips, not seeding')
+            return
+
+        trip_ids = []
+        for trip in SEED_TRIPS:
+            cursor = conn.execute('''
+                INSERT INTO Trips (trip_location, trip_start, trip_end, trip_image, trip_description, rating, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, 1)
+            ''', trip)
+            trip_ids.append(cursor.lastrowid)
+
+        conn.executemany(
+            'INSERT INTO Journal (entry_date, journal_entry, trip_id) VALUES (?, ?, ?)',
+            [(date, text, trip_ids[i]) for date, text, i in SEED_JOURNAL]
+        )
+        conn.executemany(
+            'INSERT INTO Album (photo_path, photo_alt, trip_id, date_added) VALUES (?, ?, ?, ?)',
+            [(path, alt, trip_ids[i], date) for path, alt, i, date in SEED_ALBUM]
+        )
+        locate_missing(conn)
+        conn.commit()
+        print(f'Seeded {len(trip_ids)} trips for user 1')
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# COMMAND LINE: python migrations.py [database] [--seed]
+# ============================================================================
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    database = args[0] if args else 'part_a.db'
+
+    applied = migrate(database, verbose=True)
+    if not applied:
+        print(f'{database} is already at version {LATEST_VERSION}')
+
+    if '--seed' in sys.argv:
+        seed(database)
@@ -0,0 +1,103 @@
+import base64
+import json
+
+# ============================================================================
+# KEYSET PAGINATION (HOME PAGE TRIPS)
+# ============================================================================
+#
+# Instead of OFFSET (which still walks every skipped row) each page remembers
+# the sort value + trip_id of its last card, and the next page starts strictly
+# after that position. trip_id is the tiebreaker so the order is always total.
+# Each sort lines up with an index from migrations.py.
+#
+# Trips.rating can be NULL (older rows, imports), and NULL never compares
+# > or = to anything - so the rating sorts use COALESCE(rating, 0), unrated
+# first/last, in the ORDER BY, the cursor and the index alike.
+
+TRIPS_PER_PAGE = 24
+
+# sort name -> (sort expression, collation, direction, trip_id tiebreaker direction)
+TRIP_SORTS = {
+    'date_asc': ('trip_start', '', 'ASC', 'ASC'),
+    'date_desc': ('trip_start', '', 'DESC', 'DESC'),
+    'id_asc': (None, '', None, 'ASC'),
+    'id_desc': (None, '', None, 'DESC'),
+    'location_asc': ('trip_location', ' COLLATE NOCASE', 'ASC', 'ASC'),
+    'rating_asc': ('COALESCE(rating, 0)', '', 'ASC', 'DESC'),
+    'rating_desc': ('COALESCE(rating, 0)', '', 'DESC', 'DESC'),
+}
+DEFAULT_TRIP_SORT = 'id_desc'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Opaque, URL-safe cursor for the last row on a page
+def encode_cursor(sort_value, trip_id):
+    raw = json.dumps([sort_value, trip_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, trip_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(trip_id, int):
+        raise InvalidCursor(cursor)
+    return sort_value, trip_id
+
+
+def trip_order_clause(sort_by):
+    column, collate, direction, tiebreak = TRIP_SORTS.get(sort_by, TRIP_SORTS[DEFAULT_TRIP_SORT])
+    if column is None:
+        return f'ORDER BY trip_id {tiebreak}'
+    return f'ORDER BY {column}{collate} {direction}, trip_id {tiebreak}'
+
+
+# WHERE fragment + params for "rows after (sort_value, trip_id)"
+def _after_clause(sort_by, sort_value, trip_id):
+    column, collate, direction, tiebreak = TRIP_SORTS[sort_by]
+    id_op = '>' if tiebreak == 'ASC' else '<'
+    if column is None:
+        return f'AND trip_id {id_op} ?', (trip_id,)
+    op = '>' if direction == 'ASC' else '<'
+    return (
+        f'AND ({column}{collate} {op} ? OR ({column} = ?{collate} AND trip_id {id_op} ?))',
+        (sort_value, sort_value, trip_id),
+    )
+
+
+# One page of a user's trips. Returns (trips, next_cursor or None).
+# `visible` replaces the plain "user_id = ?" filter, e.g. to include shared
+# starter trips (see starter.visible_trips_clause). `columns` limits what is
+# selected (the sort value and trip_id are always added for the cursor).
+def trip_page(conn, user_id, sort_by=DEFAULT_TRIP_SORT, after=None, limit=TRIPS_PER_PAGE, visible=None,
+              columns=None):
+    if sort_by not in TRIP_SORTS:
+        sort_by = DEFAULT_TRIP_SORT
+    column = TRIP_SORTS[sort_by][0]
+
+    owner, owner_params = visible or ('user_id = ?', (user_id,))
+    where, params = f'WHERE {owner}', list(owner_params)
+    if after:
+        sort_value, trip_id = decode_cursor(after)
+        clause, clause_params = _after_clause(sort_by, sort_value, trip_id)
+        where += ' ' + clause
+        params.extend(clause_params)
+
+    # Fetch one extra row to know whether there is another page
+    selected = ', '.join(dict.fromkeys(['trip_id', *columns])) if columns else '*'
+    if column:
+        selected += f', {column} AS sort_value'
+    query = f'SELECT {selected} FROM Trips {where} {trip_order_clause(sort_by)} LIMIT ?'
+    rows = conn.execute(query, (*params, limit + 1)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['sort_value'] if column else None, last['trip_id'])
+    return rows, next_cursor
@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from profiling import observe_password, count_password_rejected
+
+# ============================================================================
+# PASSWORD HASHING POOL
+# ============================================================================
+#
+# A password hash is slow on purpose (tens of milliseconds of CPU). Done on
+# the request thread, a burst of logins would hold the GIL and starve every
+# other route in the process. So login / register hand the work to a small
+# process pool (PASSWORD_WORKERS processes) and wait for the result.
+#
+# At most PASSWORD_QUEUE_SIZE hashes may be running or waiting at once per
+# process; past that, hash_password() / verify_password() raise PoolBusy
+# straight away (the app answers 429 + Retry-After) instead of letting the
+# queue - and every waiting request - grow.
+#
+# PASSWORD_METHOD is any Werkzeug method string, scrypt by default
+# ("scrypt:32768:8:1"; "pbkdf2:sha256:600000" also works). A stored hash made
+# with other parameters is replaced on the next successful login, in the same
+# worker call that checked it.
+#
+# PASSWORD_WORKERS = 0 hashes on the calling thread (scripts, tests).
+#
+# The workers come from a fork server, not a fork of the app: by the first
+# login the app has upload threads, request threads and (asgi.py) an event
+# loop, and a child forked while one of them holds a lock can hang on it.
+# The fork server is a fresh interpreter that only imports this module. If a
+# worker dies, the pool is replaced and the hash is tried once more.
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 16
+RETRY_AFTER = 1  # seconds, for the 429
+
+# Checked against when the username doesn't exist, so that takes as long as
+# a wrong password (no telling which usernames are taken from the timing)
+_dummy_hash = None
+
+_executor = None
+_executor_lock = threading.Lock()
+_context = None
+_slots = None
+_method = DEFAULT_METHOD
+_workers = DEFAULT_WORKERS
+
+
+class PoolBusy(Exception):
+    pass
+
+
+# ============================================================================
+# WORKER SIDE (RUNS IN THE POOL'S PROCESSES)
+# ============================================================================
+
+def _hash(password, method):
+    started = time.perf_counter()
+    return generate_password_hash(password, method), time.perf_counter() - started
+
+
+# (matches, new hash if the stored one used other parameters, seconds)
+def _verify(stored, password, method):
+    started = time.perf_counter()
+    matches = check_password_hash(stored, password)
+    rehashed = None
+    if matches and stored.split('$', 1)[0] != method:
+        rehashed = generate_password_hash(password, method)
+    return matches, rehashed, time.perf_counter() - started
+
+
+# ============================================================================
+# REQUEST SIDE
+# ============================================================================
+
+# Processes start on the first submit, so creating a pool is cheap
+def _new_executor():
+    return ProcessPoolExecutor(max_workers=_workers, mp_context=_context)
+
+
+# A worker died (killed, out of memory): swap in a new pool, unless another
+# request already has
+def _replace_executor(broken):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = _new_executor()
+            broken.shutdown(wait=False)
+        return _executor
+
+
+def _submit(func, *args):
+    executor = _executor
+    try:
+        return executor.submit(func, *args).result()
+    except BrokenProcessPool:
+        return _replace_executor(executor).submit(func, *args).result()
+
+
+# Run one hash in the pool (or inline with no workers), timing queue + KDF
+def _run(operation, func, *args):
+    if not _slots.acquire(blocking=False):
+        count_password_rejected(operation)
+        raise PoolBusy(operation)
+    started = time.perf_counter()
+    try:
+        if _workers == 0:
+            result = func(*args)
+        else:
+            result = _submit(func, *args)
+    finally:
+        _slots.release()
+    observe_password(operation, time.perf_counter() - started, result[-1])
+    return result[:-1]
+
+
+def hash_password(password):
+    return _run('hash', _hash, password, _method)[0]
+
+
+# (matches, new hash to store or None). `stored` is None for an unknown user.
+def verify_password(stored, password):
+    if stored is None:
+        _run('verify', _verify, _dummy_hash, password, _method)
+        return False, None
+    return _run('verify', _verify, stored, password, _method)
+
+
+def init_app(app):
+    global _method, _workers, _slots, _dummy_hash, _executor, _context
+    app.config.setdefault('PASSWORD_METHOD', DEFAULT_METHOD)
+    app.config.setdefault('PASSWORD_WORKERS', DEFAULT_WORKERS)
+    app.config.setdefault('PASSWORD_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+    # Werkzeug fills in the default parameters ("pbkdf2" -> "pbkdf2:sha256:1000000"):
+    # keep the full string, it's what stored hashes are compared against
+    _dummy_hash = generate_password_hash(os.urandom(16).hex(), app.config['PASSWORD_METHOD'])
+    _method = _dummy_hash.split('$', 1)[0]
+    _workers = app.config['PASSWORD_WORKERS']
+    _slots = threading.BoundedSemaphore(max(1, app.config['PASSWORD_QUEUE_SIZE']))
+    if _workers:
+        _context = multiprocessing.get_context('forkserver')
+        _context.set_forkserver_preload([__name__])
+        _executor = _new_executor()
@@ -0,0 +1,348 @@
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_app_context, has_request_context, before_render_template, template_rendered
+
+from cache import get_cache
+
+# ============================================================================
+# PROFILING (OPT-IN: PROFILING = True / TRIPTROVE_PROFILING=1)
+# ============================================================================
+#
+# Shows where a request's time goes:
+#
+#   db       every statement run on a pooled connection (db.py hands out
+#            ProfiledConnections), with its duration and row count. Time
+#            spent fetching rows counts towards the statement.
+#   tpl      Jinja rendering (Flask's template signals)
+#   upload   copying uploaded files into the upload queue (timed() blocks)
+#   kdf      password hashing on login / register (queue wait + hashing,
+#            split in the metrics; see passwords.py)
+#
+# Each response gets a Server-Timing header (browser dev tools show it next
+# to the request), and the totals go into histograms served from /metrics in
+# Prometheus text format, together with the render cache counters.
+#
+# Statements slower than SLOW_QUERY_MS are logged (logger 'triptrove.sql')
+# with their EXPLAIN QUERY PLAN. Statements run outside a request (upload
+# jobs) are counted under the route "background", timed up to their first row.
+#
+# Metrics are per process, like the render cache. With profiling off none of
+# this is installed: connections, cursors and templates are the plain ones.
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+# Histogram buckets (seconds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+EXPLAINED_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+slow_query_log = logging.getLogger('triptrove.sql')
+
+_enabled = False
+_slow_seconds = DEFAULT_SLOW_QUERY_MS / 1000
+
+
+# ============================================================================
+# METRICS (a minimal Prometheus registry: counters and histograms)
+# ============================================================================
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._values = {}  # labels -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), labels + (bound,))} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {total:.6f}')
+                lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+REQUESTS = Counter('triptrove_requests_total', 'Requests handled.', ('route', 'status'))
+REQUEST_SECONDS = Histogram('triptrove_request_duration_seconds', 'Time in the app per request.', ('route',))
+SQL_SECONDS = Histogram('triptrove_sql_duration_seconds', 'SQL time per statement.', ('route',))
+SQL_ROWS = Counter('triptrove_sql_rows_total', 'Rows returned or changed by SQL statements.', ('route',))
+SLOW_QUERIES = Counter('triptrove_sql_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.', ('route',))
+TEMPLATE_SECONDS = Histogram('triptrove_template_render_seconds', 'Jinja render time.', ('template',))
+IO_SECONDS = Histogram('triptrove_io_duration_seconds', 'File I/O time.', ('operation',))
+PASSWORD_SECONDS = Histogram('triptrove_password_duration_seconds',
+                             'Password hashing: time waiting for the pool, and hashing.', ('operation', 'stage'))
+PASSWORDS_REJECTED = Counter('triptrove_password_rejected_total', 'Hashes refused because the pool was full.',
+                             ('operation',))
+METRICS = (REQUESTS, REQUEST_SECONDS, SQL_SECONDS, SQL_ROWS, SLOW_QUERIES, TEMPLATE_SECONDS, IO_SECONDS,
+           PASSWORD_SECONDS, PASSWORDS_REJECTED)
+
+
+# Everything, in Prometheus text format (plus the render cache's counters)
+def render_metrics(app):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    stats = get_cache(app).stats()
+    for key, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                      ('entries', 'gauge'), ('bytes', 'gauge'), ('max_bytes', 'gauge')):
+        name = f'triptrove_render_cache_{key}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {name} Render cache {key.replace("_", " ")}.', f'# TYPE {name} {kind}', f'{name} {stats[key]}']
+    return '\n'.join(lines) + '\n'
+
+
+# ============================================================================
+# PER-REQUEST PROFILE
+# ============================================================================
+
+class Profile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = []  # [{'sql', 'parameters', 'seconds', 'rows'}]
+        self.template_seconds = 0.0
+        self.template_starts = []
+        self.io_seconds = {}
+
+    def server_timing(self, total):
+        db = sum(statement['seconds'] for statement in self.statements)
+        parts = [f'db;dur={db * 1000:.1f};desc="{len(self.statements)} queries"',
+                 f'tpl;dur={self.template_seconds * 1000:.1f}']
+        parts += [f'{operation};dur={seconds * 1000:.1f}' for operation, seconds in self.io_seconds.items()]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def _profile():
+    return g.get('profile') if has_app_context() else None
+
+
+def _route():
+    return (request.endpoint or 'unmatched') if has_request_context() else 'background'
+
+
+# Time a block of file I/O: with timed('upload'): ...
+@contextmanager
+def timed(operation):
+    if not _enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        IO_SECONDS.observe((operation,), seconds)
+        profile = _profile()
+        if profile is not None:
+            profile.io_seconds[operation] = profile.io_seconds.get(operation, 0.0) + seconds
+
+
+# One password hash (see passwords.py): `total` from the request's point of
+# view, `hashing` inside the worker (the rest was spent queued)
+def observe_password(operation, total, hashing):
+    if not _enabled:
+        return
+    PASSWORD_SECONDS.observe((operation, 'queued'), max(0.0, total - hashing))
+    PASSWORD_SECONDS.observe((operation, 'hashing'), hashing)
+    profile = _profile()
+    if profile is not None:
+        profile.io_seconds['kdf'] = profile.io_seconds.get('kdf', 0.0) + total
+
+
+def count_password_rejected(operation):
+    if _enabled:
+        PASSWORDS_REJECTED.inc((operation,))
+
+
+# ============================================================================
+# SQL: CONNECTION / CURSOR THAT TIME EVERY STATEMENT
+# ============================================================================
+
+class ProfiledCursor(sqlite3.Cursor):
+    _statement = None
+
+    def _start(self, sql, parameters, run):
+        started = time.perf_counter()
+        try:
+            return run()
+        finally:
+            seconds = time.perf_counter() - started
+            statement = {'sql': sql, 'parameters': parameters, 'seconds': seconds,
+                         'rows': max(self.rowcount, 0)}  # SELECT rows are added as they're fetched
+            profile = _profile()
+            if profile is not None:
+                self._statement = statement
+                profile.statements.append(statement)
+            else:
+                self._statement = None
+                _finish(self.connection, statement, 'background')
+
+    def _fetched(self, started, rows):
+        if self._statement is not None:
+            self._statement['seconds'] += time.perf_counter() - started
+            self._statement['rows'] += rows
+
+    def execute(self, sql, parameters=()):
+        return self._start(sql, parameters, lambda: super(ProfiledCursor, self).execute(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else ()
+        return self._start(sql, first, lambda: super(ProfiledCursor, self).executemany(sql, seq_of_parameters))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0)
+            raise
+        self._fetched(started, 1)
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute() bypasses Cursor.execute(), so go through ours
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _explain(conn, sql, parameters):
+    if conn is None or not sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+        return ''
+    try:
+        plan = sqlite3.Connection.execute(conn, f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    except sqlite3.Error as e:
+        return f'(no plan: {e})'
+    return '\n'.join(f'  {row[3]}' for row in plan)
+
+
+# Count a finished statement, and log it if it was slow
+def _finish(conn, statement, route):
+    SQL_SECONDS.observe((route,), statement['seconds'])
+    SQL_ROWS.inc((route,), statement['rows'])
+    if statement['seconds'] >= _slow_seconds:
+        SLOW_QUERIES.inc((route,))
+        plan = _explain(conn, statement['sql'], statement['parameters'])
+        slow_query_log.warning('Slow query (%.1fms, %d rows, %s): %s%s',
+                               statement['seconds'] * 1000, statement['rows'], route,
+                               ' '.join(statement['sql'].split()), f'\n{plan}' if plan else '')
+
+
+# ============================================================================
+# REQUEST / TEMPLATE HOOKS
+# ============================================================================
+
+def _start_request():
+    g.profile = Profile()
+
+
+def _finish_request(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    total = time.perf_counter() - profile.started
+    route = _route()
+    conn = g.get('db')
+    for statement in profile.statements:
+        _finish(conn, statement, route)
+    REQUESTS.inc((route, str(response.status_code)))
+    REQUEST_SECONDS.observe((route,), total)
+    response.headers['Server-Timing'] = profile.server_timing(total)
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    profile = _profile()
+    if profile is not None:
+        profile.template_starts.append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    profile = _profile()
+    if profile is not None and profile.template_starts:
+        seconds = time.perf_counter() - profile.template_starts.pop()
+        profile.template_seconds += seconds
+        TEMPLATE_SECONDS.observe((template.name or 'string',), seconds)
+
+
+# Call before anything opens a pooled connection (db.py reads the factory)
+def init_app(app):
+    global _enabled, _slow_seconds
+    app.config.setdefault('PROFILING', False)
+    app.config.setdefault('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+    app.config.setdefault('METRICS_ALLOWED_IPS', DEFAULT_METRICS_ALLOWED_IPS)
+    if not app.config['PROFILING']:
+        return
+
+    _enabled = True
+    _slow_seconds = app.config['SLOW_QUERY_MS'] / 1000
+    app.config['DB_CONNECTION_FACTORY'] = ProfiledConnection
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
@@ -0,0 +1,148 @@
+import re
+from markupsafe import Markup, escape
+
+from pagination import encode_cursor, decode_cursor, InvalidCursor
+from starter import STARTER_USER_ID, has_starter_content
+
+# ============================================================================
+# FULL-TEXT SEARCH (TRIPS, JOURNAL ENTRIES, PHOTO CAPTIONS)
+# ============================================================================
+#
+# SearchIndex (migration 8) is an FTS5 table kept in sync by triggers. A
+# query only matches rows whose owner token is the user's ("u<user_id>", plus
+# "u1" for shared starter trips), so FTS5 intersects the user's posting list
+# with the search terms instead of looking at everyone's rows.
+#
+# Every one of the user's matches is ranked, inside FTS5, with bm25() and
+# column weights (a hit in the trip location counts TITLE_WEIGHT times a hit
+# in the text; the UNINDEXED and owner columns count for nothing). bm25()
+# reads each term's document count from the whole index, which costs more
+# for very common words than scoring a sample would - but a sample (say the
+# newest N rows) can leave a heavy user's best, older matches out entirely.
+#
+# Only the page being shown goes through highlight(), in a second query on
+# its rowids.
+#
+# Pages use the same keyset cursors as the home page, on (score, rowid).
+
+RESULTS_PER_PAGE = 20
+MAX_TERMS = 10
+SNIPPET_WORDS = 24
+
+# How much more a match in the trip location counts than one in the text
+TITLE_WEIGHT = 4.0
+
+# bm25() weights for SearchIndex's columns (kind, item_id, trip_id, owner, title, body)
+_WEIGHTS = (0.0, 0.0, 0.0, 0.0, TITLE_WEIGHT, 1.0)
+
+# Highlight markers: control characters that can't appear in typed text, so
+# the text can be HTML-escaped first and the markers swapped for <mark> after
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+
+# Turn what the user typed into a safe FTS5 expression: every word becomes a
+# quoted term, so AND / NEAR / * / quotes are just text. (No prefix matching:
+# a prefix term makes FTS5 merge the lists of every word it could start.)
+def build_match(text):
+    terms = re.findall(r'\w+', text or '')[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def _highlight(text):
+    return Markup(str(escape(text or ''))
+                  .replace(HIGHLIGHT_START, '<mark>')
+                  .replace(HIGHLIGHT_END, '</mark>'))
+
+
+# A few words either side of the first match
+def _snippet(text):
+    words = text.split()
+    first = next((i for i, word in enumerate(words) if HIGHLIGHT_START in word), 0)
+    start = max(0, first - SNIPPET_WORDS // 3)
+    end = start + SNIPPET_WORDS
+    snippet = ' '.join(words[start:end])
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(words) else '')
+
+
+# One page of results for a user. Returns (results, next_cursor or None).
+def search(conn, user_id, text, after=None, limit=RESULTS_PER_PAGE):
+    match = build_match(text)
+    if match is None:
+        return [], None
+
+    owners = [f'u{user_id}']
+    starter = has_starter_content(conn, user_id)
+    if starter:
+        owners.append(f'u{STARTER_USER_ID}')
+    expression = f'owner : ({" OR ".join(owners)}) AND {{title body}} : ({match})'
+
+    where, params = ['SearchIndex MATCH ?'], [expression]
+    if starter:
+        # Starter trips the user has copied or deleted
+        where.append('trip_id NOT IN (SELECT template_trip_id FROM StarterOverrides WHERE user_id = ?)')
+        params.append(user_id)
+
+    # bm25() is lower for better matches: best first, rowid as the tiebreaker
+    # (same idea as pagination.py)
+    keyset = ''
+    if after:
+        score, rowid = decode_cursor(after)
+        if not isinstance(score, (int, float)):
+            raise InvalidCursor(after)
+        keyset = 'WHERE score > ? OR (score = ? AND rowid > ?)'
+        params += [score, score, rowid]
+
+    ranked = conn.execute(f'''
+        SELECT rowid, kind, item_id, trip_id, score FROM (
+            SELECT rowid, kind, item_id, trip_id, bm25(SearchIndex, {', '.join(map(str, _WEIGHTS))}) AS score
+            FROM SearchIndex
+            WHERE {' AND '.join(where)}
+        )
+        {keyset}
+        ORDER BY score, rowid
+        LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+
+    page = ranked[:limit]
+    next_cursor = None
+    if len(ranked) > limit:
+        next_cursor = encode_cursor(page[-1]['score'], page[-1]['rowid'])
+    return _describe(conn, page, expression), next_cursor
+
+
+# Add what the results page shows (highlighted text, trip location, entry
+# date, photo) to a page
+def _describe(conn, page, expression):
+    def lookup(query, ids):
+        if not ids:
+            return {}
+        return {row[0]: row[1] for row in conn.execute(query.format(','.join('?' * len(ids))), list(ids))}
+
+    if not page:
+        return []
+    texts = {row[0]: row[1:] for row in conn.execute(f'''
+        SELECT rowid, highlight(SearchIndex, 4, ?, ?), highlight(SearchIndex, 5, ?, ?)
+        FROM SearchIndex
+        WHERE SearchIndex MATCH ? AND rowid IN ({','.join('?' * len(page))})
+    ''', (HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, expression,
+          *(c['rowid'] for c in page)))}
+
+    locations = lookup('SELECT trip_id, trip_location FROM Trips WHERE trip_id IN ({})',
+                       {c['trip_id'] for c in page})
+    entry_dates = lookup('SELECT journal_id, entry_date FROM Journal WHERE journal_id IN ({})',
+                         {c['item_id'] for c in page if c['kind'] == 'journal'})
+    photo_paths = lookup('SELECT photo_id, photo_path FROM Album WHERE photo_id IN ({})',
+                         {c['item_id'] for c in page if c['kind'] == 'photo'})
+
+    return [{
+        'kind': c['kind'],
+        'item_id': c['item_id'],
+        'trip_id': c['trip_id'],
+        'trip_location': locations.get(c['trip_id']),
+        'title': _highlight(texts[c['rowid']][0]) if c['kind'] == 'trip' else None,
+        'snippet': _highlight(_snippet(texts[c['rowid']][1])),
+        'entry_date': entry_dates.get(c['item_id']) if c['kind'] == 'journal' else None,
+        'photo_path': photo_paths.get(c['item_id']) if c['kind'] == 'photo' else None,
+    } for c in page]
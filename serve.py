@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+
+try:
+    import uvicorn
+except ImportError:  # only needed for the production server (python serve.py)
+    uvicorn = None
+
+# ============================================================================
+# LAUNCHER: python serve.py [--workers N] [--threads N] [--keep-alive S] ...
+# ============================================================================
+#
+# Production: serves asgi.application (the Flask app under asyncio) with
+# uvicorn. --workers is the number of processes, --threads the size of each
+# process's view executor (SQLite + templates; see asgi.py), --keep-alive how
+# long an idle connection is held open.
+#
+# Development: python serve.py --dev (Flask's reloading debug server).
+#
+# With more than one worker the in-process render cache is switched off: a
+# write handled by one process can't invalidate another process's pages.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5000
+DEFAULT_WORKERS = 1
+DEFAULT_THREADS = 8
+DEFAULT_KEEP_ALIVE = 5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the TripTrove server.')
+    parser.add_argument('--host', default=os.environ.get('TRIPTROVE_HOST', DEFAULT_HOST))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('TRIPTROVE_PORT', DEFAULT_PORT)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('TRIPTROVE_WORKERS', DEFAULT_WORKERS)),
+                        help='server processes')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('TRIPTROVE_THREADS', DEFAULT_THREADS)),
+                        help='view threads per process (database + templates)')
+    parser.add_argument('--keep-alive', type=int, default=int(os.environ.get('TRIPTROVE_KEEP_ALIVE', DEFAULT_KEEP_ALIVE)),
+                        help='seconds to keep an idle connection open')
+    parser.add_argument('--dev', action='store_true', help="Flask's debug server instead")
+    return parser.parse_args(argv)
+
+
+# `app` is passed when started as python app.py, so it isn't imported twice
+def main(argv=None, app=None):
+    args = parse_args(argv)
+
+    if args.dev:
+        if app is None:
+            from app import app
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+
+    if uvicorn is None:
+        sys.exit('uvicorn is required for the production server: pip install uvicorn (or use --dev)')
+
+    # Read by asgi.create_application() (and by app.py) in every worker process
+    os.environ['TRIPTROVE_ASGI_THREADS'] = str(args.threads)
+    os.environ.setdefault('TRIPTROVE_DB_POOL_SIZE', str(args.threads))
+    if args.workers > 1:
+        os.environ['TRIPTROVE_RENDER_CACHE_BYTES'] = '0'
+
+    options = dict(host=args.host, port=args.port, timeout_keep_alive=args.keep_alive, lifespan='on')
+    if args.workers == 1 and app is not None:
+        from asgi import wrap
+        uvicorn.run(wrap(app, args.threads), **options)
+    else:
+        uvicorn.run('asgi:application', workers=args.workers, **options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+from flask import g
+
+# ============================================================================
+# STARTER TRIPS (COPY-ON-WRITE)
+# ============================================================================
+#
+# New accounts start out with the demo trips owned by STARTER_USER_ID. Rather
+# than copying them (plus their journal entries and photos) at sign-up, those
+# trips are shared read-only with every account that has Users.starter_content
+# set. A user only gets their own copy the first time they change one - see
+# materialize(). StarterOverrides records, per user, which starter trips have
+# been copied (trip_id = the copy) or deleted (trip_id IS NULL).
+
+STARTER_USER_ID = 1
+
+
+def has_starter_content(conn, user_id):
+    cache = g.setdefault('starter_content', {})
+    if user_id not in cache:
+        row = conn.execute('SELECT starter_content FROM Users WHERE user_id = ?', (user_id,)).fetchone()
+        cache[user_id] = bool(row and row['starter_content'])
+    return cache[user_id]
+
+
+# WHERE condition for "every trip this user can see": their own, plus the
+# starter trips they haven't copied or deleted. Returns (sql, params).
+def visible_trips_clause(conn, user_id):
+    if not has_starter_content(conn, user_id):
+        return 'user_id = ?', (user_id,)
+    return ('''(user_id = ? OR (user_id = ? AND trip_id NOT IN (
+        SELECT template_trip_id FROM StarterOverrides WHERE user_id = ?)))''',
+            (user_id, STARTER_USER_ID, user_id))
+
+
+# Is this trip a starter trip the user is still sharing (not copied/deleted)?
+def is_shared_starter(conn, trip, user_id):
+    if trip is None or trip['user_id'] != STARTER_USER_ID or user_id == STARTER_USER_ID:
+        return False
+    if not has_starter_content(conn, user_id):
+        return False
+    override = conn.execute('''
+        SELECT 1 FROM StarterOverrides WHERE user_id = ? AND template_trip_id = ?
+    ''', (user_id, trip['trip_id'])).fetchone()
+    return override is None
+
+
+# May the user look at this trip? (any row with trip_id + user_id columns)
+def is_visible(conn, trip, user_id):
+    return trip['user_id'] == user_id or is_shared_starter(conn, trip, user_id)
+
+
+# A trip the user may look at (their own, or a shared starter trip), else None
+def get_visible_trip(conn, trip_id, user_id):
+    trip = conn.execute('SELECT * FROM Trips WHERE trip_id = ?', (trip_id,)).fetchone()
+    if trip is None or not is_visible(conn, trip, user_id):
+        return None
+    return trip
+
+
+# Give the user their own copy of a shared starter trip (one INSERT ... SELECT
+# per table). Returns (new_trip_id, {old journal_id: new}, {old photo_id: new}),
+# or None if the user hid the trip in the meantime.
+# Doesn't commit - the caller's change goes in the same transaction.
+def materialize(conn, trip_id, user_id):
+    # Take the write lock before looking again: a second first edit of the
+    # same trip (double submit, two tabs) waits here, then uses the copy the
+    # first one made instead of making another
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    existing = conn.execute('''
+        SELECT trip_id FROM StarterOverrides WHERE user_id = ? AND template_trip_id = ?
+    ''', (user_id, trip_id)).fetchone()
+    if existing is not None:
+        return _existing_copy(conn, trip_id, existing['trip_id'])
+
+    cursor = conn.execute('''
+        INSERT INTO Trips (trip_location, trip_start, trip_end, trip_image, trip_description, rating, user_id)
+        SELECT trip_location, trip_start, trip_end, trip_image, trip_description, rating, ?
+        FROM Trips WHERE trip_id = ?
+    ''', (user_id, trip_id))
+    new_trip_id = cursor.lastrowid
+
+    journal_map = _copy_children(conn, 'Journal', 'journal_id', 'entry_date, journal_entry', trip_id, new_trip_id)
+    album_map = _copy_children(conn, 'Album', 'photo_id', 'photo_path, photo_alt, date_added', trip_id, new_trip_id)
+
+    conn.execute('''
+        INSERT INTO StarterOverrides (user_id, template_trip_id, trip_id) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, template_trip_id) DO NOTHING
+    ''', (user_id, trip_id, new_trip_id))
+    return new_trip_id, journal_map, album_map
+
+
+# The copy another request already made: its id, and child maps pairing each
+# template row with an unchanged copy of it. A row since changed or deleted
+# on the copy maps to None, so a late edit of it does nothing (rather than
+# landing on the shared template row).
+def _existing_copy(conn, template_trip_id, copy_trip_id):
+    if copy_trip_id is None:
+        return None  # hidden
+    journal_map = _match_children(conn, 'Journal', 'journal_id', 'entry_date, journal_entry',
+                                  template_trip_id, copy_trip_id)
+    album_map = _match_children(conn, 'Album', 'photo_id', 'photo_path, photo_alt, date_added',
+                                template_trip_id, copy_trip_id)
+    return copy_trip_id, journal_map, album_map
+
+
+def _match_children(conn, table, id_column, columns, old_trip_id, new_trip_id):
+    query = f'SELECT {id_column}, {columns} FROM {table} WHERE trip_id = ? ORDER BY {id_column}'
+    copies = {}
+    for row in conn.execute(query, (new_trip_id,)):
+        copies.setdefault(tuple(row[1:]), []).append(row[0])
+    mapping = {}
+    for row in conn.execute(query, (old_trip_id,)):
+        same = copies.get(tuple(row[1:]))
+        mapping[row[0]] = same.pop(0) if same else None
+    return mapping
+
+
+# Copy every child row in one statement. New ids come out in the same order as
+# the old ones (AUTOINCREMENT, single statement), which gives us the mapping.
+def _copy_children(conn, table, id_column, columns, old_trip_id, new_trip_id):
+    old_ids = [row[0] for row in conn.execute(
+        f'SELECT {id_column} FROM {table} WHERE trip_id = ? ORDER BY {id_column}', (old_trip_id,))]
+    if not old_ids:
+        return {}
+    cursor = conn.execute(f'''
+        INSERT INTO {table} ({columns}, trip_id)
+        SELECT {columns}, ? FROM {table} WHERE trip_id = ? ORDER BY {id_column}
+    ''', (new_trip_id, old_trip_id))
+    first_new_id = cursor.lastrowid - len(old_ids) + 1
+    return {old_id: first_new_id + i for i, old_id in enumerate(old_ids)}
+
+
+# Stop showing a starter trip to this user (their "delete")
+def hide(conn, trip_id, user_id):
+    conn.execute('''
+        INSERT OR IGNORE INTO StarterOverrides (user_id, template_trip_id, trip_id) VALUES (?, ?, NULL)
+    ''', (user_id, trip_id))
+
+
+# For write routes: the user's own trip id for trip_id, copying a shared
+# starter trip first if needed. Returns (trip_id, journal_map, album_map),
+# or None if the user can't see the trip (any more).
+def own_trip(conn, trip_id, user_id):
+    trip = conn.execute('SELECT trip_id, user_id FROM Trips WHERE trip_id = ?', (trip_id,)).fetchone()
+    if trip is None:
+        return None
+    if trip['user_id'] == user_id:
+        return trip_id, {}, {}
+    if is_shared_starter(conn, trip, user_id):
+        return materialize(conn, trip_id, user_id)
+    return None
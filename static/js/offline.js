@@ -0,0 +1,55 @@
+// Offline support: register the service worker (templates/sw.js), give each
+// journal / upload submission an idempotency key, and ask the worker to send
+// anything queued offline as soon as the connection is back.
+(function() {
+    function newKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+    }
+
+    // One key per submission: a double click sends the same key twice (the
+    // server runs it once), a new entry after going Back gets a fresh one
+    document.addEventListener('submit', function(e) {
+        const form = e.target;
+        if (!form.matches('form[data-idempotent]')) {
+            return;
+        }
+        const action = new URL(form.action, location.href);
+        if (!action.searchParams.has('idempotency_key')) {
+            action.searchParams.set('idempotency_key', newKey());
+            form.action = action.toString();
+        }
+    }, true);
+
+    window.addEventListener('pageshow', function(e) {
+        if (!e.persisted) {
+            return;
+        }
+        document.querySelectorAll('form[data-idempotent]').forEach(function(form) {
+            const action = new URL(form.action, location.href);
+            action.searchParams.delete('idempotency_key');
+            form.action = action.toString();
+        });
+    });
+
+    if (!('serviceWorker' in navigator)) {
+        return;
+    }
+
+    navigator.serviceWorker.register('/sw.js').catch(function() {});
+
+    // Browsers without Background Sync: flush the queue when we're back online
+    window.addEventListener('online', function() {
+        if (navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage('flush-outbox');
+        }
+    });
+
+    navigator.serviceWorker.addEventListener('message', function(e) {
+        if (e.data && e.data.type === 'outbox-sent' && document.body.dataset.offlineQueued !== undefined) {
+            location.replace('/');  // on the "saved offline" page: it's been sent now
+        }
+    });
+})();
@@ -0,0 +1,28 @@
+// Photos still processing in the background: poll until they're ready, then swap them in
+document.addEventListener('DOMContentLoaded', function() {
+    const POLL_INTERVAL = 2000;
+
+    function poll(placeholder) {
+        const url = '/uploads/status/' + placeholder.dataset.jobId +
+                    '?alt=' + encodeURIComponent(placeholder.dataset.alt) +
+                    '&sizes=' + encodeURIComponent(placeholder.dataset.sizes);
+
+        fetch(url, {credentials: 'same-origin'})
+            .then(function(response) { return response.json(); })
+            .then(function(job) {
+                if (job.status === 'done') {
+                    placeholder.outerHTML = job.html;
+                } else if (job.status === 'failed' || job.error) {
+                    placeholder.textContent = job.error || 'Upload failed';
+                    placeholder.classList.add('failed');
+                } else {
+                    setTimeout(function() { poll(placeholder); }, POLL_INTERVAL);
+                }
+            })
+            .catch(function() {
+                setTimeout(function() { poll(placeholder); }, POLL_INTERVAL * 2);
+            });
+    }
+
+    document.querySelectorAll('.photo-processing').forEach(poll);
+});
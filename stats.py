@@ -0,0 +1,68 @@
+from starter import STARTER_USER_ID, has_starter_content
+
+# ============================================================================
+# HOME PAGE DASHBOARD
+# ============================================================================
+#
+# Totals come from UserStats / UserYearStats (migration 9), which triggers keep
+# up to date on every write, so this costs the same for 10 trips or 10,000.
+#
+# A user sharing the starter trips sees those too: their numbers are their
+# own row plus the starter user's, minus the starter trips they've copied or
+# deleted (at most a handful of rows).
+
+STAT_FIELDS = ('trip_count', 'days_travelled', 'rating_sum', 'rated_count', 'journal_count', 'photo_count')
+
+
+def dashboard(conn, user_id):
+    user_ids = [user_id]
+    starter = has_starter_content(conn, user_id)
+    if starter:
+        user_ids.append(STARTER_USER_ID)
+    placeholders = ','.join('?' * len(user_ids))
+
+    totals = dict.fromkeys(STAT_FIELDS, 0)
+    for row in conn.execute(f'SELECT * FROM UserStats WHERE user_id IN ({placeholders})', user_ids):
+        for field in STAT_FIELDS:
+            totals[field] += row[field]
+
+    years = {}
+    for row in conn.execute(f'''
+        SELECT year, trip_count, days_travelled FROM UserYearStats WHERE user_id IN ({placeholders})
+    ''', user_ids):
+        trips, days = years.get(row['year'], (0, 0))
+        years[row['year']] = (trips + row['trip_count'], days + row['days_travelled'])
+
+    if starter:
+        _subtract_overridden(conn, user_id, totals, years)
+
+    trips = totals['trip_count']
+    return {
+        'trips': trips,
+        'days': totals['days_travelled'],
+        'average_rating': totals['rating_sum'] / totals['rated_count'] if totals['rated_count'] else None,
+        'photos_per_trip': totals['photo_count'] / trips if trips else 0,
+        'entries_per_trip': totals['journal_count'] / trips if trips else 0,
+        'timeline': [(year, trips, days) for year, (trips, days) in sorted(years.items()) if trips > 0],
+    }
+
+
+# Take out the starter trips this user no longer sees
+def _subtract_overridden(conn, user_id, totals, years):
+    for row in conn.execute('''
+        SELECT substr(trip_start, 1, 4) AS year,
+               MAX(0, COALESCE(CAST(julianday(trip_end) - julianday(trip_start) AS INTEGER) + 1, 0)) AS days,
+               COALESCE(rating, 0) AS rating, journal_count, photo_count
+        FROM StarterOverrides
+        JOIN Trips ON Trips.trip_id = StarterOverrides.template_trip_id
+        JOIN TripStats ON TripStats.trip_id = Trips.trip_id
+        WHERE StarterOverrides.user_id = ?
+    ''', (user_id,)):
+        totals['trip_count'] -= 1
+        totals['days_travelled'] -= row['days']
+        totals['rating_sum'] -= row['rating']
+        totals['rated_count'] -= row['rating'] > 0
+        totals['journal_count'] -= row['journal_count']
+        totals['photo_count'] -= row['photo_count']
+        trips, days = years.get(row['year'], (0, 0))
+        years[row['year']] = (trips - 1, days - row['days'])
@@ -0,0 +1,115 @@
+import json
+
+from starter import has_starter_content, STARTER_USER_ID
+
+# ============================================================================
+# SYNC (CHANGES SINCE A TOKEN)
+# ============================================================================
+#
+# Replicas (the mobile app, another browser) keep a copy of a user's trips and
+# ask for what changed since their last sync:
+#
+#   GET /api/v1/sync?since=<token>
+#
+# Triggers keep SyncLog up to date (migration 11) - so every write counts,
+# whether it came from a route, a starter copy or an upload job - and each
+# change is numbered from one counter that only goes up. A sync reads the log
+# rows numbered after the token through the (user_id, version) index, then the
+# current values of the changed rows with one json_each() query per table, so
+# it costs O(changes) whatever the size of the account.
+#
+# The answer lists, per table, the rows inserted or updated (their current
+# values) and the ids deleted (tombstones). A trip tombstone also stands for
+# its journal entries and photos. since=0 (or no token) is a full sync.
+# At most SYNC_PAGE_SIZE changes come back at once: the client keeps calling
+# with the returned token while `more` is true.
+
+SYNC_PAGE_SIZE = 500
+
+# log entity -> (response key, table, id column)
+ENTITIES = {
+    'trip': ('trips', 'Trips', 'trip_id'),
+    'journal': ('journal', 'Journal', 'journal_id'),
+    'photo': ('photos', 'Album', 'photo_id'),
+}
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def parse_token(token):
+    if token is None or token == '':
+        return 0
+    if not token.isdigit():
+        raise InvalidToken(token)
+    return int(token)
+
+
+# Changed (entity, entity_id, version, deleted) for the user, oldest first.
+# Starter trips count until the user hides or copies them; from then on they
+# get a tombstone of their own (StarterOverrides.sync_version).
+def _log_rows(conn, user_id, since, limit):
+    full_sync = since == 0
+    if not has_starter_content(conn, user_id):
+        return conn.execute('''
+            SELECT entity, entity_id, version, deleted FROM SyncLog
+            WHERE user_id = ? AND version > ? AND NOT (deleted AND ?)
+            ORDER BY version LIMIT ?
+        ''', (user_id, since, full_sync, limit)).fetchall()
+
+    rows = conn.execute('''
+        SELECT entity, entity_id, version, deleted FROM (
+            SELECT entity, entity_id, version, deleted FROM SyncLog
+            WHERE user_id = ? AND version > ? AND NOT (deleted AND ?)
+            UNION ALL
+            SELECT entity, entity_id, version, deleted FROM SyncLog
+            WHERE user_id = ? AND version > ? AND NOT (deleted AND ?)
+              AND trip_id NOT IN (SELECT template_trip_id FROM StarterOverrides WHERE user_id = ?)
+            UNION ALL
+            SELECT 'trip', template_trip_id, sync_version, 1 FROM StarterOverrides
+            WHERE user_id = ? AND sync_version > ? AND NOT ?
+        )
+        ORDER BY version LIMIT ?
+    ''', (user_id, since, full_sync,
+          STARTER_USER_ID, since, full_sync, user_id,
+          user_id, since, full_sync, limit)).fetchall()
+    return rows
+
+
+# Current values of the changed rows (one query per table). The id always
+# comes back, whatever `fields` asks for - the client needs it to apply the row.
+def _current_rows(conn, table, id_column, ids, fields):
+    fields = list(dict.fromkeys((id_column, *fields)))
+    columns = ', '.join(f'{table}.{column}' for column in fields)
+    rows = conn.execute(f'''
+        SELECT {columns}
+        FROM json_each(?) AS ids
+        JOIN {table} ON {table}.{id_column} = ids.value
+    ''', (json.dumps(ids),)).fetchall()
+    return {row[id_column]: {field: row[field] for field in fields} for row in rows}
+
+
+# {'trips': {'upserted': [...], 'deleted': [...]}, 'journal': ..., 'photos': ...,
+#  'next': token, 'more': bool}. `fields` maps each response key to its columns.
+def changes_since(conn, user_id, since, fields, limit=SYNC_PAGE_SIZE):
+    log = _log_rows(conn, user_id, since, limit + 1)
+    more = len(log) > limit
+    log = log[:limit]
+
+    changed = {entity: [] for entity in ENTITIES}
+    deleted = {entity: [] for entity in ENTITIES}
+    for row in log:
+        (deleted if row['deleted'] else changed)[row['entity']].append(row['entity_id'])
+
+    result = {}
+    for entity, (key, table, id_column) in ENTITIES.items():
+        current = _current_rows(conn, table, id_column, changed[entity], fields[key]) if changed[entity] else {}
+        # Gone since it was logged (its trip was deleted): nothing to send
+        result[key] = {
+            'upserted': [current[entity_id] for entity_id in changed[entity] if entity_id in current],
+            'deleted': deleted[entity],
+        }
+    result['next'] = str(log[-1]['version'] if log else since)
+    result['more'] = more
+    return result
@@ -0,0 +1,237 @@
+// ============================================================================
+// TRIPTROVE SERVICE WORKER (rendered by app.py's /sw.js route)
+// ============================================================================
+//
+// - The app shell (CSS bundle, scripts, offline page) is precached per build.
+// - The home, trip, journal and album pages are network-first: each visit
+//   fetches the page (so it's never older than the last write, online or
+//   via a GET link like delete) and keeps a copy, which is shown only when
+//   the network can't be reached. The copies are dropped on logout.
+// - New journal entries and photo uploads that fail because we're offline
+//   are saved in IndexedDB and sent again by Background Sync (or when a page
+//   sees the connection come back). Each one carries an idempotency key, so
+//   a send that did reach the server before the connection dropped isn't
+//   stored twice.
+
+const VERSION = {{ version|tojson }};
+const SHELL_CACHE = 'triptrove-shell-' + VERSION;
+const PAGE_CACHE = 'triptrove-pages';
+const PRECACHE = {{ precache|tojson }};
+const OFFLINE_URL = {{ url_for('offline')|tojson }};
+const SYNC_TAG = 'triptrove-outbox';
+
+const PAGE_ROUTES = [/^\/$/, /^\/trip\/\d+$/, /^\/journal\/\d+$/, /^\/album\/\d+$/];
+const QUEUED_ROUTES = [/^\/journal\/\d+$/, /^\/journal\/add\/\d+$/, /^\/album\/\d+\/upload$/];
+const SIGNED_OUT_ROUTES = [/^\/logout$/, /^\/login$/, /^\/register$/];
+
+function matches(routes, path) {
+    return routes.some(function(route) { return route.test(path); });
+}
+
+
+// ============================================================================
+// INSTALL / ACTIVATE
+// ============================================================================
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(function(cache) { return cache.addAll(PRECACHE); })
+            .then(function() { return self.skipWaiting(); })
+    );
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(
+        caches.keys()
+            .then(function(names) {
+                return Promise.all(names
+                    .filter(function(name) { return name.startsWith('triptrove-shell-') && name !== SHELL_CACHE; })
+                    .map(function(name) { return caches.delete(name); }));
+            })
+            .then(function() { return self.clients.claim(); })
+            .then(function() { return flushOutbox().catch(function() {}); })
+    );
+});
+
+
+// ============================================================================
+// FETCH
+// ============================================================================
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== location.origin) {
+        return;
+    }
+
+    if (request.method === 'POST' && matches(QUEUED_ROUTES, url.pathname)) {
+        event.respondWith(sendOrQueue(request));
+    } else if (request.method !== 'GET') {
+        return;
+    } else if (matches(SIGNED_OUT_ROUTES, url.pathname)) {
+        // Someone else may sign in next: forget this user's pages
+        event.respondWith(caches.delete(PAGE_CACHE).then(function() { return fetch(request); }));
+    } else if (matches(PAGE_ROUTES, url.pathname)) {
+        event.respondWith(networkFirst(request));
+    } else {
+        event.respondWith(
+            caches.match(request, {ignoreSearch: url.pathname === OFFLINE_URL}).then(function(cached) {
+                return cached || fetch(request).catch(function() {
+                    return request.mode === 'navigate' ? caches.match(OFFLINE_URL) : Response.error();
+                });
+            })
+        );
+    }
+});
+
+function networkFirst(request) {
+    return caches.open(PAGE_CACHE).then(function(cache) {
+        return fetch(request).then(function(response) {
+            if (response.ok && !response.redirected) {
+                return cache.put(request, response.clone()).then(function() { return response; });
+            }
+            if (response.redirected) {
+                return cache.delete(request).then(function() { return response; });  // signed out
+            }
+            return response;
+        }, function() {
+            // Offline: the last copy, if there is one
+            return cache.match(request, {ignoreVary: true}).then(function(cached) {
+                return cached || caches.match(OFFLINE_URL);
+            });
+        });
+    });
+}
+
+
+// ============================================================================
+// OFFLINE QUEUE (IndexedDB "outbox")
+// ============================================================================
+
+function openOutbox() {
+    return new Promise(function(resolve, reject) {
+        const open = indexedDB.open('triptrove', 1);
+        open.onupgradeneeded = function() {
+            open.result.createObjectStore('outbox', {keyPath: 'id', autoIncrement: true});
+        };
+        open.onsuccess = function() { resolve(open.result); };
+        open.onerror = function() { reject(open.error); };
+    });
+}
+
+function outbox(mode, work) {
+    return openOutbox().then(function(db) {
+        return new Promise(function(resolve, reject) {
+            const transaction = db.transaction('outbox', mode);
+            const result = work(transaction.objectStore('outbox'));
+            transaction.oncomplete = function() { db.close(); resolve(result.result); };
+            transaction.onerror = function() { db.close(); reject(transaction.error); };
+        });
+    });
+}
+
+function newKey() {
+    return self.crypto && crypto.randomUUID ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+
+// Send a write now, or save it for later if we're offline
+function sendOrQueue(request) {
+    const saved = request.clone();
+    return fetch(request).catch(function() {
+        return queue(saved).then(function() { return savedOffline(saved); });
+    });
+}
+
+function queue(request) {
+    const url = new URL(request.url);
+    if (!url.searchParams.has('idempotency_key')) {
+        url.searchParams.set('idempotency_key', newKey());  // the page didn't add one
+    }
+    return request.arrayBuffer()
+        .then(function(body) {
+            return outbox('readwrite', function(store) {
+                return store.add({
+                    url: url.toString(),
+                    body: body,
+                    contentType: request.headers.get('Content-Type'),
+                    accept: request.headers.get('Accept'),
+                    queuedAt: Date.now(),
+                });
+            });
+        })
+        .then(function() {
+            // No Background Sync (Firefox, Safari): pages ask us to flush when they go online
+            return self.registration.sync ? self.registration.sync.register(SYNC_TAG).catch(function() {}) : null;
+        });
+}
+
+// What the page gets back for a queued write
+function savedOffline(request) {
+    if ((request.headers.get('Accept') || '').includes('application/json')) {
+        return new Response(JSON.stringify({offline: true, files: []}), {headers: {'Content-Type': 'application/json'}});
+    }
+    return Response.redirect(OFFLINE_URL + '?queued=1', 303);
+}
+
+// Send everything queued, oldest first. Rejects (so Background Sync tries
+// again later) if something couldn't be sent yet.
+let flushing = null;
+
+function flushOutbox() {
+    if (!flushing) {
+        flushing = sendQueued().finally(function() { flushing = null; });
+    }
+    return flushing;
+}
+
+function sendQueued() {
+    let sent = 0;
+    return outbox('readonly', function(store) { return store.getAll(); })
+        .then(function(items) {
+            return items.reduce(function(previous, item) {
+                return previous.then(function() { return sendQueuedItem(item); }).then(function() { sent += 1; });
+            }, Promise.resolve());
+        })
+        .finally(function() {
+            if (sent) {
+                return caches.delete(PAGE_CACHE).then(function() { return notifyPages(sent); });
+            }
+        });
+}
+
+function sendQueuedItem(item) {
+    const headers = {'Accept': item.accept || '*/*'};
+    if (item.contentType) {
+        headers['Content-Type'] = item.contentType;
+    }
+    return fetch(item.url, {method: 'POST', body: item.body, headers: headers, credentials: 'same-origin'})
+        .then(function(response) {
+            const signedOut = response.redirected && new URL(response.url).pathname === '/login';
+            if (signedOut || response.status === 409 || response.status === 429 || response.status >= 500) {
+                throw new Error('Not sent yet (' + response.status + ')');  // keep it for next time
+            }
+            // Sent (or refused for good, e.g. the trip was deleted): either way it's done
+            return outbox('readwrite', function(store) { return store.delete(item.id); });
+        });
+}
+
+function notifyPages(count) {
+    return self.clients.matchAll({type: 'window'}).then(function(pages) {
+        pages.forEach(function(page) { page.postMessage({type: 'outbox-sent', count: count}); });
+    });
+}
+
+self.addEventListener('sync', function(event) {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(flushOutbox());
+    }
+});
+
+self.addEventListener('message', function(event) {
+    if (event.data === 'flush-outbox') {
+        event.waitUntil(flushOutbox().catch(function() {}));
+    }
+});
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timezone
+
+from starter import STARTER_USER_ID, has_starter_content, is_visible
+
+# ============================================================================
+# VERSION TOKENS FOR CONDITIONAL GET
+# ============================================================================
+#
+# Each read route can describe "what it would render" with a couple of
+# integers from TripVersions / UserVersions (migration 7, bumped by triggers
+# on every write). The route decorator in app.py turns them into an ETag and
+# Last-Modified, and answers a matching If-None-Match / If-Modified-Since
+# with 304 before the page queries or template run.
+#
+# Each function returns (etag, last_modified or None), or None when the
+# route should just run (e.g. it is about to answer 404).
+
+
+# Newest mtime of the code / templates (unix time). Mixed into every token so
+# a deploy doesn't leave browsers treating old-template pages as current.
+def build_time(*paths):
+    newest = 0
+    for path in paths:
+        if os.path.isfile(path):
+            newest = max(newest, os.path.getmtime(path))
+        for folder, _, files in os.walk(path):
+            for name in files:
+                newest = max(newest, os.path.getmtime(os.path.join(folder, name)))
+    return int(newest)
+
+
+def _last_modified(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else None
+
+
+# Home page (and its infinite-scroll pages): the user's own trips, plus the
+# starter trips if they share them
+def home_version(conn, user_id):
+    user_ids = [user_id]
+    if has_starter_content(conn, user_id):
+        user_ids.append(STARTER_USER_ID)
+    rows = {row['user_id']: row for row in conn.execute(
+        f'SELECT user_id, version, modified_at FROM UserVersions WHERE user_id IN ({",".join("?" * len(user_ids))})',
+        user_ids)}
+
+    versions = [rows[uid]['version'] if uid in rows else 0 for uid in user_ids]
+    modified = [rows[uid]['modified_at'] for uid in user_ids if uid in rows]
+    etag = f'home-{user_id}-' + '.'.join(str(v) for v in versions)
+    return etag, _last_modified(max(modified) if modified else None)
+
+
+# Trip, journal and album pages: one trip and everything on it
+def trip_version(conn, user_id, trip_id):
+    trip = conn.execute('''
+        SELECT Trips.trip_id, Trips.user_id, TripVersions.version, TripVersions.modified_at
+        FROM Trips LEFT JOIN TripVersions ON TripVersions.trip_id = Trips.trip_id
+        WHERE Trips.trip_id = ?
+    ''', (trip_id,)).fetchone()
+    if trip is None or not is_visible(conn, trip, user_id):
+        return None
+    return f'trip-{trip_id}-{user_id}-{trip["version"] or 0}', _last_modified(trip['modified_at'])
+
+
+# Mix the build into a token: (etag, last_modified) ready for the response
+def stamp(token, build):
+    etag, last_modified = token
+    built_at = _last_modified(build)
+    return f'{etag}-{build:x}', max(last_modified, built_at) if last_modified else built_at